@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+
+"""
+Copyright (c) 2022, Ian Santopietro
+All rights reserved.
+
+This file is part of RepoLib.
+
+RepoLib is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RepoLib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
+
+Reports the memory used per loaded source, with and without shared field 
+values. Run from the repository root with:
+
+    PYTHONPATH=src python3 benchmarks/bench_memory.py [FILES] [STANZAS]
+"""
+
+import gc
+import sys
+import tracemalloc
+
+import repolib
+from repolib import util, system
+
+SUITES = ['jammy', 'jammy-updates', 'jammy-security', 'jammy-backports']
+COMPONENTS = 'main restricted universe multiverse'
+ARCHES = 'amd64 i386'
+URIS = [
+    'http://archive.ubuntu.com/ubuntu',
+    'http://security.ubuntu.com/ubuntu',
+    'http://apt.pop-os.org/release',
+]
+
+def write_sources(files:int, stanzas:int) -> None:
+    """Write a directory of generated DEB822 sources."""
+    util.SOURCES_DIR.mkdir(parents=True, exist_ok=True)
+    for file_num in range(files):
+        output:str = ''
+        for stanza in range(stanzas):
+            output += (
+                f'X-Repolib-Name: Bench {file_num} {stanza}\n'
+                f'X-Repolib-ID: bench-{file_num}-{stanza}\n'
+                'Enabled: yes\n'
+                'Types: deb deb-src\n'
+                f'URIs: {URIS[stanza % len(URIS)]}\n'
+                f'Suites: {" ".join(SUITES)}\n'
+                f'Components: {COMPONENTS}\n'
+                f'Architectures: {ARCHES}\n'
+                '\n'
+            )
+        sources_file = util.SOURCES_DIR / f'bench-{file_num}.sources'
+        sources_file.write_text(output)
+
+def measure(intern:bool) -> float:
+    """Load all sources and return the traced bytes per source."""
+    util.INTERN_VALUES = intern
+    util.sources.clear()
+    util.files.clear()
+    gc.collect()
+
+    tracemalloc.start()
+    system.load_all_sources()
+    for source in util.sources.values():
+        # Touch the list properties, as a UI would
+        source.uris, source.suites, source.components
+    gc.collect()
+    used, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return used / max(len(util.sources), 1)
+
+def main() -> None:
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    stanzas = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    repolib.set_testing()
+    write_sources(files, stanzas)
+
+    before = measure(intern=False)
+    after = measure(intern=True)
+    print(f'Sources loaded:       {len(util.sources)}')
+    print(f'Bytes/source before:  {before:.0f}')
+    print(f'Bytes/source after:   {after:.0f}')
+    print(f'Saved:                {(1 - after / before) * 100:.1f}%')
+
+if __name__ == '__main__':
+    main()
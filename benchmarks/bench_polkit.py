@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+
+"""
+Copyright (c) 2022, Ian Santopietro
+All rights reserved.
+
+This file is part of RepoLib.
+
+RepoLib is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RepoLib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
+
+Measures authorization checks in the DBus service against a stand-in polkit
+authority with a fixed latency, with and without the authorization cache. The
+service is loaded with the stand-in dbus and gi modules from the unit tests, 
+so neither needs to be installed. Run from the repository root with:
+
+    PYTHONPATH=src python3 benchmarks/bench_polkit.py [CALLS] [LATENCY_MS]
+"""
+
+import importlib.util
+import os
+import sys
+import time
+
+from pathlib import Path
+from unittest import mock
+
+from repolib.unittest.test_service import stand_in_modules
+
+SERVICE_PATH = Path(__file__).parent.parent / 'data' / 'service.py'
+PRIVILEGE = 'org.pop_os.repolib.modifysources'
+
+class StandInBus:
+    """Answers GetConnectionUnixProcessID with this process's pid."""
+
+    def __init__(self, latency:float) -> None:
+        self.latency = latency
+        self.calls = 0
+
+    def GetConnectionUnixProcessID(self, sender):
+        self.calls += 1
+        time.sleep(self.latency)
+        return os.getpid()
+
+class StandInPolkit:
+    """Authorizes every request after a fixed delay."""
+
+    def __init__(self, latency:float) -> None:
+        self.latency = latency
+        self.calls = 0
+
+    def CheckAuthorization(self, subject, action, details, flags, cancel_id, timeout=None):
+        self.calls += 1
+        time.sleep(self.latency)
+        return (True, False, {})
+
+def load_service():
+    """Import data/service.py as a module, without dbus or gi."""
+    with mock.patch.dict(sys.modules, stand_in_modules()):
+        spec = importlib.util.spec_from_file_location(
+            'repolib_service', SERVICE_PATH
+        )
+        service = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(service)
+    return service
+
+def run(service, calls:int, latency:float, ttl:float) -> None:
+    """Time a burst of authorization checks from a single client."""
+    repo = service.Repo()
+    repo.auth_cache_ttl = ttl
+    repo.dbus_info = StandInBus(latency)
+    repo.polkit = StandInPolkit(latency)
+
+    start = time.perf_counter()
+    for _ in range(calls):
+        repo._check_polkit_privilege(':1.42', object(), PRIVILEGE)
+    elapsed = time.perf_counter() - start
+
+    print(
+        f'ttl {ttl:>5.1f}s  {calls} calls  {elapsed * 1000:8.1f} ms  '
+        f'polkit calls {repo.polkit.calls}  pid lookups {repo.dbus_info.calls}'
+    )
+
+def main() -> None:
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.005
+
+    service = load_service()
+    run(service, calls, latency, 0)
+    run(service, calls, latency, service.AUTH_CACHE_TTL or 10)
+
+if __name__ == '__main__':
+    main()
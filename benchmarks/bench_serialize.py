@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+
+"""
+Copyright (c) 2022, Ian Santopietro
+All rights reserved.
+
+This file is part of RepoLib.
+
+RepoLib is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RepoLib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
+
+Compares registry serialization with pickle and JSON. Run from the repository
+root with:
+
+    PYTHONPATH=src python3 benchmarks/bench_serialize.py [FILES] [STANZAS]
+"""
+
+import json
+import pickle
+import sys
+import timeit
+
+import repolib
+from repolib import util, system
+
+from bench_memory import write_sources
+
+ROUNDS = 20
+
+def to_json() -> bytes:
+    """Serialize the registry as JSON field dictionaries."""
+    data = {}
+    for name, sourcefile in util.files.items():
+        data[name] = [dict(source) for source in sourcefile.sources]
+    return json.dumps(data).encode()
+
+def from_json(data:bytes) -> None:
+    """Load a registry serialized by to_json()."""
+    for name, sources in json.loads(data).items():
+        sourcefile = repolib.SourceFile()
+        sourcefile.name = name
+        for fields in sources:
+            source = repolib.Source()
+            source.update(fields)
+            sourcefile.add_source(source)
+
+def report(name:str, dump, load) -> None:
+    """Print the size and timings for one serializer."""
+    try:
+        data = dump()
+    except Exception as err:
+        print(f'{name:<10} failed: {err}')
+        return
+    dump_time = timeit.timeit(dump, number=ROUNDS) / ROUNDS
+    load_time = timeit.timeit(lambda: load(data), number=ROUNDS) / ROUNDS
+    print(
+        f'{name:<10} {len(data):>10} bytes  '
+        f'dump {dump_time * 1000:8.2f} ms  load {load_time * 1000:8.2f} ms'
+    )
+
+def main() -> None:
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    stanzas = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    repolib.set_testing()
+    write_sources(files, stanzas)
+    system.load_all_sources()
+    print(f'Sources loaded: {len(util.sources)}')
+
+    report('repolib', system.registry_to_bytes, system.registry_from_bytes)
+    report('pickle', lambda: pickle.dumps(util.files), pickle.loads)
+    report('json', to_json, from_json)
+
+if __name__ == '__main__':
+    main()
@@ -19,11 +19,12 @@
 '''
 #pylint: skip-file
 
-import shutil
+import os
 import subprocess
+import threading
 
 import gi
-from gi.repository import GObject, GLib
+from gi.repository import GObject, GLib, Gio
 
 from pathlib import Path
 import dbus
@@ -33,6 +34,16 @@ import time
 
 import repolib
 
+# Seconds for which a successful authorization is reused for the same client.
+# Set to 0 to check with polkit on every call.
+AUTH_CACHE_TTL = float(os.environ.get('REPOLIB_AUTH_CACHE_TTL', 10))
+
+# Milliseconds to wait for more file changes before reloading the sources
+CHANGE_DELAY = 250
+
+# Source fields which modify_source can change
+MODIFY_FIELDS = ('name', 'enabled', 'uris', 'suites', 'components')
+
 class RepolibException(dbus.DBusException):
     _dbus_error_name = 'org.pop_os.repolib.RepolibException'
 
@@ -51,14 +62,39 @@ class Repo(dbus.service.Object):
         self.polkit = None
         self.enforce_polkit = True
 
-        try:
-            self.system_repo = repolib.SystemSource()
-        except:
-            self.system_repo = None
+        # Cached authorizations, by (sender, pid, start time, privilege), and
+        # the pid of each sender. Both are dropped when the sender disconnects.
+        self.auth_cache = {}
+        self.auth_cache_ttl = AUTH_CACHE_TTL
+        self.sender_pids = {}
+        if conn is not None:
+            conn.add_signal_receiver(
+                self._on_name_owner_changed,
+                signal_name='NameOwnerChanged',
+                dbus_interface='org.freedesktop.DBus',
+                bus_name='org.freedesktop.DBus'
+            )
+
+        # The system source, kept until its file changes on disk
+        self.system_file = None
+        self.system_mtime = None
         
         self.source = None
         self.sources_dir = Path('/etc/apt/sources.list.d')
         self.keys_dir = Path('/etc/apt/trusted.gpg.d')
+
+        # Parsed sources, kept until the files on disk change
+        self.registry_stamp = None
+        self.registry_data = None
+
+        # Watch for changes made outside the service
+        self.monitor = None
+        self.change_timeout = None
+        if conn is not None:
+            self.monitor = Gio.File.new_for_path(
+                str(self.sources_dir)
+            ).monitor_directory(Gio.FileMonitorFlags.NONE, None)
+            self.monitor.connect('changed', self._on_sources_dir_changed)
     
     @dbus.service.method(
         "org.pop_os.repolib.Interface",
@@ -86,7 +122,7 @@ class Repo(dbus.service.Object):
         self._check_polkit_privilege(
             sender, conn, 'org.pop_os.repolib.modifysources'
         )
-        shutil.copy2(src, dest)
+        self._apply_changes([(repolib.changeset.WRITE_KEY, dest, src)])
     
     @dbus.service.method(
         "org.pop_os.repolib.Interface",
@@ -97,8 +133,7 @@ class Repo(dbus.service.Object):
         self._check_polkit_privilege(
             sender, conn, 'org.pop_os.repolib.modifysources'
         )
-        key_path = Path(src)
-        key_path.unlink()
+        self._apply_changes([(repolib.changeset.DELETE_KEY, src, '')])
     
     @dbus.service.method(
         "org.pop_os.repolib.Interface",
@@ -109,8 +144,7 @@ class Repo(dbus.service.Object):
         self._check_polkit_privilege(
             sender, conn, 'org.pop_os.repolib.modifysources'
         )
-        prefs_path = Path(src)
-        prefs_path.unlink()
+        self._apply_changes([(repolib.changeset.DELETE_PREFS, src, '')])
     
     @dbus.service.method(
         "org.pop_os.repolib.Interface",
@@ -121,9 +155,7 @@ class Repo(dbus.service.Object):
         self._check_polkit_privilege(
             sender, conn, 'org.pop_os.repolib.modifysources'
         )
-        full_path = Path(path)
-        with open(full_path, mode='w') as output_file:
-            output_file.write(contents)
+        self._apply_changes([(repolib.changeset.WRITE_PREFS, path, contents)])
     
     @dbus.service.method(
         "org.pop_os.repolib.Interface",
@@ -134,9 +166,9 @@ class Repo(dbus.service.Object):
         self._check_polkit_privilege(
             sender, conn, 'org.pop_os.repolib.modifysources'
         )
-        full_path = self.sources_dir / filename
-        with open(full_path, mode='w') as output_file:
-            output_file.write(source)
+        self._apply_changes(
+            [(repolib.changeset.WRITE_SOURCE, filename, source)]
+        )
     
     @dbus.service.method(
         "org.pop_os.repolib.Interface",
@@ -147,10 +179,9 @@ class Repo(dbus.service.Object):
         self._check_polkit_privilege(
             sender, conn, 'org.pop_os.repolib.modifysources'
         )
-        alt_path = self.sources_dir / alt_file
-        save_path = self.sources_dir / save_file
-        if alt_path.exists():
-            alt_path.rename(save_path)
+        self._apply_changes(
+            [(repolib.changeset.BACKUP_SOURCE, alt_file, save_file)]
+        )
 
     @dbus.service.method(
         "org.pop_os.repolib.Interface",
@@ -161,8 +192,264 @@ class Repo(dbus.service.Object):
         self._check_polkit_privilege(
             sender, conn, 'org.pop_os.repolib.modifysources'
         )
-        source_file = self.sources_dir / filename
-        source_file.unlink()
+        self._apply_changes([(repolib.changeset.DELETE_SOURCE, filename, '')])
+
+    @dbus.service.method(
+        "org.pop_os.repolib.Interface",
+        in_signature='a(sss)', out_signature='',
+        sender_keyword='sender', connection_keyword='conn'
+    )
+    def apply_changes(self, changes, sender=None, conn=None):
+        """ Apply a whole set of changes with a single authorization.
+
+        The changes are applied as a unit; if any of them fails, the ones
+        already applied are rolled back. Targets outside of the directories
+        RepoLib manages are refused.
+
+        Arguments:
+            changes (list): (action, target, data) tuples, as recorded by a
+                repolib.ChangeSet
+        """
+        self._check_polkit_privilege(
+            sender, conn, 'org.pop_os.repolib.modifysources'
+        )
+        self._apply_changes(changes)
+
+    @dbus.service.method(
+        "org.pop_os.repolib.Interface",
+        in_signature='', out_signature='ay',
+        sender_keyword='sender', connection_keyword='conn'
+    )
+    def get_registry(self, sender=None, conn=None):
+        """ Get all of the configured sources, already parsed.
+
+        Returns:
+            The sources, serialized with repolib.registry_to_bytes()
+        """
+        self._check_for_changes()
+        if self.registry_data is None:
+            self.registry_data = repolib.registry_to_bytes()
+        return dbus.ByteArray(self.registry_data)
+
+    @dbus.service.method(
+        "org.pop_os.repolib.Interface",
+        in_signature='', out_signature='a(ss)',
+        sender_keyword='sender', connection_keyword='conn'
+    )
+    def list_sources(self, sender=None, conn=None):
+        """ List the configured sources.
+
+        Returns:
+            The (ident, name) of each source
+        """
+        self._check_for_changes()
+        return [
+            (ident, source.name) for ident, source in repolib.sources.items()
+        ]
+
+    @dbus.service.method(
+        "org.pop_os.repolib.Interface",
+        in_signature='s', out_signature='s',
+        sender_keyword='sender', connection_keyword='conn'
+    )
+    def show_source(self, ident, sender=None, conn=None):
+        """ Get the details of a source, as shown by apt-manage list.
+
+        Arguments:
+            ident (str): The ident of the source
+        """
+        self._check_for_changes()
+        return self._get_source(ident).ui
+
+    @dbus.service.method(
+        "org.pop_os.repolib.Interface",
+        in_signature='sa{ss}', out_signature='s',
+        sender_keyword='sender', connection_keyword='conn'
+    )
+    def modify_source(self, ident, fields, sender=None, conn=None):
+        """ Change the settings of a source and save it.
+
+        Arguments:
+            ident (str): The ident of the source
+            fields (dict): The new values, by field. List fields (uris, 
+                suites, components) are space-separated.
+        
+        Returns:
+            The details of the modified source
+        """
+        self._check_polkit_privilege(
+            sender, conn, 'org.pop_os.repolib.modifysources'
+        )
+        self._check_for_changes()
+        source = self._get_source(ident)
+        changes = {}
+        for field, value in fields.items():
+            field = str(field)
+            value = str(value)
+            if field not in MODIFY_FIELDS:
+                raise RepolibException(f'The field {field} cannot be modified')
+            if field in ('uris', 'suites', 'components'):
+                value = value.split()
+            changes[field] = value
+        for field, value in changes.items():
+            setattr(source, field, value)
+        self._save_file(source.file)
+        return source.ui
+
+    @dbus.service.method(
+        "org.pop_os.repolib.Interface",
+        in_signature='s', out_signature='s',
+        sender_keyword='sender', connection_keyword='conn',
+        async_callbacks=('reply_handler', 'error_handler')
+    )
+    def add_source(
+        self, line, sender=None, conn=None, reply_handler=None, 
+        error_handler=None
+    ):
+        """ Add a new source from a deb line or shortcut and save it.
+
+        Shortcuts may need to fetch details and keys from the network, so the
+        line is loaded in a thread and the reply is sent once it finishes.
+
+        Arguments:
+            line (str): The deb line or shortcut, e.g. ppa:user/repo
+        
+        Returns:
+            The ident of the new source
+        """
+        self._check_polkit_privilege(
+            sender, conn, 'org.pop_os.repolib.modifysources'
+        )
+        line = str(line)
+        new_source = None
+        for prefix in repolib.shortcut_prefixes:
+            if line.startswith(prefix):
+                new_source = repolib.shortcut_prefixes[prefix]()
+                break
+        if new_source is None or not new_source.validator(line):
+            raise RepolibException(f'Could not parse line {line}')
+        
+        def load_source():
+            try:
+                new_source.load_from_data([line])
+            except Exception as err:
+                GLib.idle_add(error_handler, RepolibException(str(err)))
+                return
+            GLib.idle_add(
+                self._finish_add_source, new_source, reply_handler, 
+                error_handler
+            )
+        
+        threading.Thread(target=load_source, daemon=True).start()
+
+    def _finish_add_source(self, new_source, reply_handler, error_handler):
+        """ Save a source loaded by add_source, back on the main loop."""
+        try:
+            self._check_for_changes()
+            new_source.twin_source = True
+            if not new_source.ident:
+                new_source.ident = new_source.generate_default_ident()
+
+            # Shortcuts manage their own files, other sources mustn't replace
+            # an existing source or file
+            if type(new_source) is repolib.Source:
+                new_source.ident = repolib.system.allocate_ident(
+                    new_source.ident
+                )
+            elif new_source.file is not None:
+                # Drop the file the shortcut registered while loading
+                path = str(new_source.file.path)
+                if repolib.files.get(path) is new_source.file:
+                    del repolib.files[path]
+
+            new_file = repolib.SourceFile(name=new_source.ident)
+            new_file.format = new_source.default_format
+            new_file.add_source(new_source)
+            new_source.file = new_file
+            self._save_file(new_file)
+        except RepolibException as err:
+            error_handler(err)
+            return False
+        repolib.files[new_file.path.name] = new_file
+        repolib.sources[new_source.ident] = new_source
+        reply_handler(new_source.ident)
+        return False
+
+    @dbus.service.method(
+        "org.pop_os.repolib.Interface",
+        in_signature='', out_signature='a(ssbasasasass)',
+        sender_keyword='sender', connection_keyword='conn'
+    )
+    def GetSources(self, sender=None, conn=None):
+        """ Get all of the configured sources.
+
+        Returns:
+            A struct for each source, see GetSource
+        """
+        self._check_for_changes()
+        return [Repo._source_struct(source) for source in repolib.sources.values()]
+
+    @dbus.service.method(
+        "org.pop_os.repolib.Interface",
+        in_signature='s', out_signature='(ssbasasasass)',
+        sender_keyword='sender', connection_keyword='conn'
+    )
+    def GetSource(self, ident, sender=None, conn=None):
+        """ Get a single source.
+
+        Arguments:
+            ident (str): The ident of the source
+
+        Returns:
+            (ident, name, enabled, types, uris, suites, components, signed_by,
+            file name)
+        """
+        self._check_for_changes()
+        return Repo._source_struct(self._get_source(ident))
+
+    @dbus.service.method(
+        "org.pop_os.repolib.Interface",
+        in_signature='', out_signature='a(sas)',
+        sender_keyword='sender', connection_keyword='conn'
+    )
+    def GetKeys(self, sender=None, conn=None):
+        """ Get the signing keys used by the configured sources.
+
+        Returns:
+            The keyring path and the idents of the sources using it, for each
+            key
+        """
+        self._check_for_changes()
+        keys = {}
+        for source in repolib.sources.values():
+            if source.signed_by:
+                keys.setdefault(source.signed_by, []).append(source.ident)
+        return [(path, idents) for path, idents in keys.items()]
+
+    @dbus.service.method(
+        "org.pop_os.repolib.Interface",
+        in_signature='', out_signature='a{ss}',
+        sender_keyword='sender', connection_keyword='conn'
+    )
+    def GetErrors(self, sender=None, conn=None):
+        """ Get the source files which could not be loaded.
+
+        Returns:
+            The error message for each file name
+        """
+        self._check_for_changes()
+        return {
+            str(name): str(err) for name, err in repolib.errors.items()
+        }
+
+    @dbus.service.signal("org.pop_os.repolib.Interface", signature='as')
+    def SourcesChanged(self, idents):
+        """ Emitted when sources are added, changed or removed.
+
+        Arguments:
+            idents (list): The idents of the affected sources
+        """
+        pass
 
     @dbus.service.method(
         "org.pop_os.repolib.Interface",
@@ -186,15 +473,14 @@ class Repo(dbus.service.Object):
         self._check_polkit_privilege(
             sender, conn, 'org.pop_os.repolib.modifysources'
         )
-        if self.system_repo:
-            self.system_repo.load_from_file()
-            new_types = [repolib.util.AptSourceType.BINARY]
-            if enabled:
-                new_types.append(repolib.util.AptSourceType.SOURCE)
-            self.system_repo.types = new_types
-            self.system_repo.save_to_disk()
-            return enabled
-        return False
+        system_source = self._get_system_source()
+        if not system_source:
+            return False
+        
+        if system_source.sourcecode_enabled != bool(enabled):
+            system_source.sourcecode_enabled = bool(enabled)
+            self._save_system_source()
+        return bool(enabled)
 
     @dbus.service.method(
         "org.pop_os.repolib.Interface",
@@ -211,12 +497,17 @@ class Repo(dbus.service.Object):
         self._check_polkit_privilege(
             sender, conn, 'org.pop_os.repolib.modifysources'
         )
-        if self.system_repo:
-            self.system_repo.load_from_file()
-            self.system_repo.set_component_enabled(component=comp, enabled=enable)
-            self.system_repo.save_to_disk()
-            return True
-        return False
+        system_source = self._get_system_source()
+        if not system_source:
+            return False
+        
+        components = Repo._set_item_enabled(
+            system_source.components, str(comp), enable
+        )
+        if components != system_source.components:
+            system_source.components = components
+            self._save_system_source()
+        return True
     
     @dbus.service.method(
         "org.pop_os.repolib.Interface",
@@ -233,13 +524,186 @@ class Repo(dbus.service.Object):
         self._check_polkit_privilege(
             sender, conn, 'org.pop_os.repolib.modifysources'
         )
-        if self.system_repo:
-            self.system_repo.load_from_file()
-            self.system_repo.set_suite_enabled(suite=suite, enabled=enable)
-            self.system_repo.save_to_disk()
-            return True
+        system_source = self._get_system_source()
+        if not system_source:
+            return False
+        
+        suites = Repo._set_item_enabled(system_source.suites, str(suite), enable)
+        if suites != system_source.suites:
+            system_source.suites = suites
+            self._save_system_source()
+        return True
+
+    def _refresh_registry(self):
+        """ Reload the sources if they changed on disk since they were loaded.
+
+        Returns:
+            The idents of any sources which were added, changed or removed. 
+            Nothing is reported for the first load, or for a reload which 
+            drops unsaved changes, since clients haven't seen the state 
+            before it.
+        """
+        stamp = repolib.system.get_sources_stamp()
+        if stamp == self.registry_stamp:
+            return []
+        
+        first_load = self.registry_stamp is None
+        before = {ident: str(source) for ident, source in repolib.sources.items()}
+        repolib.load_all_sources()
+        self.registry_stamp = stamp
+        self.registry_data = None
+        if first_load:
+            return []
+        after = {ident: str(source) for ident, source in repolib.sources.items()}
+        return sorted(
+            ident for ident in before.keys() | after.keys()
+            if before.get(ident) != after.get(ident)
+        )
+    
+    def _check_for_changes(self):
+        """ Reload the sources if needed and tell clients what changed.
+
+        Every method which reads the sources goes through here, so a change
+        noticed by a read is still signalled, even if the file monitor's 
+        delay hasn't passed yet.
+        """
+        changed = self._refresh_registry()
+        if changed:
+            self.SourcesChanged(changed)
+    
+    def _on_sources_dir_changed(self, monitor, file, other_file, event_type):
+        """ Wait for a burst of file changes to finish, then check them."""
+        if self.change_timeout is not None:
+            GLib.source_remove(self.change_timeout)
+        self.change_timeout = GLib.timeout_add(
+            CHANGE_DELAY, self._on_change_timeout
+        )
+    
+    def _on_change_timeout(self):
+        self.change_timeout = None
+        self._check_for_changes()
         return False
 
+    @staticmethod
+    def _source_struct(source):
+        """ Get the GetSource struct for a source."""
+        return (
+            source.ident,
+            source.name,
+            source.enabled == repolib.util.AptSourceEnabled.TRUE,
+            [sourcetype.value for sourcetype in source.types],
+            source.uris,
+            source.suites,
+            source.components,
+            source.signed_by,
+            source.file.path.name if source.file else '',
+        )
+
+    def _get_source(self, ident):
+        """ Get a loaded source, or raise an error for the client."""
+        try:
+            return repolib.sources[str(ident)]
+        except KeyError:
+            raise RepolibException(f'The source {ident} was not found')
+
+    def _apply_changes(self, changes):
+        """ Apply changes for a client, then tell clients what changed."""
+        changes = [
+            (str(action), str(target), str(data))
+            for action, target, data in changes
+        ]
+        try:
+            repolib.changeset.apply_changes(changes)
+        except (OSError, repolib.util.RepoError) as err:
+            raise RepolibException(str(err))
+        self._check_for_changes()
+
+    def _save_file(self, source_file):
+        """ Save a file changed by the service, keeping the registry warm."""
+        try:
+            source_file.save()
+        except (OSError, repolib.util.RepoError) as err:
+            # Drop any unsaved edits. Nothing changed on disk, so there's
+            # nothing to signal.
+            self.registry_stamp = None
+            self._refresh_registry()
+            raise RepolibException(str(err))
+        # The loaded sources already match what was written
+        self.registry_stamp = repolib.system.get_sources_stamp()
+        self.registry_data = None
+        self.SourcesChanged([source.ident for source in source_file.sources])
+
+    def _get_system_source(self):
+        """ Get the system source, parsing its file only if it changed."""
+        path = Path(repolib.util.SOURCES_DIR) / 'system.sources'
+        if not path.exists():
+            path = path.with_suffix('.list')
+        try:
+            mtime = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            self.system_file = None
+            return None
+        
+        if self.system_file is None or mtime != self.system_mtime:
+            try:
+                # Creating the SourceFile parses it
+                self.system_file = repolib.SourceFile(name='system')
+            except repolib.util.RepoError as err:
+                self.system_file = None
+                raise RepolibException(str(err))
+            self.system_mtime = mtime
+        
+        for source in self.system_file.sources:
+            if source.ident == 'system':
+                return source
+        if self.system_file.sources:
+            return self.system_file.sources[0]
+        return None
+    
+    def _save_system_source(self):
+        """ Write the cached system source and tell clients it changed.
+
+        The registry is updated from the cached file rather than reloaded. 
+        Its stamp is only moved on if nothing else changed since it was 
+        loaded, so other changes are still picked up by the next read.
+        """
+        registry_current = (
+            self.registry_stamp is not None
+            and repolib.system.get_sources_stamp() == self.registry_stamp
+        )
+        try:
+            self.system_file.save()
+        except (OSError, repolib.util.RepoError) as err:
+            self.system_file = None
+            raise RepolibException(str(err))
+        self.system_mtime = self.system_file.path.stat().st_mtime_ns
+
+        new_sources = {
+            source.ident: source for source in self.system_file.sources
+        }
+        if self.registry_stamp is not None:
+            old_file = repolib.files.get(self.system_file.path.name)
+            if old_file is not None:
+                for source in old_file.sources:
+                    if source.ident not in new_sources:
+                        repolib.sources.pop(source.ident, None)
+            repolib.files[self.system_file.path.name] = self.system_file
+            repolib.sources.update(new_sources)
+            self.registry_data = None
+        if registry_current:
+            self.registry_stamp = repolib.system.get_sources_stamp()
+        self.SourcesChanged(list(new_sources))
+    
+    @staticmethod
+    def _set_item_enabled(items, item, enabled):
+        """ Get a copy of a list with an item added or removed."""
+        items = list(items)
+        if enabled and item not in items:
+            items.append(item)
+        elif not enabled and item in items:
+            items.remove(item)
+        return items
+
     @classmethod
     def _log_in_file(klass, filename, string):
         date = time.asctime(time.localtime())
@@ -278,7 +742,17 @@ class Repo(dbus.service.Object):
         if self.dbus_info is None:
             self.dbus_info = dbus.Interface(conn.get_object('org.freedesktop.DBus',
                 '/org/freedesktop/DBus/Bus', False), 'org.freedesktop.DBus')
-        pid = self.dbus_info.GetConnectionUnixProcessID(sender)
+        pid = self.sender_pids.get(sender)
+        if pid is None:
+            pid = int(self.dbus_info.GetConnectionUnixProcessID(sender))
+            self.sender_pids[sender] = pid
+        start_time = Repo._get_start_time(pid)
+
+        # A process with the same pid and start time is the same process
+        cache_key = (sender, pid, start_time, privilege)
+        expiry = self.auth_cache.get(cache_key, 0)
+        if expiry > time.monotonic():
+            return
         
         # query PolicyKit
         if self.polkit is None:
@@ -290,7 +764,7 @@ class Repo(dbus.service.Object):
             # we don't need is_challenge return here, since we call with AllowUserInteraction
             (is_auth, _, details) = self.polkit.CheckAuthorization(
                     ('unix-process', {'pid': dbus.UInt32(pid, variant_level=1),
-                    'start-time': dbus.UInt64(0, variant_level=1)}), 
+                    'start-time': dbus.UInt64(start_time, variant_level=1)}), 
                     privilege, {'': ''}, dbus.UInt32(1), '', timeout=600)
         except dbus.DBusException as e:
             if e._dbus_error_name == 'org.freedesktop.DBus.Error.ServiceUnknown':
@@ -301,11 +775,40 @@ class Repo(dbus.service.Object):
                 raise
 
         if not is_auth:
+            self.auth_cache.pop(cache_key, None)
             Repo._log_in_file('/tmp/repolib.log','_check_polkit_privilege: sender %s on connection %s pid %i is not authorized for %s: %s' %
                     (sender, conn, pid, privilege, str(details)))
             raise PermissionDeniedByPolicy(privilege)
+        
+        if self.auth_cache_ttl > 0:
+            self.auth_cache[cache_key] = time.monotonic() + self.auth_cache_ttl
+
+    @classmethod
+    def _get_start_time(klass, pid):
+        """ Get the start time of a process, in clock ticks since boot.
+
+        Returns 0 if it can't be read, which polkit treats as unknown.
+        """
+        try:
+            with open(f'/proc/{pid}/stat') as stat_file:
+                stat = stat_file.read()
+            # The command name may contain spaces, so split after it
+            return int(stat.rsplit(')', 1)[1].split()[19])
+        except (OSError, IndexError, ValueError):
+            return 0
+
+    def _on_name_owner_changed(self, name, old_owner, new_owner):
+        """ Forget cached authorizations when a client disconnects."""
+        if new_owner or not name.startswith(':'):
+            return
+        self.sender_pids.pop(name, None)
+        for cache_key in list(self.auth_cache):
+            if cache_key[0] == name:
+                del self.auth_cache[cache_key]
 
 if __name__ == '__main__':
+    # The service writes files itself, it mustn't ask itself to write them
+    repolib.privileged.set_enabled(False)
     dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
     
     bus = dbus.SystemBus()
@@ -32,9 +32,17 @@ VERSION = __version__.__version__
 from .file import SourceFile, SourceFileError
 from .source import Source, SourceError
 from .shortcuts import PPASource, PopdevSource, shortcut_prefixes
-from .key import SourceKey, KeyFileError
+from .key import (
+    SourceKey, KeyFileError, load_many_key_data, find_identical_keyrings
+)
 from . import util
 from . import system
+from . import changeset
+from .serialize import SerializationError
+from .changeset import ChangeSet, ChangeSetError
+from .privileged import PrivilegedError
+from .httpclient import DownloadError
+from .asyncclient import AsyncClient
 
 LOG_FILE_PATH = '/var/log/repolib.log'
 LOG_LEVEL = logging.WARNING
@@ -142,3 +150,9 @@ options_outmap = util.options_outmap
 true_values = util.true_values
 
 load_all_sources = system.load_all_sources
+registry_to_bytes = system.registry_to_bytes
+registry_from_bytes = system.registry_from_bytes
+get_all_key_info = system.get_all_key_info
+consolidate_keyrings = system.consolidate_keyrings
+
+transaction = changeset.transaction
@@ -0,0 +1,237 @@
+#!/usr/bin/python3
+
+"""
+Copyright (c) 2022, Ian Santopietro
+All rights reserved.
+
+This file is part of RepoLib.
+
+RepoLib is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RepoLib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
+
+asyncio client for the privileged DBus service, for GUI frontends.
+
+By default each call runs in a worker thread, so it works with any asyncio
+event loop. Frontends which run asyncio on top of a GLib main loop, with
+dbus-python's GLib integration set as the default main loop, can pass
+`use_glib=True` to make the calls without any threads.
+"""
+
+import asyncio
+import functools
+import logging
+
+from . import changeset, privileged
+
+# Seconds to wait for the service. Calls may wait on a polkit prompt, so this
+# is long by default.
+DEFAULT_TIMEOUT = 600
+
+log = logging.getLogger(__name__)
+
+class AsyncClient:
+    """Makes calls to the privileged service as awaitables.
+
+    Independent calls can be run concurrently, e.g. with asyncio.gather().
+    Failures, including timeouts, raise :class:`PrivilegedError`.
+
+    Attributes:
+        timeout(float): The default timeout for calls, in seconds
+        use_glib(bool): Use dbus-python's asynchronous calls instead of threads
+    """
+
+    def __init__(self, timeout:float = DEFAULT_TIMEOUT, use_glib:bool = False) -> None:
+        self.timeout = timeout
+        self.use_glib = use_glib
+
+    async def call(self, method:str, *args, timeout:float = None, **kwargs):
+        """Call a method on the privileged service.
+
+        Arguments:
+            method(str): The name of the method to call
+            *args: The arguments to the method
+            timeout(float): Seconds to wait, instead of the default timeout
+            **kwargs: Keyword arguments for the proxy, e.g. `signature`
+
+        Returns:
+            The return value of the method
+        """
+        timeout = timeout or self.timeout
+        if self.use_glib:
+            future = self._call_glib(method, args, kwargs, timeout)
+        else:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(
+                None,
+                functools.partial(
+                    privileged.call, method, *args, timeout=timeout, **kwargs
+                )
+            )
+
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError as err:
+            raise privileged.PrivilegedError(
+                f'Privileged call {method} timed out after {timeout} seconds'
+            ) from err
+
+    def _call_glib(self, method:str, args:tuple, kwargs:dict, timeout:float):
+        """Start a call with reply handlers, returning a future for it."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def on_reply(*result):
+            if not future.done():
+                future.set_result(result[0] if len(result) == 1 else result or None)
+
+        def on_error(err):
+            if not future.done():
+                future.set_exception(privileged.wrap_error(method, err))
+
+        getattr(privileged.get_proxy(), method)(
+            *args,
+            reply_handler=lambda *result: loop.call_soon_threadsafe(on_reply, *result),
+            error_handler=lambda err: loop.call_soon_threadsafe(on_error, err),
+            timeout=timeout,
+            **kwargs
+        )
+        return future
+
+    async def commit(self, changes:changeset.ChangeSet) -> None:
+        """Apply a ChangeSet, using the service only if we need to.
+
+        Arguments:
+            changes(ChangeSet): The changes to apply
+        """
+        change_list = changes.get_changes()
+        if not change_list:
+            return
+
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, changeset.apply_changes, change_list)
+        except PermissionError:
+            log.info('Permission denied, trying the privileged service')
+            await self.apply_changes(change_list)
+        changes.run_callbacks()
+
+    async def apply_changes(self, changes:list, timeout:float = None) -> None:
+        """Apply a list of (action, target, data) changes with the service.
+
+        Arguments:
+            changes(list): The changes to apply
+        """
+        await self.call(
+            'apply_changes', changes, signature='a(sss)', timeout=timeout
+        )
+
+    async def write_source_file(self, filename:str, contents:str, timeout:float = None) -> None:
+        """Write a file in the sources directory.
+
+        Arguments:
+            filename(str): The name of the file within the sources directory
+            contents(str): The contents to write
+        """
+        await self.call('output_file_to_disk', filename, contents, timeout=timeout)
+
+    async def backup_source_file(self, filename:str, save_name:str, timeout:float = None) -> None:
+        """Rename a file in the sources directory out of the way.
+
+        Arguments:
+            filename(str): The name of the file to back up
+            save_name(str): The new name for the file
+        """
+        await self.call('backup_alt_file', filename, save_name, timeout=timeout)
+
+    async def delete_source_file(self, filename:str, timeout:float = None) -> None:
+        """Delete a file from the sources directory.
+
+        Arguments:
+            filename(str): The name of the file to delete
+        """
+        await self.call('delete_source_file', filename, timeout=timeout)
+
+    async def install_key(self, src:str, dest:str, timeout:float = None) -> None:
+        """Install a signing keyring.
+
+        Arguments:
+            src(str): The path of the keyring to install
+            dest(str): The path to install the keyring to
+        """
+        await self.call('install_signing_key', src, dest, timeout=timeout)
+
+    async def delete_key(self, path:str, timeout:float = None) -> None:
+        """Delete a signing keyring.
+
+        Arguments:
+            path(str): The path of the keyring to delete
+        """
+        await self.call('delete_signing_key', path, timeout=timeout)
+
+    async def write_prefs(self, path:str, contents:str, timeout:float = None) -> None:
+        """Write an apt preferences file.
+
+        Arguments:
+            path(str): The path of the prefs file
+            contents(str): The contents to write
+        """
+        await self.call('output_prefs_to_disk', path, contents, timeout=timeout)
+
+    async def delete_prefs(self, path:str, timeout:float = None) -> None:
+        """Delete an apt preferences file.
+
+        Arguments:
+            path(str): The path of the prefs file
+        """
+        await self.call('delete_prefs_file', path, timeout=timeout)
+
+    async def set_system_source_code_enabled(self, enabled:bool, timeout:float = None) -> bool:
+        """Enable or disable source code in the system source.
+
+        Arguments:
+            enabled(bool): The new state to set, True = Enabled.
+
+        Returns: bool
+            The service's result
+        """
+        return bool(await self.call(
+            'set_system_source_code_enabled', enabled, timeout=timeout
+        ))
+
+    async def set_system_comp_enabled(self, comp:str, enabled:bool, timeout:float = None) -> bool:
+        """Enable or disable a component in the system source.
+
+        Arguments:
+            comp(str): The component to set
+            enabled(bool): The new state to set, True = Enabled.
+
+        Returns: bool
+            The service's result
+        """
+        return bool(await self.call(
+            'set_system_comp_enabled', comp, enabled, timeout=timeout
+        ))
+
+    async def set_system_suite_enabled(self, suite:str, enabled:bool, timeout:float = None) -> bool:
+        """Enable or disable a suite in the system source.
+
+        Arguments:
+            suite(str): The suite to set
+            enabled(bool): The new state to set, True = Enabled.
+
+        Returns: bool
+            The service's result
+        """
+        return bool(await self.call(
+            'set_system_suite_enabled', suite, enabled, timeout=timeout
+        ))
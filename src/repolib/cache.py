@@ -0,0 +1,244 @@
+#!/usr/bin/python3
+
+"""
+Copyright (c) 2022, Ian Santopietro
+All rights reserved.
+
+This file is part of RepoLib.
+
+RepoLib is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RepoLib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
+
+On-disk caches shared by the library, apt-manage and the DBus service.
+
+Entries are stored under util.CACHE_DIR, named by the SHA-256 hash of the
+data they describe, so a changed keyring is simply a cache miss. Downloaded
+keys are stored by their own hash and indexed by URL and fingerprint, and the
+latency of each keyserver is recorded to choose which to try first. Entries
+written by root in util.SYSTEM_CACHE_DIR are also used by other users. The
+caches are only an optimization: if they can't be read or written, the data
+is computed again.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+
+from pathlib import Path
+
+from . import util
+
+CACHE_VERSION = 1
+KEY_INFO_DIR = 'keyinfo'
+KEY_BLOB_DIR = 'keys'
+KEY_INDEX_DIR = 'keyindex'
+
+KEYSERVER_STATS = 'keyservers.json'
+
+# Weight given to each new keyserver latency in the running average
+LATENCY_WEIGHT = 0.3
+
+# Seconds before a downloaded key is fetched again. In offline mode, cached 
+# keys are always used and keys which aren't cached can't be loaded.
+KEY_CACHE_EXPIRY = float(os.environ.get('REPOLIB_KEY_CACHE_EXPIRY', 7 * 86400))
+OFFLINE = bool(os.environ.get('REPOLIB_OFFLINE'))
+
+log = logging.getLogger(__name__)
+
+def content_hash(data:bytes) -> str:
+    """Get the hash used to name cache entries for some data.
+
+    Arguments:
+        data(bytes): The data
+
+    Returns: str
+        The SHA-256 hex digest of the data
+    """
+    return hashlib.sha256(data).hexdigest()
+
+def _cache_dirs() -> list:
+    """Get the cache directories to read from, in order."""
+    dirs = [Path(util.CACHE_DIR)]
+    if Path(util.SYSTEM_CACHE_DIR) not in dirs:
+        dirs.append(Path(util.SYSTEM_CACHE_DIR))
+    return dirs
+
+def _read_entry(subdir:str, name:str):
+    """Read a cache entry, returning None if there isn't a usable one."""
+    for cache_dir in _cache_dirs():
+        path = cache_dir / subdir / name
+        try:
+            with open(path, mode='r') as entry_file:
+                entry = json.load(entry_file)
+        except FileNotFoundError:
+            continue
+        except (OSError, ValueError) as err:
+            log.debug('Ignoring cache entry %s: %s', path, err)
+            continue
+        if entry.get('version') == CACHE_VERSION:
+            return entry
+    return None
+
+def _write_entry(subdir:str, name:str, entry:dict) -> None:
+    """Write a cache entry, ignoring failures."""
+    entry['version'] = CACHE_VERSION
+    path = Path(util.CACHE_DIR) / subdir / name
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        util.atomic_write(path, json.dumps(entry, default=str))
+    except OSError as err:
+        log.debug('Could not write cache entry %s: %s', path, err)
+
+def get_key_info(data:bytes):
+    """Get the cached information about the keys in a keyring.
+
+    Arguments:
+        data(bytes): The contents of the keyring
+
+    Returns: list
+        The key dicts, as from SourceKey.list_keys(), or None if they aren't
+        cached.
+    """
+    entry = _read_entry(KEY_INFO_DIR, f'{content_hash(data)}.json')
+    if entry is None:
+        return None
+    # Whether a key has expired depends on the time, not just the keyring
+    valid_until = entry.get('valid_until')
+    if valid_until and valid_until <= time.time():
+        return None
+    return entry.get('keys')
+
+def store_key_info(data:bytes, keys:list) -> None:
+    """Cache the information about the keys in a keyring.
+
+    Arguments:
+        data(bytes): The contents of the keyring
+        keys(list): The key dicts for the keyring
+    """
+    expiry_dates:list = []
+    for key in keys:
+        for item in [key, *key.get('subkey_info', {}).values()]:
+            if item.get('expires'):
+                expiry_dates.append(int(item['expires']))
+    valid_until = min(expiry_dates) if expiry_dates else None
+
+    _write_entry(
+        KEY_INFO_DIR,
+        f'{content_hash(data)}.json',
+        {'keys': [dict(key) for key in keys], 'valid_until': valid_until}
+    )
+
+def set_offline(offline:bool = True) -> None:
+    """Enable or disable offline mode for key downloads.
+
+    Arguments:
+        offline(bool): Whether to only use cached keys (Default: True)
+    """
+    global OFFLINE
+    OFFLINE = offline
+
+def _key_index_name(url:str = '', fingerprint:str = '') -> str:
+    """Get the index entry name for a key's URL or fingerprint."""
+    if fingerprint:
+        fingerprint = fingerprint.replace(' ', '').upper()
+        if fingerprint.startswith('0X'):
+            fingerprint = fingerprint[2:]
+        return f'{content_hash(f"fingerprint:{fingerprint}".encode())}.json'
+    return f'{content_hash(f"url:{url}".encode())}.json'
+
+def _read_blob(digest:str):
+    """Read cached data by its hash, checking it hasn't been altered."""
+    for cache_dir in _cache_dirs():
+        path = cache_dir / KEY_BLOB_DIR / digest
+        try:
+            data = path.read_bytes()
+        except OSError:
+            continue
+        if content_hash(data) == digest:
+            return data
+        log.debug('Ignoring corrupt cache entry %s', path)
+    return None
+
+def get_downloaded_key(url:str = '', fingerprint:str = ''):
+    """Get a previously downloaded key.
+
+    Arguments:
+        url(str): The URL the key was downloaded from
+        fingerprint(str): The fingerprint of the key
+
+    Returns: bytes
+        The key data, or None if it isn't cached or has expired
+    """
+    entry = _read_entry(KEY_INDEX_DIR, _key_index_name(url, fingerprint))
+    if entry is None:
+        return None
+    if not OFFLINE and entry.get('fetched', 0) + KEY_CACHE_EXPIRY < time.time():
+        return None
+    return _read_blob(entry.get('hash', ''))
+
+def store_downloaded_key(data:bytes, url:str = '', fingerprint:str = '', fingerprints:list = None) -> None:
+    """Cache a downloaded key.
+
+    The data is stored once, by its hash, and indexed by where it came from
+    and by the fingerprint of each key it contains.
+
+    Arguments:
+        data(bytes): The key data
+        url(str): The URL the key was downloaded from
+        fingerprint(str): The fingerprint which was requested
+        fingerprints(list): The fingerprints of the keys in the data
+    """
+    digest = content_hash(data)
+    path = Path(util.CACHE_DIR) / KEY_BLOB_DIR / digest
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        util.atomic_write(path, data)
+    except OSError as err:
+        log.debug('Could not write cache entry %s: %s', path, err)
+        return
+
+    entry = {'hash': digest, 'fetched': time.time()}
+    names = {_key_index_name(url, fingerprint)}
+    for key_fingerprint in fingerprints or []:
+        names.add(_key_index_name(fingerprint=key_fingerprint))
+    for name in names:
+        _write_entry(KEY_INDEX_DIR, name, dict(entry))
+
+def get_keyserver_latencies() -> dict:
+    """Get the recorded latency of each keyserver.
+
+    Returns: dict
+        The average seconds taken by each keyserver which has been used
+    """
+    entry = _read_entry('', KEYSERVER_STATS)
+    if entry is None:
+        return {}
+    return entry.get('latencies', {})
+
+def record_keyserver_latencies(latencies:dict) -> None:
+    """Add new keyserver latencies to the running averages.
+
+    Arguments:
+        latencies(dict): The seconds taken by each keyserver for one lookup
+    """
+    averages = get_keyserver_latencies()
+    for server, seconds in latencies.items():
+        if server in averages:
+            seconds = (
+                LATENCY_WEIGHT * seconds 
+                + (1 - LATENCY_WEIGHT) * averages[server]
+            )
+        averages[server] = seconds
+    _write_entry('', KEYSERVER_STATS, {'latencies': averages})
@@ -0,0 +1,359 @@
+#!/usr/bin/python3
+
+"""
+Copyright (c) 2022, Ian Santopietro
+All rights reserved.
+
+This file is part of RepoLib.
+
+RepoLib is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RepoLib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
+
+Transactions for changes to source files, signing keys and prefs files.
+
+Every write RepoLib makes is recorded in a ChangeSet. Outside of a 
+transaction, each save gets its own ChangeSet which is committed immediately.
+Inside a transaction() block, all saves are collected into one ChangeSet and 
+committed together when the block exits.
+"""
+
+import contextlib
+import logging
+import tempfile
+
+from pathlib import Path
+
+from . import privileged, util
+
+log = logging.getLogger(__name__)
+
+# Change actions. Each change is a tuple of (action, target, data).
+WRITE_KEY = 'write_key'         # (keyring path, temporary keyring path)
+WRITE_PREFS = 'write_prefs'     # (prefs path, contents)
+WRITE_SOURCE = 'write_source'   # (file name in SOURCES_DIR, contents)
+BACKUP_SOURCE = 'backup_source' # (file name in SOURCES_DIR, backup name)
+DELETE_SOURCE = 'delete_source' # (file name in SOURCES_DIR, '')
+DELETE_PREFS = 'delete_prefs'   # (prefs path, '')
+DELETE_KEY = 'delete_key'       # (keyring path, '')
+
+# Keys and prefs are written before the sources which use them, and removed
+# after the sources which used them.
+ACTION_ORDER = [
+    WRITE_KEY,
+    WRITE_PREFS,
+    WRITE_SOURCE,
+    BACKUP_SOURCE,
+    DELETE_SOURCE,
+    DELETE_PREFS,
+    DELETE_KEY,
+]
+
+# Other directories apt reads keyrings from, besides util.KEYS_DIR
+SYSTEM_KEY_DIRS = (
+    Path('/etc/apt/keyrings'),
+    Path('/etc/apt/trusted.gpg.d'),
+    Path('/usr/share/keyrings'),
+)
+
+_current = None
+
+class ChangeSetError(util.RepoError):
+    """ Exceptions related to applying changes."""
+
+    def __init__(self, *args, code=1, **kwargs):
+        """Exceptions related to applying changes.
+
+        Arguments:
+            code (:obj:`int`, optional, default=1): Exception error code.
+    """
+        super().__init__(*args, **kwargs)
+        self.code = code
+
+class ChangeSet:
+    """A set of pending changes to source files, keys and prefs files.
+
+    Source files are recorded rather than their contents, so each file is 
+    rendered once at commit time no matter how many times it was saved.
+
+    Attributes:
+        files(list): The source files to save
+        changes(dict): The other pending changes, by (action, target)
+    """
+
+    def __init__(self) -> None:
+        self.files:list = []
+        self.changes:dict = {}
+        self._callbacks:list = []
+    
+    def add_file(self, source_file) -> None:
+        """Record that a source file should be saved.
+
+        Arguments:
+            source_file(SourceFile): The file to save
+        """
+        if source_file not in self.files:
+            self.files.append(source_file)
+    
+    def add(self, action:str, target:str, data:str = '') -> None:
+        """Record a change. A later change to the same target replaces any
+        earlier one.
+
+        Arguments:
+            action(str): The change action
+            target(str): The path or name the change applies to
+            data(str): The data for the action
+        """
+        if action not in ACTION_ORDER:
+            raise ChangeSetError(f'Unknown change action {action}')
+        target = str(target)
+        for change in list(self.changes):
+            if change[1] == target:
+                self.changes.pop(change)
+        self.changes[(action, target)] = str(data)
+    
+    def on_commit(self, callback) -> None:
+        """Run a function once these changes are committed successfully.
+
+        Arguments:
+            callback(callable): The function to run, with no arguments
+        """
+        self._callbacks.append(callback)
+    
+    def get_changes(self) -> list:
+        """Get the full list of changes, rendering each source file once.
+
+        Returns: list
+            A list of (action, target, data) tuples, in the order to apply them
+        """
+        changes:list = []
+        for source_file in self.files:
+            changes += source_file.get_changes()
+        for action, target in self.changes:
+            changes.append((action, target, self.changes[(action, target)]))
+        changes.sort(key=lambda change: ACTION_ORDER.index(change[0]))
+        return changes
+    
+    def commit(self) -> None:
+        """Apply all of the changes.
+
+        Changes are applied directly if we have permission to, otherwise they 
+        are sent to the privileged DBus service.
+        """
+        changes = self.get_changes()
+        if not changes:
+            return
+
+        try:
+            apply_changes(changes)
+        except PermissionError:
+            log.info('Permission denied, trying the privileged service')
+            if not apply_changes_privileged(changes):
+                return
+        
+        self.run_callbacks()
+    
+    def run_callbacks(self) -> None:
+        """Run the functions registered with on_commit()."""
+        for callback in self._callbacks:
+            callback()
+
+@contextlib.contextmanager
+def transaction():
+    """Collect all changes made within the block and commit them together.
+
+    Each affected source file is rendered once, and everything is written 
+    atomically when the block exits. If applying the changes fails, anything 
+    already written is rolled back. If the block raises an exception, nothing 
+    is written. Nested transactions are merged into the outermost one.
+
+    Yields: ChangeSet
+        The pending changes
+    """
+    global _current
+    if _current is not None:
+        yield _current
+        return
+    
+    changeset = ChangeSet()
+    _current = changeset
+    try:
+        yield changeset
+    finally:
+        _current = None
+    changeset.commit()
+
+def _source_path(name:str) -> Path:
+    """Get the path to a file within the sources directory."""
+    if not name or '/' in name or name.startswith('.'):
+        raise ChangeSetError(f'Invalid source file name {name}')
+    return Path(util.SOURCES_DIR) / name
+
+def _checked_path(target:str, directories) -> Path:
+    """Get the real path of a change target inside one of `directories`.
+
+    Symlinks are followed first, so a link can't send a change elsewhere.
+    """
+    path = Path(target)
+    if path.is_absolute():
+        resolved = path.resolve()
+        for directory in directories:
+            directory = Path(directory).resolve()
+            if resolved.parent == directory or directory in resolved.parents:
+                return resolved
+    raise ChangeSetError(f'{target} is not in a directory RepoLib manages')
+
+def _key_path(target:str) -> Path:
+    """Get the path to a keyring within one of the keys directories."""
+    return _checked_path(target, (util.KEYS_DIR, *SYSTEM_KEY_DIRS))
+
+def _prefs_path(target:str) -> Path:
+    """Get the path to a file within the apt preferences directory."""
+    return _checked_path(target, (util.PREFS_DIR,))
+
+def _temp_key_path(name:str) -> Path:
+    """Get the path to a keyring prepared in the temporary directory."""
+    path = _checked_path(name, (tempfile.gettempdir(),))
+    if not path.is_file():
+        raise ChangeSetError(f'{name} is not a keyring file')
+    return path
+
+def _backup(path:Path, backups:list) -> None:
+    """Save the current contents of a path so that it can be restored."""
+    try:
+        mode = path.stat().st_mode & 0o7777
+        backups.append((path, path.read_bytes(), mode))
+    except FileNotFoundError:
+        backups.append((path, None, 0))
+
+def _rollback(backups:list) -> None:
+    """Restore paths saved by _backup(), most recent first."""
+    for path, contents, mode in reversed(backups):
+        try:
+            if contents is None:
+                path.unlink(missing_ok=True)
+            else:
+                util.atomic_write(path, contents, mode=mode)
+        except OSError as err:
+            log.error('Could not restore %s: %s', path, err)
+
+def _apply_change(action:str, target:str, data:str, backups:list) -> None:
+    """Apply a single change, saving backups of anything it replaces."""
+    if action == WRITE_SOURCE:
+        path = _source_path(target)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _backup(path, backups)
+        util.atomic_write(path, data)
+
+    elif action == BACKUP_SOURCE:
+        path = _source_path(target)
+        save_path = _source_path(data)
+        if path.exists():
+            _backup(path, backups)
+            _backup(save_path, backups)
+            path.rename(save_path)
+
+    elif action == DELETE_SOURCE:
+        path = _source_path(target)
+        if path.exists():
+            _backup(path, backups)
+            path.unlink()
+
+    elif action == WRITE_PREFS:
+        path = _prefs_path(target)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _backup(path, backups)
+        util.atomic_write(path, data)
+
+    elif action == WRITE_KEY:
+        path = _key_path(target)
+        key_data = _temp_key_path(data).read_bytes()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _backup(path, backups)
+        util.atomic_write(path, key_data)
+
+    elif action in (DELETE_PREFS, DELETE_KEY):
+        if action == DELETE_PREFS:
+            path = _prefs_path(target)
+        else:
+            path = _key_path(target)
+        if path.exists():
+            _backup(path, backups)
+            path.unlink()
+    
+    else:
+        raise ChangeSetError(f'Unknown change action {action}')
+
+def apply_changes(changes:list) -> None:
+    """Apply a list of changes to disk as a single unit.
+
+    If any change fails, the changes already applied are rolled back and the 
+    exception is re-raised.
+
+    Arguments:
+        changes(list): The (action, target, data) tuples to apply
+    """
+    backups:list = []
+    try:
+        for action, target, data in changes:
+            log.debug('Applying %s to %s', action, target)
+            _apply_change(action, target, data, backups)
+    except BaseException:
+        _rollback(backups)
+        raise
+
+def apply_changes_privileged(changes:list) -> bool:
+    """Apply a list of changes through the privileged DBus service.
+
+    The whole list is sent in one call, so it only needs to be authorized 
+    once. Older versions of the service without a batch method are sent each 
+    change separately instead.
+
+    Arguments:
+        changes(list): The (action, target, data) tuples to apply
+    
+    Returns: bool
+        `True` if the changes were sent, `False` if the service was unavailable
+    """
+    try:
+        try:
+            privileged.call('apply_changes', changes, signature='a(sss)')
+        except privileged.PrivilegedError as err:
+            if err.dbus_name != privileged.UNKNOWN_METHOD:
+                raise
+            log.debug('Service has no batch method, sending changes separately')
+            _apply_changes_separately(changes)
+    except privileged.PrivilegedError as err:
+        privileged.report(err)
+        return False
+    return True
+
+def _apply_changes_separately(changes:list) -> None:
+    """Apply changes one at a time with the service's single-file methods."""
+    for action, target, data in changes:
+        if action == WRITE_SOURCE:
+            privileged.call('output_file_to_disk', target, data)
+        elif action == BACKUP_SOURCE:
+            privileged.call('backup_alt_file', target, data)
+        elif action == DELETE_SOURCE:
+            if _source_path(target).exists():
+                privileged.call('delete_source_file', target)
+        elif action == WRITE_PREFS:
+            privileged.call('output_prefs_to_disk', target, data)
+        elif action == DELETE_PREFS:
+            if Path(target).exists():
+                privileged.call('delete_prefs_file', target)
+        elif action == WRITE_KEY:
+            privileged.call('install_signing_key', data, target)
+        elif action == DELETE_KEY:
+            if Path(target).exists():
+                privileged.call('delete_signing_key', target)
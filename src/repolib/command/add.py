@@ -23,7 +23,7 @@ along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
 from httplib2.error import ServerNotFoundError
 from urllib.error import URLError
 
-from .. import util
+from .. import httpclient, system, util
 from ..source import Source, SourceError
 from ..file import SourceFile, SourceFileError
 from ..shortcuts import ppa, popdev, shortcut_prefixes
@@ -178,7 +178,9 @@ class Add(Command):
                 
                 try:
                     new_source.load_from_data([self.deb_line])
-                except (URLError, ServerNotFoundError) as err:
+                except (
+                    URLError, ServerNotFoundError, httpclient.ConnectError
+                ) as err:
                     import traceback
                     self.log.debug(
                         'Exception info: %s \n %s \n %s',
@@ -230,6 +232,20 @@ class Add(Command):
         
         if not new_source.ident:
             new_source.ident = new_source.generate_default_ident()
+        
+        # Shortcuts manage their own files, other sources mustn't replace an
+        # existing source or file
+        if type(new_source) is Source:
+            if not system.load_from_service():
+                system.load_all_sources()
+            ident = system.allocate_ident(new_source.ident)
+            if ident != new_source.ident:
+                self.log.info(
+                    'Ident %s is already in use, using %s', 
+                    new_source.ident, 
+                    ident
+                )
+                new_source.ident = ident
 
         new_file = SourceFile(name=new_source.ident)
         new_file.format = new_source.default_format
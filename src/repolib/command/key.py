@@ -20,15 +20,24 @@ You should have received a copy of the GNU Lesser General Public License
 along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+import json
+
+from datetime import date
 from pathlib import Path
 
 from ..key import SourceKey
-from .. import system, util
+from .. import changeset, system, util
 
 from .command import Command
 
 KEYS_PATH = Path(util.KEYS_DIR)
 
+# Key details printed by --info --all
+INFO_FIELDS = (
+    'keyid', 'fingerprint', 'uids', 'type', 'trust', 'algo', 'length', 'date', 
+    'expires',
+)
+
 class Key(Command):
     """Key subcommand.
     
@@ -42,7 +51,12 @@ class Key(Command):
         --ascii, -a
         --fingerprint, -f
         --keyserver, -s
+        --info, -i
+            --all
+            --json
         --remove, -r
+        --reuse
+        --consolidate
     """
 
     @classmethod
@@ -61,7 +75,8 @@ class Key(Command):
 
         sub.add_argument(
             'repository',
-            default=['x-repolib-none'],
+            nargs='?',
+            default='',
             help='Which repository to manage keys for.'
         )
 
@@ -117,12 +132,48 @@ class Key(Command):
             )
         )
 
+        sub.add_argument(
+            '--all',
+            action='store_true',
+            dest='all_keys',
+            help=(
+                'With --info, print information for every keyring used by a '
+                'source or installed in the keys directory.'
+            )
+        )
+
+        sub.add_argument(
+            '--json',
+            action='store_true',
+            help='With --info --all, print the information as JSON.'
+        )
+
+        sub.add_argument(
+            '--reuse',
+            action='store_true',
+            help=(
+                'With --url, --ascii or --fingerprint, use an installed '
+                'keyring instead if it is identical to the new key.'
+            )
+        )
+
+        sub.add_argument(
+            '--consolidate',
+            action='store_true',
+            help=(
+                'Replace identical keyrings in the keys directory with a '
+                'single copy, updating the sources which use them.'
+            )
+        )
+
         sub.add_argument(
             '-s',
             '--keyserver',
+            action='append',
             help=(
-                'The keyserver from which to fetch the given fingerprint. '
-                '(Default: keyserver.ubuntu.com)'
+                'A keyserver from which to fetch the given fingerprint. Give '
+                'this more than once to try several keyservers, fastest first. '
+                '(Default: keyserver.ubuntu.com and pgpkeys.eu)'
             )
         )
     
@@ -130,6 +181,10 @@ class Key(Command):
         super().finalize_options(args)
         self.repo = args.repository
         self.keyserver = args.keyserver
+        self.all_keys = args.all_keys
+        self.json = args.json
+        self.reuse = args.reuse
+        self.consolidate_keys = args.consolidate
 
         self.actions:dict = {}
         self.system_source = False
@@ -145,10 +200,20 @@ class Key(Command):
         ]:
             self.actions[act] = getattr(args, act)
         
-        system.load_all_sources()
+        if not system.load_from_service():
+            system.load_all_sources()
     
     def run(self):
         """Run the command"""
+        if self.consolidate_keys:
+            return self.consolidate()
+
+        if self.all_keys:
+            if not self.actions['info']:
+                self.log.error('--all can only be used with --info')
+                return False
+            return self.info_all()
+
         self.log.info('Modifying signing key settings for %s', self.repo)
 
         if not self.repo:
@@ -180,28 +245,30 @@ class Key(Command):
          
         self.log.debug('Source before:\n%s', self.source)
 
-        rets = []
-        for action in self.actions:
-            if self.actions[action]:
-                self.log.debug('Running action: %s - (%s)', action, self.actions[action])
-                ret = getattr(self, action)(self.actions[action])
-                rets.append(ret)
-                break
-        
-        self.log.debug('Results: %s', rets)
-        self.log.debug('Source after: \n%s', self.source)
+        # Any removed key and the updated source are written together
+        with changeset.transaction():
+            rets = []
+            for action in self.actions:
+                if self.actions[action]:
+                    self.log.debug('Running action: %s - (%s)', action, self.actions[action])
+                    ret = getattr(self, action)(self.actions[action])
+                    rets.append(ret)
+                    break
+            
+            self.log.debug('Results: %s', rets)
+            self.log.debug('Source after: \n%s', self.source)
 
-        if self.actions['info']:
-            self.log.info('Running Info, skipping saving %s', self.source.ident)
-            return True
+            if self.actions['info']:
+                self.log.info('Running Info, skipping saving %s', self.source.ident)
+                return True
 
-        if True in rets:
-            self.log.info('Saving source %s', self.source.ident)
-            self.source.file.save()
-            return True
-        else:
-            self.log.warning('No valid changes specified, no actions taken.')
-            return False
+            if True in rets:
+                self.log.info('Saving source %s', self.source.ident)
+                self.source.file.save()
+                return True
+            else:
+                self.log.warning('No valid changes specified, no actions taken.')
+                return False
         
     def name(self, value:str) -> bool:
         """Sets the key file to a name in the key file directory"""
@@ -265,9 +332,7 @@ class Key(Command):
         
         key = SourceKey(name=self.source.ident)
         key.load_key_data(url=value)
-        self.source.key = key
-        self.source.signed_by = str(key.path)
-        self.source.load_key()
+        self.set_key(key)
         return True
     
     def ascii(self, value:str) -> bool:
@@ -284,9 +349,7 @@ class Key(Command):
         
         key = SourceKey(name=self.source.ident)
         key.load_key_data(ascii=value)
-        self.source.key = key
-        self.source.signed_by = str(key.path)
-        self.source.load_key()
+        self.set_key(key)
         return True
     
     def fingerprint(self, value:str) -> bool:
@@ -297,14 +360,22 @@ class Key(Command):
         key = SourceKey(name=self.source.ident)
         
         if self.keyserver:
-            key.load_key_data(fingerprint=value, keyserver=self.keyserver)
+            key.load_key_data(fingerprint=value, keyservers=self.keyserver)
         else:
             key.load_key_data(fingerprint=value)
         
+        self.set_key(key)
+        return True
+    
+    def set_key(self, key:SourceKey) -> None:
+        """Sets a newly-loaded key as the source's key"""
+        if self.reuse and key.use_identical():
+            # Share the object for the keyring if it's already loaded
+            key = util.keys.get(str(key.path), key)
+        
         self.source.key = key
         self.source.signed_by = str(key.path)
         self.source.load_key()
-        return True
     
     def info(self, value:str) -> bool:
         """Prints key information"""
@@ -333,6 +404,59 @@ class Key(Command):
 
         return True
     
+    def info_all(self) -> bool:
+        """Prints information for every keyring in use or installed"""
+        key_info:dict = system.get_all_key_info()
+        for path in key_info:
+            key_info[path]['keys'] = [
+                {field: key.get(field, '') for field in INFO_FIELDS}
+                for key in key_info[path]['keys']
+            ]
+        
+        if self.json:
+            print(json.dumps(key_info, indent=2))
+            return True
+        
+        output:str = (
+            f'{"Key ID":<18}{"Created":<12}{"Expires":<12}{"Length":<8}Keyring\n'
+        )
+        for path, keyring in key_info.items():
+            sources:str = ', '.join(keyring['sources']) or 'unused'
+            if keyring['error']:
+                output += f'{"-":<18}{"":<12}{"":<12}{"":<8}{path}\n'
+                output += f'    Error: {keyring["error"]}\n'
+                continue
+            for key in keyring['keys']:
+                created = date.fromtimestamp(int(key['date'])).isoformat()
+                expires = 'never'
+                if key['expires']:
+                    expires = date.fromtimestamp(int(key['expires'])).isoformat()
+                output += (
+                    f'{key["keyid"]:<18}{created:<12}{expires:<12}'
+                    f'{key["length"]:<8}{path}\n'
+                )
+                for uid in key['uids']:
+                    output += f'    {uid}\n'
+            output += f'    Sources: {sources}\n'
+        print(output, end='')
+        return True
+    
+    def consolidate(self) -> bool:
+        """Replaces identical keyrings with a single copy"""
+        replacements:dict = system.consolidate_keyrings(dry_run=True)
+        if not replacements:
+            print('No identical keyrings were found.')
+            return True
+        
+        for path, keep in replacements.items():
+            print(f'{path} will be replaced with {keep}')
+        response = input('Do you want to continue? (y/N): ')
+        if response not in util.true_values:
+            return False
+        
+        system.consolidate_keyrings()
+        return True
+    
     def remove(self, value:str) -> bool:
         """Removes the key from the source"""
 
@@ -183,7 +183,9 @@ class List(Command):
     
     def run(self):
         """Run the command"""
-        system.load_all_sources()
+        # Use the running service's parsed sources if we can
+        if not system.load_from_service():
+            system.load_all_sources()
         self.log.debug("Current sources: %s", util.sources)
         ret = False
 
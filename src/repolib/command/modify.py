@@ -41,6 +41,7 @@ class Modify(Command):
         --remove-component
         --add-uri
         --remove-uri
+        --dry-run
     
     Hidden Options
         --add-option
@@ -169,6 +170,11 @@ class Modify(Command):
             )
         )
 
+        sub.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show the changes which would be made, without saving them.'
+        )
         # Options
         sub.add_argument(
             '--add-option',
@@ -189,6 +195,7 @@ class Modify(Command):
         self.disable = args.disable
         self.source_enable = args.source_enable
         self.source_disable = args.source_disable
+        self.dry_run = args.dry_run
 
         self.actions:dict = {}
 
@@ -214,7 +221,8 @@ class Modify(Command):
         ]:
             self.actions[arg] = getattr(args, arg)
         
-        system.load_all_sources()
+        if not system.load_from_service():
+            system.load_all_sources()
     
     def run(self):
         """Run the command"""
@@ -233,6 +241,12 @@ class Modify(Command):
         if self.source.ident == 'system':
             self.system_source = True
         
+        if self.dry_run:
+            original_file = self.source.file
+            preview_file = original_file.snapshot()
+            index = original_file.sources.index(self.source)
+            self.source = preview_file.sources[index]
+        
         self.log.debug('Actions to take:\n%s', self.actions)
         self.log.debug('Source before:\n%s', self.source)
 
@@ -244,6 +258,10 @@ class Modify(Command):
         self.log.debug('Results: %s', rets)
         self.log.debug('Source after: \n%s', self.source)
 
+        if True in rets and self.dry_run:
+            print(original_file.diff(preview_file), end='')
+            return True
+        
         if True in rets:
             self.source.file.save()
             return True
@@ -20,7 +20,7 @@ You should have received a copy of the GNU Lesser General Public License
 along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-from .. import util, system
+from .. import changeset, util, system
 from .command import Command
 
 class Remove(Command):
@@ -58,7 +58,8 @@ class Remove(Command):
 
     def finalize_options(self, args):
         super().finalize_options(args)
-        system.load_all_sources()
+        if not system.load_from_service():
+            system.load_all_sources()
         self.source_name = args.repository
         self.assume_yes = args.assume_yes
         self.source = None
@@ -105,24 +106,30 @@ class Remove(Command):
             response = input('Are you sure you want to do this? (y/N) ')
         
         if response in util.true_values:
-            self.file.remove_source(self.source_name)
-            self.file.save()
-
-            system.load_all_sources()
-            for source in util.sources.values():
-                self.log.debug('Checking key for %s', source.ident)
-                try:
-                    if source.key.path == self.key.path:
-                        self.log.info('Source key in use with another source')
-                        return True
-                except AttributeError:
-                    pass
-            
-            self.log.info('No other sources found using key, deleting key')
-            if self.key:
-                self.key.delete_key()
+            # Write the file and remove the key together, so a failure 
+            # doesn't leave a dangling key or a source without its key.
+            with changeset.transaction():
+                self.file.remove_source(self.source_name)
+                self.remove_key()
             return True
 
         else:
             print('Canceled.')
             return False
+    
+    def remove_key(self) -> None:
+        """Remove the source's key unless another source still uses it."""
+        for source in util.sources.values():
+            if source.ident == self.source_name:
+                continue
+            self.log.debug('Checking key for %s', source.ident)
+            try:
+                if source.key.path == self.key.path:
+                    self.log.info('Source key in use with another source')
+                    return
+            except AttributeError:
+                pass
+        
+        self.log.info('No other sources found using key, deleting key')
+        if self.key:
+            self.key.delete_key()
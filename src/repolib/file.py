@@ -19,14 +19,15 @@ GNU Lesser General Public License for more details.
 You should have received a copy of the GNU Lesser General Public License
 along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
 """
+import copy
+import difflib
+import io
 import logging
 
 from pathlib import Path
 
-import dbus
-
 from .source import Source, SourceError
-from . import util
+from . import changeset, serialize, util
 
 FILE_COMMENT = "## Added/managed by repolib ##"
 
@@ -65,6 +66,7 @@ class SourceFile:
         self.format:util.SourceFormat = util.SourceFormat.DEFAULT
         self.contents:list = []
         self.sources:list = []
+        self.idents:util.IdentAllocator = util.IdentAllocator()
 
         self.contents.append(FILE_COMMENT)
         self.contents.append('#')
@@ -92,6 +94,7 @@ class SourceFile:
         if source not in self.sources:
             self.contents.append(source)
             self.sources.append(source)
+            self.idents.reserve(source.ident)
             source.file = self
     
     def remove_source(self, ident:str) -> None:
@@ -103,27 +106,111 @@ class SourceFile:
         source = self.get_source_by_ident(ident)
         self.contents.remove(source)
         self.sources.remove(source)
-        self.save()
+        self.idents.release(ident)
+        util.idents.release(ident)
+
+        with changeset.transaction() as changes:
+            self.save()
+
+            ## Remove sources prefs files/pin-priority
+            prefs_path = source.prefs
+            if prefs_path.name:
+                changes.add(changeset.DELETE_PREFS, prefs_path)
+
+    def snapshot(self):
+        """Get a cheap copy of this file and its sources for previewing changes.
 
-        ## Remove sources prefs files/pin-priority
-        prefs_path = source.prefs
-        try:
-            if prefs_path.exists() and prefs_path.name:
-                prefs_path.unlink()
+        Each source in the copy is a :meth:`Source.snapshot`, so unchanged 
+        field values are shared with this file. Changes made to the copy can be
+        rendered or diffed against this file and then thrown away.
+
+        Returns: SourceFile
+            The copy of this file
+        """
+        clone = copy.copy(self)
+        clone.contents = []
+        clone.sources = []
+        clone.idents = util.IdentAllocator()
+        for item in self.contents:
+            if isinstance(item, Source):
+                item = item.snapshot()
+                item.file = clone
+                clone.sources.append(item)
+                clone.idents.reserve(item.ident)
+            clone.contents.append(item)
+        return clone
+    
+    def diff(self, other) -> str:
+        """Compare the output of this file with another file.
+
+        Arguments:
+            other(SourceFile): The file to compare with, usually a snapshot
         
-        except AttributeError:
-            # No prefs path
-            pass
+        Returns: str
+            A unified diff from this file to `other`, empty if they match
+        """
+        return ''.join(difflib.unified_diff(
+            self.output.splitlines(keepends=True),
+            other.output.splitlines(keepends=True),
+            fromfile=str(self.path),
+            tofile=str(other.path)
+        ))
+
+    def to_bytes(self) -> bytes:
+        """Serialize this file and its sources into a compact binary form.
+
+        Returns: bytes
+            The serialized file, see :mod:`repolib.serialize`
+        """
+        table = serialize.StringTable()
+        return serialize.pack(serialize.KIND_FILE, table, self._pack(table))
+    
+    @classmethod
+    def from_bytes(cls, data:bytes):
+        """Load a file serialized with :meth:`to_bytes`.
+
+        The file is not read from or written to disk.
+
+        Arguments:
+            data(bytes): The serialized file
         
-        except PermissionError:
-            bus = dbus.SystemBus()
-            try:
-                privileged_object = bus.get_object('org.pop_os.repolib', '/Repo')
-                privileged_object.delete_prefs_file(str(prefs_path))
-            except dbus.exceptions.DBusException:
-                self.log.critical('DBus service not found!')
-                print("Permission denied. Please use `sudo`.")
-                return
+        Returns: SourceFile
+            The loaded file
+        """
+        return serialize.load(data, serialize.KIND_FILE, cls._unpack)
+    
+    def _pack(self, table:serialize.StringTable) -> tuple:
+        """Get the serialization payload for this file."""
+        contents:list = []
+        for item in self.contents:
+            if isinstance(item, Source):
+                contents.append(item._pack(table))
+            else:
+                contents.append(table.add(str(item)))
+        return (
+            table.add(self.name),
+            table.add(self.format.value),
+            tuple(contents)
+        )
+    
+    @classmethod
+    def _unpack(cls, strings:tuple, payload:tuple):
+        """Create a file from a serialization payload."""
+        name, format, contents = payload
+        source_file = cls()
+        source_file.name = strings[name]
+        source_file.format = util.SourceFormat(strings[format])
+        source_file.contents = []
+        for item in contents:
+            if isinstance(item, int):
+                source_file.contents.append(strings[item])
+                continue
+            source = Source._unpack(strings, item)
+            source.file = source_file
+            source_file.contents.append(source)
+            source_file.sources.append(source)
+            source_file.idents.reserve(source.ident)
+        return source_file
 
     def get_source_by_ident(self, ident: str) -> Source:
         """Find a source within this file by its ident
@@ -184,8 +271,8 @@ class SourceFile:
             source will be dropped until export.
           * (legacy) If the sources differ by URIs, Components, or Suites, then 
             the differing data will be appended to the sources' idents.
-          * (Either) If no other rules can be determined, then the sources will 
-            have a number appended to them
+          * (Either) If no other rules can be determined, then the second 
+            source will have the next free number for that ident appended.
         
         Arguments:
             source1(Source): The original source with the ident
@@ -238,20 +325,16 @@ class SourceFile:
                     if ident_src1 != ident_src2:
                         break
         if ident_src2 and ident_src1 != ident_src2:
-            source1.ident = ident_src1
-            source2.ident = ident_src2
+            self.idents.release(source1.ident)
+            source1.ident = self.idents.allocate(ident_src1)
+            source2.ident = self.idents.allocate(ident_src2)
             return True
         
         elif ident_src2 and ident_src1 == ident_src2:
-            for source in self.sources:
-                src_index = self.sources.index(source)
-                source.ident = f'{self.name}-{src_index}'
-                return True
-        
-        elif not ident_src2:
-            return False
+            source2.ident = self.idents.allocate(ident_src2)
+            return True
         
-        return True
+        return False
 
             
     def load(self) -> None:
@@ -259,6 +342,7 @@ class SourceFile:
         self.log.debug(f'Loading source file {self.path}')
         self.contents = []
         self.sources = []
+        self.idents.clear()
 
         if not self.name:
             raise SourceFileError('You must provide a filename to load.')
@@ -313,6 +397,7 @@ class SourceFile:
                             idents[old_source.ident] = old_source
                         idents[new_source.ident] = new_source
                         if to_add:
+                            self.idents.reserve(new_source.ident)
                             new_source.file = self
                             self.contents.append(new_source)
                             self.sources.append(new_source)
@@ -344,6 +429,7 @@ class SourceFile:
                             idents[old_source.ident] = old_source
                         idents[new_source.ident] = new_source
                         if to_add:
+                            self.idents.reserve(new_source.ident)
                             new_source.file = self
                             self.contents.append(new_source)
                             self.sources.append(new_source)
@@ -384,6 +470,7 @@ class SourceFile:
                         self.find_unique_ident(old_source, new_source)
                         idents[old_source.ident] = old_source
                     idents[new_source.ident] = new_source
+                    self.idents.reserve(new_source.ident)
                     new_source.file = self
                     self.contents.append(new_source)
                     self.sources.append(new_source)
@@ -408,6 +495,7 @@ class SourceFile:
                 self.find_unique_ident(old_source, new_source)
                 idents[old_source.ident] = old_source
             idents[new_source.ident] = new_source
+            self.idents.reserve(new_source.ident)
             new_source.file = self
             self.contents.append(new_source)
             self.sources.append(new_source)
@@ -425,64 +513,50 @@ class SourceFile:
         self.log.debug('File %s loaded', self.path)
 
     def save(self) -> None:
-        """Saves the source file to disk using the current format"""
+        """Saves the source file to disk using the current format
+        
+        Within a :func:`repolib.transaction`, the file is written when the 
+        transaction is committed.
+        """
         self.log.debug(f'Saving source file to {self.path}')
 
         for source in self.sources:
             self.log.debug('New Source %s: \n%s', source.ident, source)
 
-        save_path = util.SOURCES_DIR / f'{self.name}.save'
-
-        for source in self.sources:
-            if source.key:
-                source.key.save_gpg()
-            source.tasks_save()
-
         if not self.name or not self.format:
             raise SourceFileError('There was not a complete filename to save')
-        
-        if not util.SOURCES_DIR.exists():
-            try:
-                util.SOURCES_DIR.mkdir(parents=True)
-            except PermissionError:
-                self.log.error(
-                    'Source destination path does not exist and cannot be created '
-                    'Failures expected now.'
-                )
+
+        with changeset.transaction() as changes:
+            # Only write out keys and prefs which actually changed
+            for source in self.sources:
+                if source.key and source.key.dirty:
+                    source.key.save_gpg()
+                source.tasks_save()
+            changes.add_file(self)
+    
+    def get_changes(self) -> list:
+        """Get the changes needed to save this file in its current state.
+
+        Returns: list
+            The (action, target, data) tuples for a :class:`ChangeSet`
+        """
+        save_name = f'{self.name}.save'
 
         if len(self.sources) > 0:
             self.log.debug('Saving, Main path %s; Alt path: %s', self.path, self.alt_path)
-            try:
-                with open(self.path, mode='w') as output_file:
-                    output_file.write(self.output)
-                if self.alt_path.exists():
-                    self.alt_path.rename(save_path)
-            
-            except PermissionError:
-                bus = dbus.SystemBus()
-                try:
-                    privileged_object = bus.get_object('org.pop_os.repolib', '/Repo')
-                    privileged_object.output_file_to_disk(self.path.name, self.output)
-                except dbus.exceptions.DBusException:
-                    self.log.critical('DBus service not found!')
-                    print("Permission denied. Please use `sudo`.")
-                    return
-            self.log.debug('File %s saved', self.path)
-        else:
-            try:
-                self.path.unlink(missing_ok=True)
-                self.alt_path.unlink(missing_ok=True)
-                save_path.unlink(missing_ok=True)
-            except PermissionError:
-                bus = dbus.SystemBus()
-                try:
-                    privileged_object = bus.get_object('org.pop_os.repolib', '/Repo')
-                    privileged_object.delete_source_file(self.path.name)
-                except dbus.exceptions.DBusException:
-                    self.log.critical('DBus service not found!')
-                    print("Permission denied. Please use `sudo`.")
-                    return
-            self.log.debug('File %s removed', self.path)
+            changes = [(changeset.WRITE_SOURCE, self.path.name, self.output)]
+            if self.alt_path.exists():
+                changes.append(
+                    (changeset.BACKUP_SOURCE, self.alt_path.name, save_name)
+                )
+            return changes
+        
+        self.log.debug('File %s has no sources, removing', self.path)
+        return [
+            (changeset.DELETE_SOURCE, self.path.name, ''),
+            (changeset.DELETE_SOURCE, self.alt_path.name, ''),
+            (changeset.DELETE_SOURCE, save_name, ''),
+        ]
 
     
     ## Attribute properties
@@ -503,57 +577,63 @@ class SourceFile:
         self.alt_path = util.SOURCES_DIR / f'{self.name}.{alt_format.value}'
 
     ## Output properties
+    def write_to(self, fp, format=None) -> None:  # type: ignore (We don't use str.format)
+        """Write the contents of this file to a file object, item by item.
+
+        Arguments:
+            fp: The text file or buffer to write to
+            format(SourceFormat|str): The output format; `SourceFormat.DEFAULT`
+                for DEB822, `SourceFormat.LEGACY` for one-line sources, or 
+                `'ui'` for the UI format. (Default: the format of this file)
+        """
+        if format is None:
+            format = self.format
+
+        for item in self.contents:
+            is_source:bool = isinstance(item, Source)
+            if format == 'ui':
+                # Skip file comments in UI mode
+                if is_source:
+                    fp.write(item.ui)
+                fp.write('\n')
+            elif format == util.SourceFormat.LEGACY:
+                fp.write(item.legacy if is_source else item)
+                fp.write('\n')
+            elif is_source:
+                fp.write(item.deb822)
+            else:
+                fp.write(item)
+                fp.write('\n')
+    
+    def render(self, format=None) -> str:  # type: ignore (We don't use str.format)
+        """Render the contents of this file into a string.
+
+        Arguments:
+            format(SourceFormat|str): The output format, see :meth:`write_to`
+        
+        Returns: str
+            The rendered file
+        """
+        output = io.StringIO()
+        self.write_to(output, format)
+        return output.getvalue()
+
     @property 
     def legacy(self) -> str:
         """Outputs the file in the output_legacy format"""
-        legacy_output:str = ''
-        for item in self.contents:
-            try:
-                legacy_output += item.legacy
-            except AttributeError:
-                legacy_output += item
-            legacy_output += '\n'
-        return legacy_output
+        return self.render(util.SourceFormat.LEGACY)
 
     @property 
     def deb822(self) -> str:
         """Outputs the file in the output_822 format"""
-        deb822_output:str = ''
-        for item in self.contents:
-            try:
-                deb822_output += item.deb822
-            except AttributeError:
-                deb822_output += item
-                deb822_output += '\n'
-        return deb822_output
-
+        return self.render(util.SourceFormat.DEFAULT)
 
     @property 
     def ui(self) -> str:
         """Outputs the file in the output_ui format"""
-        ui_output:str = ''
-        for item in self.contents:
-            try:
-                ui_output += item.ui
-            except AttributeError:
-                pass # Skip file comments in UI mode
-            ui_output += '\n'
-        return ui_output
-
+        return self.render('ui')
 
     @property 
     def output(self) -> str:
         """Outputs the file in the output format"""
-        default_output:str = ''
-        for item in self.contents:
-            try:
-                if self.format == util.SourceFormat.DEFAULT:
-                    default_output += item.deb822
-                elif self.format == util.SourceFormat.LEGACY:
-                    default_output += item.legacy
-                    default_output += '\n'
-            except AttributeError:
-                default_output += item
-                default_output += '\n'
-        return default_output
-
+        return self.render()
@@ -0,0 +1,370 @@
+#!/usr/bin/python3
+
+"""
+Copyright (c) 2022, Ian Santopietro
+All rights reserved.
+
+This file is part of RepoLib.
+
+RepoLib is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RepoLib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
+
+HTTP client used for key downloads and other requests RepoLib makes.
+
+Connections are kept alive and reused for later requests to the same host.
+Each request has separate connect and read timeouts and an overall deadline,
+failed requests are retried with backoff, and responses are read in chunks
+up to a maximum size. Proxies are taken from the standard environment
+variables (http_proxy, https_proxy, no_proxy).
+"""
+
+import base64
+import http.client
+import logging
+import threading
+import time
+
+from urllib.parse import urljoin, urlsplit, unquote
+from urllib.request import getproxies, proxy_bypass
+
+from . import util
+from .__version__ import __version__
+
+# Seconds allowed to connect, and to wait for each read
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 30
+
+# Attempts after the first, and the delay before the first of them, which
+# doubles for each attempt after that
+RETRIES = 2
+BACKOFF = 0.5
+
+# The largest response body to accept, in bytes
+MAX_SIZE = 10 * 1024 * 1024
+
+MAX_REDIRECTS = 5
+CHUNK_SIZE = 65536
+USER_AGENT = f'RepoLib/{__version__}'
+
+# Statuses which may succeed if the request is retried
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+log = logging.getLogger(__name__)
+_client = None
+_client_lock = threading.Lock()
+
+class DownloadError(util.RepoError):
+    """ Exceptions related to HTTP requests."""
+
+    def __init__(self, *args, code=1, status=0, url='', **kwargs):
+        """Exceptions related to HTTP requests.
+
+        Arguments:
+            code (:obj:`int`, optional, default=1): Exception error code.
+            status (:obj:`int`, optional): The HTTP status, if there was one.
+            url (:obj:`str`, optional): The URL which was requested.
+    """
+        super().__init__(*args, **kwargs)
+        self.code = code
+        self.status = status
+        self.url = url
+
+class ConnectError(DownloadError):
+    """ The server couldn't be reached or stopped responding."""
+
+class HTTPClient:
+    """Makes HTTP requests over persistent connections.
+
+    A client can be used from several threads at once. Each connection is
+    used for one request at a time, then returned to the pool for its host.
+
+    Attributes:
+        connect_timeout(float): Seconds allowed to connect to a server
+        read_timeout(float): Seconds allowed to wait for each read
+        retries(int): The number of times to retry a failed request
+        backoff(float): Seconds to wait before the first retry
+        max_size(int): The largest response body to accept, in bytes
+        proxies(dict): Proxy URLs by scheme, or None to use the environment
+    """
+
+    def __init__(
+        self,
+        connect_timeout:float = CONNECT_TIMEOUT,
+        read_timeout:float = READ_TIMEOUT,
+        retries:int = RETRIES,
+        backoff:float = BACKOFF,
+        max_size:int = MAX_SIZE,
+        proxies:dict = None
+    ) -> None:
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_size = max_size
+        self.proxies = proxies
+        self._pool:dict = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        url:str,
+        headers:dict = None,
+        timeout:float = None,
+        max_size:int = None,
+        stop:threading.Event = None
+    ) -> bytes:
+        """Download the body of a URL.
+
+        Arguments:
+            url(str): The http or https URL to get
+            headers(dict): Extra request headers
+            timeout(float): Seconds allowed for the whole request, including
+                retries and redirects (Default: no overall limit)
+            max_size(int): The largest body to accept (Default: self.max_size)
+            stop(threading.Event): When set, the request is given up before
+                any further retries or redirects
+
+        Returns: bytes
+            The response body
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        max_size = max_size or self.max_size
+
+        for _redirect in range(MAX_REDIRECTS + 1):
+            _check_stop(stop, url)
+            status, location, body = self._get_with_retries(
+                url, headers or {}, deadline, max_size, stop
+            )
+            if status not in REDIRECT_STATUSES:
+                return body
+            if not location:
+                raise DownloadError(
+                    f'The redirect from {url} has no location',
+                    status=status, url=url
+                )
+
+            new_url = urljoin(url, location)
+            if urlsplit(url).scheme == 'https' and urlsplit(new_url).scheme != 'https':
+                raise DownloadError(
+                    f'Refusing to follow redirect from {url} to insecure '
+                    f'URL {new_url}',
+                    status=status, url=url
+                )
+            log.debug('Following redirect from %s to %s', url, new_url)
+            url = new_url
+
+        raise DownloadError(f'Too many redirects for {url}', url=url)
+
+    def close(self) -> None:
+        """Close all idle connections."""
+        with self._lock:
+            pool = self._pool
+            self._pool = {}
+        for connections in pool.values():
+            for conn in connections:
+                conn.close()
+
+    def _get_with_retries(self, url:str, headers:dict, deadline, max_size:int, stop) -> tuple:
+        """Make a request, retrying failures which might be temporary."""
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                status, location, body = self._request(
+                    url, headers, deadline, max_size
+                )
+            except (OSError, http.client.HTTPException) as err:
+                error:DownloadError = ConnectError(
+                    f'Could not get {url}: {err}', url=url
+                )
+                error.__cause__ = err
+            else:
+                if status == 200 or status in REDIRECT_STATUSES:
+                    return status, location, body
+                error = DownloadError(
+                    f'Could not get {url}: HTTP status {status}',
+                    status=status, url=url
+                )
+                if status not in RETRY_STATUSES:
+                    raise error
+
+            if attempt == self.retries:
+                raise error
+            if deadline and time.monotonic() + delay >= deadline:
+                raise error
+            log.debug('Retrying %s in %s seconds: %s', url, delay, error)
+            if stop:
+                stop.wait(delay)
+            else:
+                time.sleep(delay)
+            delay *= 2
+            _check_stop(stop, url)
+
+    def _request(self, url:str, headers:dict, deadline, max_size:int) -> tuple:
+        """Make a single request, returning (status, location, body)."""
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise DownloadError(f'Unsupported URL {url}', url=url)
+
+        target = parts.path or '/'
+        if parts.query:
+            target += f'?{parts.query}'
+        request_headers = {'User-Agent': USER_AGENT, **headers}
+
+        proxy = self._get_proxy(parts)
+        pool_key = (parts.scheme, parts.hostname, parts.port, proxy)
+        if proxy and parts.scheme == 'http':
+            # Plain HTTP proxies are sent the whole URL
+            target = url
+            request_headers.update(_proxy_headers(proxy))
+
+        conn, reused = self._get_connection(pool_key)
+        try:
+            self._set_timeout(conn, deadline)
+            try:
+                conn.request('GET', target, headers=request_headers)
+                response = conn.getresponse()
+            except (ConnectionError, http.client.BadStatusLine):
+                if not reused:
+                    raise
+                # The server closed an idle connection, try a new one
+                conn.close()
+                conn, reused = self._get_connection(pool_key, reuse=False)
+                self._set_timeout(conn, deadline)
+                conn.request('GET', target, headers=request_headers)
+                response = conn.getresponse()
+
+            body = self._read_body(conn, response, url, deadline, max_size)
+        except BaseException:
+            conn.close()
+            raise
+
+        if response.will_close:
+            conn.close()
+        else:
+            with self._lock:
+                self._pool.setdefault(pool_key, []).append(conn)
+        return response.status, response.getheader('Location', ''), body
+
+    def _read_body(self, conn, response, url:str, deadline, max_size:int) -> bytes:
+        """Read a response body in chunks, enforcing the size and deadline."""
+        length = response.getheader('Content-Length')
+        if length and length.isdigit() and int(length) > max_size:
+            raise DownloadError(
+                f'The response from {url} is larger than {max_size} bytes',
+                status=response.status, url=url
+            )
+
+        body = bytearray()
+        while True:
+            self._set_timeout(conn, deadline)
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            body += chunk
+            if len(body) > max_size:
+                raise DownloadError(
+                    f'The response from {url} is larger than {max_size} bytes',
+                    status=response.status, url=url
+                )
+        return bytes(body)
+
+    def _set_timeout(self, conn, deadline) -> None:
+        """Connect if needed, then limit the next read to the deadline."""
+        remaining = None
+        if deadline:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DownloadError(
+                    f'The request to {conn.host} did not finish in time'
+                )
+
+        if conn.sock is None:
+            conn.timeout = min(self.connect_timeout, remaining or self.connect_timeout)
+            conn.connect()
+        conn.sock.settimeout(min(self.read_timeout, remaining or self.read_timeout))
+
+    def _get_connection(self, pool_key:tuple, reuse:bool = True) -> tuple:
+        """Get an idle connection from the pool, or a new one."""
+        if reuse:
+            with self._lock:
+                connections = self._pool.get(pool_key)
+                if connections:
+                    return connections.pop(), True
+
+        scheme, host, port, proxy = pool_key
+        if not proxy:
+            if scheme == 'https':
+                return http.client.HTTPSConnection(host, port), False
+            return http.client.HTTPConnection(host, port), False
+
+        proxy_parts = urlsplit(proxy)
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(
+                proxy_parts.hostname, proxy_parts.port or 8080
+            )
+            conn.set_tunnel(host, port, headers=_proxy_headers(proxy))
+            return conn, False
+        return http.client.HTTPConnection(
+            proxy_parts.hostname, proxy_parts.port or 8080
+        ), False
+
+    def _get_proxy(self, parts) -> str:
+        """Get the proxy URL to use for a URL, or an empty string."""
+        proxies = self.proxies
+        if proxies is None:
+            proxies = getproxies()
+            if proxies.get('no') and proxy_bypass(parts.hostname):
+                return ''
+        proxy = proxies.get(parts.scheme, '')
+        if proxy and '://' not in proxy:
+            proxy = f'http://{proxy}'
+        return proxy
+
+def _check_stop(stop, url:str) -> None:
+    """Give up on a request once its stop event is set."""
+    if stop and stop.is_set():
+        raise DownloadError(f'The request for {url} was cancelled', url=url)
+
+def _proxy_headers(proxy:str) -> dict:
+    """Get the authorization header for a proxy URL with credentials."""
+    parts = urlsplit(proxy)
+    if not parts.username:
+        return {}
+    credentials = f'{unquote(parts.username)}:{unquote(parts.password or "")}'
+    token = base64.b64encode(credentials.encode()).decode()
+    return {'Proxy-Authorization': f'Basic {token}'}
+
+def get_client() -> HTTPClient:
+    """Get the client shared by the rest of RepoLib.
+
+    Returns: HTTPClient
+        The shared client, created with the default settings when first used
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HTTPClient()
+        return _client
+
+def get(url:str, **kwargs) -> bytes:
+    """Download the body of a URL with the shared client.
+
+    Arguments:
+        url(str): The http or https URL to get
+        **kwargs: Options for :meth:`HTTPClient.get`
+
+    Returns: bytes
+        The response body
+    """
+    return get_client().get(url, **kwargs)
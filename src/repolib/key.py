@@ -20,19 +20,38 @@ You should have received a copy of the GNU Lesser General Public License
 along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+import concurrent.futures
 import logging
+import math
+import queue
 import shutil
+import threading
+import time
 
-import dbus
 import gnupg
 from pathlib import Path
-from urllib import request
 
-from . import util
+from . import cache, changeset, httpclient, openpgp, util
 
 SKS_KEYSERVER = 'https://keyserver.ubuntu.com/'
 SKS_KEYLOOKUP_PATH = 'pks/lookup?op=get&options=mr&exact=on&search=0x'
 
+# Keyservers to look up fingerprints on. The one which has been fastest is
+# tried first, and if it hasn't answered after HEDGE_DELAY seconds, the next
+# one is tried at the same time.
+KEYSERVERS = [SKS_KEYSERVER, 'https://pgpkeys.eu/']
+HEDGE_DELAY = 1.0
+
+# Seconds allowed for each key download, and the number of downloads to run
+# at once in load_many_key_data()
+FETCH_TIMEOUT = 30
+FETCH_WORKERS = 8
+
+# The largest key file to download, in bytes
+MAX_KEY_SIZE = 4 * 1024 * 1024
+
+log = logging.getLogger(__name__)
+
 class KeyFileError(util.RepoError):
     """ Exceptions related to apt key files."""
 
@@ -46,18 +65,39 @@ class KeyFileError(util.RepoError):
         self.code = code
 
 class SourceKey:
-    """A signing key for an apt source."""
+    """A signing key for an apt source.
+    
+    Attributes:
+        path(Path): The path to the keyring on disk
+        tmp_path(Path): The path to the working copy of the keyring
+        dirty(bool): `True` if the working copy has changes which have not been
+            saved to `path` yet
+        gpg(gnupg.GPG): The GPG object for the working copy. This is set up
+            the first time it's used, so keys which are only listed never 
+            copy the keyring or run gpg.
+    """
 
     def __init__(self, name:str = '') -> None:
         self.log = logging.getLogger(__name__)
         self.tmp_path = Path()
         self.path = Path()
-        self.gpg = gnupg.GPG()
+        self._gpg = None
         self.data = b''
+        self.dirty:bool = False
         
         if name:
             self.reset_path(name=name)
+    
+    @property
+    def gpg(self) -> gnupg.GPG:
+        """The GPG object for the working copy of the keyring."""
+        if self._gpg is None:
             self.setup_gpg()
+        return self._gpg
+    
+    @gpg.setter
+    def gpg(self, gpg:gnupg.GPG) -> None:
+        self._gpg = gpg
     
     def reset_path(self, name: str = '', path:str = '', suffix: str = 'archive-keyring') -> None:
         """Set the path for this key
@@ -80,7 +120,8 @@ class SourceKey:
             self.path = Path(path)
             self.tmp_path = util.TEMP_DIR / self.path.name
         
-        self.setup_gpg()
+        # Set up again for the new path when next needed
+        self._gpg = None
         
         self.log.debug('Key Path: %s', self.path)
         self.log.debug('Temp Path: %s', self.tmp_path)
@@ -95,56 +136,115 @@ class SourceKey:
         except FileNotFoundError:
             pass
         
-        self.gpg = gnupg.GPG(keyring=str(self.tmp_path))
-        self.log.debug('GPG Setup: %s', self.gpg.keyring)
+        self._gpg = gnupg.GPG(keyring=str(self.tmp_path))
+        self.log.debug('GPG Setup: %s', self._gpg.keyring)
     
+    def list_keys(self) -> list:
+        """Get information about the keys in this keyring.
+
+        The information is cached by the keyring's contents. Otherwise the 
+        keyring is read directly where possible, falling back to gpg for 
+        anything the native reader can't handle.
+
+        Returns: list
+            A dict for each key, in the form python-gnupg's list_keys() uses
+        """
+        # The working copy has any changes which haven't been saved yet
+        keyring = self.path
+        if (self._gpg is not None or self.dirty) and self.tmp_path.exists():
+            keyring = self.tmp_path
+        
+        try:
+            data = keyring.read_bytes()
+        except OSError as err:
+            self.log.debug('Reading %s with gpg: %s', keyring, err)
+            return self.gpg.list_keys()
+        
+        keys = cache.get_key_info(data)
+        if keys is not None:
+            return keys
+        
+        try:
+            keys = openpgp.read_keys(data)
+        except openpgp.OpenPGPError as err:
+            self.log.debug('Reading %s with gpg: %s', keyring, err)
+            keys = list(self.gpg.list_keys())
+        cache.store_key_info(data, keys)
+        return keys
+
     def save_gpg(self) -> None:
-        """Saves the key to disk."""
+        """Saves the key to disk.
+        
+        Within a :func:`repolib.transaction`, the key is written when the 
+        transaction is committed.
+        """
         self.log.info('Saving key file %s from %s', self.path, self.tmp_path)
-        self.log.debug('Key contents: %s', self.gpg.list_keys())
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug('Key contents: %s', self.list_keys())
         self.log.debug('Temp key exists? %s', self.tmp_path.exists())
-        if not util.KEYS_DIR.exists():
-            try:
-                util.KEYS_DIR.mkdir(parents=True)
-            except PermissionError:
-                self.log.error(
-                    'Key destination path does not exist and cannot be created '
-                    'Failures expected now.'
-                )
-        try:
-            shutil.copy(self.tmp_path, self.path)
         
-        except PermissionError:
-            bus = dbus.SystemBus()
-            try:
-                privileged_object = bus.get_object('org.pop_os.repolib', '/Repo')
-                privileged_object.install_signing_key(
-                    str(self.tmp_path),
-                    str(self.path)
-                )
-            except dbus.exceptions.DBusException:
-                self.log.critical('DBus service not found!')
-                print("Permission denied. Please use `sudo`.")
-                return
+        with changeset.transaction() as changes:
+            changes.add(changeset.WRITE_KEY, self.path, self.tmp_path)
+            changes.on_commit(self._mark_saved)
+    
+    def _mark_saved(self) -> None:
+        """Marks the working copy as saved once it has been written."""
+        self.dirty = False
     
+    def use_identical(self) -> bool:
+        """Use an installed keyring with the same contents as this key.
+
+        If the working copy of a new key is identical to a keyring which is 
+        already installed, this key is pointed at that keyring instead, so 
+        another copy isn't saved.
+
+        Returns: bool
+            `True` if an identical keyring was found and is now used
+        """
+        if not self.dirty or not self.tmp_path.exists():
+            return False
+        
+        data = self.tmp_path.read_bytes()
+        existing = find_keyring(data)
+        if existing is None or existing == self.path:
+            return False
+        
+        self.log.info('Using identical keyring %s for %s', existing, self.path)
+        self.tmp_path.unlink(missing_ok=True)
+        self.reset_path(path=existing)
+        self.data = data
+        self.dirty = False
+        return True
+
     def delete_key(self) -> None:
         """Deletes the key file from disk."""
+        self.dirty = False
+        self.tmp_path.unlink(missing_ok=True)
+        with changeset.transaction() as changes:
+            changes.add(changeset.DELETE_KEY, self.path)
+
+    def import_keys(self, data) -> None:
+        """Add public keys to the working copy of the keyring.
+
+        Keys are dearmored and written as a binary keyring directly, without 
+        running gpg. gpg is used instead to merge keys into a working copy 
+        which already has keys in it, and for data which can't be read 
+        natively.
+
+        Arguments:
+            data(bytes): The keys, binary or ASCII-armored
+        """
         try:
-            self.tmp_path.unlink()
-            self.path.unlink()
-        
-        except PermissionError:
-            bus = dbus.SystemBus()
-            try:
-                privileged_object = bus.get_object('org.pop_os.repolib', '/Repo')
-                privileged_object.delete_signing_key(str(self.path))
-            except dbus.exceptions.DBusException:
-                self.log.critical('DBus service not found!')
-                print("Permission denied. Please use `sudo`.")
-                return
+            if self.tmp_path.exists() and self.tmp_path.stat().st_size:
+                raise openpgp.OpenPGPError('The working copy already has keys')
+            keyring = openpgp.public_keyring(data)
+        except openpgp.OpenPGPError as err:
+            self.log.debug('Importing keys with gpg: %s', err)
+            self.gpg.import_keys(data)
+            return
         
-        except FileNotFoundError:
-            pass
+        self.log.debug('Writing keys to %s', self.tmp_path)
+        self.tmp_path.write_bytes(keyring)
 
     def load_key_data(self, **kwargs) -> None:
         """Loads the key data from disk into the object for processing.
@@ -157,9 +257,12 @@ class SourceKey:
             raw(bytes): Raw data to import to the keyring
             ascii(str): ASCII-armored key data to import directly
             url(str): A URL to download key data from
-            fingerprint(str): A key fingerprint to download from `keyserver`
-                keyserver(str): A keyserver to download from.
+            fingerprint(str): A key fingerprint to download from a keyserver
+                keyservers(list): Keyservers to try, see lookup_fingerprint()
+                keyserver(str): A single keyserver to download from instead.
                 keypath(str): The path on the keyserver from which to download.
+            timeout(float): Seconds allowed for a download (Default: 
+                FETCH_TIMEOUT)
         
         NOTE: The keyserver and keypath args only affect the operation of the 
             `fingerprint` keyword.
@@ -171,41 +274,23 @@ class SourceKey:
             return
         
         self.tmp_path.touch()
+        self.dirty = True
         
         if 'raw' in kwargs:
             self.data = kwargs['raw']
-            self.gpg.import_keys(self.data)
+            self.import_keys(self.data)
             return
         
         if 'ascii' in kwargs:
-            self.gpg.import_keys(kwargs['ascii'])
+            self.import_keys(kwargs['ascii'])
             if self.tmp_path.exists():
                 with open(self.tmp_path, mode='rb') as keyfile:
                     self.data = keyfile.read()
             return
         
-        if 'url' in kwargs:
-            req = request.Request(
-                kwargs['url'],
-                headers={"User-Agent": "python-requests/2.31.0"},
-            )
-            with request.urlopen(req) as response:
-                self.data = response.read().decode('UTF-8')
-                self.gpg.import_keys(self.data)
-            return
-        
-        if 'fingerprint' in kwargs:
-            if not 'keyserver' in kwargs:
-                kwargs['keyserver'] = SKS_KEYSERVER
-            
-            if not 'keypath' in kwargs:
-                kwargs['keypath'] = SKS_KEYLOOKUP_PATH
-            
-            key_url = kwargs['keyserver'] + kwargs['keypath'] + kwargs['fingerprint']
-            req = request.Request(key_url)
-            with request.urlopen(req) as response:
-                self.data = response.read().decode('UTF-8')
-                self.gpg.import_keys(self.data)
+        if 'url' in kwargs or 'fingerprint' in kwargs:
+            self.data = download_key(**kwargs)
+            self.import_keys(self.data)
             return
         
         raise TypeError(
@@ -214,4 +299,267 @@ class SourceKey:
         )
         
 
+def _keyrings_by_hash() -> dict:
+    """Get the keyrings in the keys directory, grouped by content hash."""
+    keyrings:dict = {}
+    keys_dir = Path(util.KEYS_DIR)
+    if not keys_dir.is_dir():
+        return keyrings
+    
+    for path in sorted(keys_dir.iterdir()):
+        if path.suffix not in ('.gpg', '.asc') or not path.is_file():
+            continue
+        try:
+            data = path.read_bytes()
+        except OSError as err:
+            log.debug('Could not read keyring %s: %s', path, err)
+            continue
+        keyrings.setdefault(cache.content_hash(data), []).append(path)
+    return keyrings
+
+def find_keyring(data:bytes):
+    """Find an installed keyring with exactly the given contents.
+
+    Arguments:
+        data(bytes): The contents of the keyring
+    
+    Returns: Path
+        The path of the first matching keyring in util.KEYS_DIR, or None
+    """
+    paths = _keyrings_by_hash().get(cache.content_hash(data))
+    if paths:
+        return paths[0]
+    return None
+
+def find_identical_keyrings() -> list:
+    """Find keyrings in the keys directory which have the same contents.
 
+    Returns: list
+        A sorted list of paths for each set of two or more identical keyrings
+    """
+    return [
+        paths for paths in _keyrings_by_hash().values() if len(paths) > 1
+    ]
+
+def download_key(timeout:float = FETCH_TIMEOUT, **kwargs) -> bytes:
+    """Download key data from a URL or a keyserver.
+
+    Keys which were downloaded before are loaded from the cache instead, see 
+    :mod:`repolib.cache`. Downloads use the shared :mod:`repolib.httpclient`
+    client, and the whole download, including retries, must finish within 
+    `timeout`.
+
+    Keyword Arguments:
+        url(str): A URL to download key data from
+        fingerprint(str): A key fingerprint to download from a keyserver
+            keyservers(list): Keyservers to try, see lookup_fingerprint()
+            keyserver(str): A single keyserver to download from instead.
+            keypath(str): The path on the keyserver from which to download.
+        timeout(float): Seconds allowed for the download (Default: 
+            FETCH_TIMEOUT)
+
+    Returns: bytes
+        The downloaded key data, which may be binary or ASCII-armored
+    """
+    if 'url' not in kwargs and 'fingerprint' not in kwargs:
+        raise TypeError('download_key() requires a url or fingerprint argument')
+
+    url = kwargs.get('url', '')
+    fingerprint = '' if url else kwargs['fingerprint']
+    cached = cache.get_downloaded_key(url=url, fingerprint=fingerprint)
+    if cached is not None:
+        log.debug('Using cached key for %s', url or fingerprint)
+        return cached
+    if cache.OFFLINE:
+        raise KeyFileError(
+            f'The key for {url or fingerprint} is not cached and RepoLib is '
+            'offline'
+        )
+
+    keypath = kwargs.get('keypath', SKS_KEYLOOKUP_PATH)
+    if url:
+        data = httpclient.get(url, timeout=timeout, max_size=MAX_KEY_SIZE)
+    elif 'keyserver' in kwargs:
+        data = httpclient.get(
+            kwargs['keyserver'] + keypath + fingerprint,
+            timeout=timeout,
+            max_size=MAX_KEY_SIZE
+        )
+    else:
+        data = lookup_fingerprint(
+            fingerprint, 
+            keyservers=kwargs.get('keyservers'), 
+            keypath=keypath, 
+            timeout=timeout
+        )
+    
+    try:
+        fingerprints = [key['fingerprint'] for key in openpgp.read_keys(data)]
+    except openpgp.OpenPGPError:
+        fingerprints = []
+    if fingerprints:
+        cache.store_downloaded_key(
+            data, url=url, fingerprint=fingerprint, fingerprints=fingerprints
+        )
+    return data
+
+def _normalize_fingerprint(fingerprint:str) -> str:
+    """Get a fingerprint or key ID as bare uppercase hex."""
+    fingerprint = fingerprint.replace(' ', '').upper()
+    if fingerprint.startswith('0X'):
+        fingerprint = fingerprint[2:]
+    return fingerprint
+
+def _check_fingerprint(data:bytes, fingerprint:str) -> None:
+    """Check that downloaded key data contains the requested key."""
+    found:list = []
+    for key in openpgp.read_keys(data):
+        found.append(key['fingerprint'])
+        found.extend(subkey[2] for subkey in key.get('subkeys', []))
+    
+    for key_fingerprint in found:
+        if key_fingerprint == fingerprint:
+            return
+        # Allow looking up keys by key ID
+        if len(fingerprint) < 40 and key_fingerprint.endswith(fingerprint):
+            return
+    raise KeyFileError(f'The response does not contain the key {fingerprint}')
+
+def lookup_fingerprint(
+    fingerprint:str, 
+    keyservers:list = None, 
+    keypath:str = SKS_KEYLOOKUP_PATH, 
+    timeout:float = FETCH_TIMEOUT, 
+    hedge_delay:float = HEDGE_DELAY
+) -> bytes:
+    """Download a key by its fingerprint from the fastest of several keyservers.
+
+    Keyservers are tried in order of their recorded latency, falling back to 
+    the given order. If a keyserver hasn't answered after `hedge_delay`, or 
+    fails, the next one is started as well. The first response containing the
+    requested key is used and the other requests are stopped before they retry.
+    How long each keyserver took is recorded for next time.
+
+    Arguments:
+        fingerprint(str): The fingerprint of the key
+        keyservers(list): The keyserver URLs to use (Default: KEYSERVERS)
+        keypath(str): The lookup path on the keyservers
+        timeout(float): Seconds allowed for the whole lookup (Default: 
+            FETCH_TIMEOUT)
+        hedge_delay(float): Seconds to wait for a keyserver before trying 
+            the next one too (Default: HEDGE_DELAY)
+
+    Returns: bytes
+        The downloaded key data
+    """
+    wanted = _normalize_fingerprint(fingerprint)
+    known:dict = cache.get_keyserver_latencies()
+    servers:list = sorted(
+        keyservers or KEYSERVERS, key=lambda server: known.get(server, math.inf)
+    )
+    deadline = time.monotonic() + timeout
+    results:queue.Queue = queue.Queue()
+    started:dict = {}
+    latencies:dict = {}
+    errors:list = []
+    stop = threading.Event()
+
+    def fetch(server:str) -> None:
+        try:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise KeyFileError(f'No time left to look up {wanted}')
+            data = httpclient.get(
+                server + keypath + wanted,
+                timeout=remaining,
+                max_size=MAX_KEY_SIZE,
+                stop=stop
+            )
+            _check_fingerprint(data, wanted)
+            results.put((server, data, None))
+        except Exception as err:
+            results.put((server, None, err))
+
+    try:
+        while servers or len(latencies) < len(started):
+            if servers and deadline > time.monotonic():
+                server = servers.pop(0)
+                log.debug('Looking up %s on %s', wanted, server)
+                started[server] = time.monotonic()
+                # Abandoned lookups mustn't keep the process running
+                threading.Thread(target=fetch, args=(server,), daemon=True).start()
+            
+            wait = deadline - time.monotonic()
+            if servers:
+                wait = min(wait, hedge_delay)
+            if wait <= 0:
+                break
+            try:
+                server, data, err = results.get(timeout=wait)
+            except queue.Empty:
+                continue
+
+            if err:
+                log.debug('Lookup on %s failed: %s', server, err)
+                errors.append(f'{server}: {err}')
+                # Make failing keyservers the last choice next time
+                latencies[server] = timeout
+                continue
+            
+            latencies[server] = time.monotonic() - started[server]
+            return data
+    finally:
+        stop.set()
+        # Abandoned keyservers took at least this long
+        for server in started:
+            elapsed = time.monotonic() - started[server]
+            if server not in latencies and elapsed > known.get(server, 0):
+                latencies[server] = elapsed
+        cache.record_keyserver_latencies(latencies)
+    
+    if not errors:
+        errors.append(f'No response within {timeout} seconds')
+    raise KeyFileError(
+        f'Could not download the key {fingerprint}: {"; ".join(errors)}'
+    )
+
+def load_many_key_data(requests:list, workers:int = FETCH_WORKERS, timeout:float = FETCH_TIMEOUT) -> dict:
+    """Download and load the data for many keys at once.
+
+    Downloads run concurrently, with at most `workers` at a time, and each 
+    must finish within `timeout`. The keys are then imported one at a time. 
+    A failure for one key doesn't affect the others.
+
+    Arguments:
+        requests(list): (SourceKey, kwargs) pairs, where kwargs are the 
+            keyword arguments for that key's load_key_data()
+        workers(int): The most downloads to run at once (Default: 
+            FETCH_WORKERS)
+        timeout(float): Seconds allowed for each download (Default: 
+            FETCH_TIMEOUT)
+    
+    Returns: dict
+        The exception for each key which failed, or None for those which were
+        loaded
+    """
+    results:dict = {}
+    downloads:dict = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        for key, kwargs in requests:
+            if key.path.exists() or not ('url' in kwargs or 'fingerprint' in kwargs):
+                # Nothing to download
+                continue
+            kwargs = {'timeout': timeout, **kwargs}
+            downloads[key] = pool.submit(download_key, **kwargs)
+        
+        for key, kwargs in requests:
+            try:
+                if key in downloads:
+                    key.load_key_data(raw=downloads[key].result())
+                else:
+                    key.load_key_data(**kwargs)
+                results[key] = None
+            except Exception as err:
+                log.warning('Could not load key %s: %s', key.path.name, err)
+                results[key] = err
+    return results
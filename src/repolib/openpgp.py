@@ -0,0 +1,525 @@
+#!/usr/bin/python3
+
+"""
+Copyright (c) 2022, Ian Santopietro
+All rights reserved.
+
+This file is part of RepoLib.
+
+RepoLib is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RepoLib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
+
+A minimal OpenPGP packet reader (RFC 4880 and RFC 9580) for inspecting
+public keyrings, and for installing them, without running gpg.
+
+Only the information apt-manage shows is read: fingerprints, key IDs, user
+IDs, creation and expiry dates, lengths, algorithms and capabilities.
+Signatures are not verified; expiry and capabilities are taken from the
+latest self-signature. Anything that can't be read raises OpenPGPError, so
+callers can fall back to gpg.
+"""
+
+import base64
+import binascii
+import hashlib
+import time
+
+from . import util
+
+TAG_SIGNATURE = 2
+TAG_SECRET_KEY = 5
+TAG_PUBLIC_KEY = 6
+TAG_SECRET_SUBKEY = 7
+TAG_USER_ID = 13
+TAG_PUBLIC_SUBKEY = 14
+TAG_USER_ATTRIBUTE = 17
+
+# The packets which may appear in exported public keys
+PUBLIC_KEY_TAGS = (
+    TAG_PUBLIC_KEY, TAG_PUBLIC_SUBKEY, TAG_USER_ID, TAG_USER_ATTRIBUTE, 
+    TAG_SIGNATURE,
+)
+
+CRC24_INIT = 0xb704ce
+CRC24_POLY = 0x1864cfb
+
+SUBPACKET_CREATED = 2
+SUBPACKET_KEY_EXPIRES = 9
+SUBPACKET_ISSUER = 16
+SUBPACKET_KEY_FLAGS = 27
+SUBPACKET_ISSUER_FINGERPRINT = 33
+
+SIG_KEY_REVOCATION = 0x20
+SIG_SUBKEY_BINDING = 0x18
+SIG_DIRECT_KEY = 0x1f
+SIG_CERTIFICATIONS = (0x10, 0x11, 0x12, 0x13)
+
+# Key flags implied by each public key algorithm, for keys without them
+ALGO_FLAGS = {
+    1: 0x2f, 2: 0x0c, 3: 0x03, 16: 0x0c, 17: 0x23, 18: 0x0c, 19: 0x23,
+    22: 0x23, 25: 0x0c, 26: 0x0c, 27: 0x23, 28: 0x23,
+}
+RSA_ALGOS = (1, 2, 3)
+MPI_KEY_ALGOS = (1, 2, 3, 16, 17)
+CURVE_KEY_ALGOS = (18, 19, 22)
+
+# Sizes of keys with a fixed length (RFC 9580 native curve keys)
+FIXED_KEY_LENGTHS = {25: 255, 26: 448, 27: 255, 28: 448}
+
+# Curve OIDs (DER body, without the tag and length), and their sizes
+CURVE_LENGTHS = {
+    bytes.fromhex('2a8648ce3d030107'): 256,             # NIST P-256
+    bytes.fromhex('2b81040022'): 384,                   # NIST P-384
+    bytes.fromhex('2b81040023'): 521,                   # NIST P-521
+    bytes.fromhex('2b2403030208010107'): 256,           # brainpoolP256r1
+    bytes.fromhex('2b240303020801010b'): 384,           # brainpoolP384r1
+    bytes.fromhex('2b240303020801010d'): 512,           # brainpoolP512r1
+    bytes.fromhex('2b06010401da470f01'): 255,           # Ed25519
+    bytes.fromhex('2b060104019755010501'): 255,         # Curve25519
+    bytes.fromhex('2b6571'): 448,                       # Ed448
+    bytes.fromhex('2b656f'): 448,                       # X448
+}
+
+# Key flag bits, in the order gpg prints capabilities
+KEY_FLAGS = (
+    (0x0c, 'e'),
+    (0x02, 's'),
+    (0x01, 'c'),
+    (0x20, 'a'),
+)
+
+class OpenPGPError(util.RepoError):
+    """ Exceptions related to reading OpenPGP data."""
+
+    def __init__(self, *args, code=1, **kwargs):
+        """Exceptions related to reading OpenPGP data.
+
+        Arguments:
+            code (:obj:`int`, optional, default=1): Exception error code.
+    """
+        super().__init__(*args, **kwargs)
+        self.code = code
+
+def _make_crc24_table() -> tuple:
+    """Build the lookup table for crc24()."""
+    table = []
+    for byte in range(256):
+        crc = byte << 16
+        for _bit in range(8):
+            crc <<= 1
+            if crc & 0x1000000:
+                crc ^= CRC24_POLY
+        table.append(crc & 0xffffff)
+    return tuple(table)
+
+_CRC24_TABLE = _make_crc24_table()
+
+def crc24(data:bytes) -> int:
+    """Calculate the CRC-24 checksum used in ASCII armor.
+
+    Arguments:
+        data(bytes): The binary data
+
+    Returns: int
+        The checksum
+    """
+    crc = CRC24_INIT
+    table = _CRC24_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xffffff) ^ table[(crc >> 16) ^ byte]
+    return crc
+
+def dearmor(data:bytes) -> bytes:
+    """Convert ASCII-armored OpenPGP data to binary.
+
+    Data which isn't armored is returned unchanged. If there are several
+    armored blocks, their contents are joined. Blocks with a checksum line
+    must match it.
+
+    Arguments:
+        data(bytes): The armored data
+
+    Returns: bytes
+        The binary data
+    """
+    if isinstance(data, str):
+        data = data.encode()
+    if b'-----BEGIN PGP' not in data:
+        return data
+
+    output = b''
+    lines = iter(data.splitlines())
+    for line in lines:
+        if not line.strip().startswith(b'-----BEGIN PGP'):
+            continue
+        # Skip the armor headers, which end with a blank line
+        for line in lines:
+            if not line.strip() or b':' not in line:
+                break
+        body = [line.strip()] if line.strip() else []
+        checksum = b''
+        for line in lines:
+            line = line.strip()
+            if line.startswith(b'-----END PGP'):
+                break
+            if line.startswith(b'=') and len(line) == 5:
+                checksum = line[1:]
+                continue
+            body.append(line)
+        try:
+            block = base64.b64decode(b''.join(body), validate=True)
+            if checksum:
+                expected = int.from_bytes(base64.b64decode(checksum), 'big')
+        except binascii.Error as err:
+            raise OpenPGPError(f'Invalid armored data: {err}') from err
+        if checksum and crc24(block) != expected:
+            raise OpenPGPError('The armored data does not match its checksum')
+        output += block
+    return output
+
+def public_keyring(data:bytes) -> bytes:
+    """Convert exported public keys to a binary keyring.
+
+    The result is the binary form of the keys, which apt can use directly as
+    a keyring. Only data which contains public keys and nothing else is 
+    accepted.
+
+    Arguments:
+        data(bytes): The keys, binary or ASCII-armored
+
+    Returns: bytes
+        The binary keyring
+    """
+    binary = dearmor(data)
+    tags = [tag for tag, _body in read_packets(binary)]
+    if not tags or tags[0] != TAG_PUBLIC_KEY:
+        raise OpenPGPError('The data does not start with a public key')
+    for tag in tags:
+        if tag not in PUBLIC_KEY_TAGS:
+            raise OpenPGPError(f'Unexpected packet type {tag} in public keys')
+    
+    # Make sure each key can be read
+    read_keys(binary)
+    return binary
+
+def read_packets(data:bytes):
+    """Split binary OpenPGP data into packets.
+
+    Arguments:
+        data(bytes): The binary data
+
+    Yields: (int, bytes)
+        The tag and body of each packet
+    """
+    pos = 0
+    end = len(data)
+    while pos < end:
+        header = data[pos]
+        pos += 1
+        if not header & 0x80:
+            raise OpenPGPError(f'Invalid packet header at offset {pos - 1}')
+
+        if header & 0x40:
+            # New format header, which may be split into partial lengths
+            tag = header & 0x3f
+            body = b''
+            while True:
+                length, pos, partial = _read_new_length(data, pos)
+                body += data[pos:pos + length]
+                pos += length
+                if not partial:
+                    break
+        else:
+            tag = (header >> 2) & 0x0f
+            length_type = header & 0x03
+            if length_type == 3:
+                length = end - pos
+            else:
+                size = 1 << length_type
+                length = int.from_bytes(data[pos:pos + size], 'big')
+                pos += size
+            body = data[pos:pos + length]
+            pos += length
+
+        if pos > end:
+            raise OpenPGPError('Truncated packet')
+        yield tag, body
+
+def _read_new_length(data:bytes, pos:int) -> tuple:
+    """Read a new format packet length.
+
+    Returns: (int, int, bool)
+        The length, the new position and whether this is a partial length
+    """
+    try:
+        first = data[pos]
+        if first < 192:
+            return first, pos + 1, False
+        if first < 224:
+            return ((first - 192) << 8) + data[pos + 1] + 192, pos + 2, False
+        if first == 255:
+            return int.from_bytes(data[pos + 1:pos + 5], 'big'), pos + 5, False
+        return 1 << (first & 0x1f), pos + 1, True
+    except IndexError as err:
+        raise OpenPGPError('Truncated packet length') from err
+
+def _mpi_bits(body:bytes, pos:int) -> tuple:
+    """Read an MPI's bit count, returning it and the position after the MPI."""
+    bits = int.from_bytes(body[pos:pos + 2], 'big')
+    return bits, pos + 2 + (bits + 7) // 8
+
+def parse_key(tag:int, body:bytes) -> dict:
+    """Read a public key or subkey packet.
+
+    Arguments:
+        tag(int): The packet tag
+        body(bytes): The packet body
+
+    Returns: dict
+        The key's details, in the form python-gnupg uses
+    """
+    if len(body) < 6:
+        raise OpenPGPError('Truncated key packet')
+
+    version = body[0]
+    created = int.from_bytes(body[1:5], 'big')
+    expires = 0
+
+    if version in (2, 3):
+        expire_days = int.from_bytes(body[5:7], 'big')
+        if expire_days:
+            expires = created + expire_days * 86400
+        algo = body[7]
+        if algo not in RSA_ALGOS:
+            raise OpenPGPError(f'Unsupported v3 key algorithm {algo}')
+        n_bits, pos = _mpi_bits(body, 8)
+        modulus = body[10:pos]
+        e_bits, e_end = _mpi_bits(body, pos)
+        exponent = body[pos + 2:e_end]
+        fingerprint = hashlib.md5(modulus + exponent).hexdigest()
+        keyid = modulus[-8:].hex()
+        material = 8
+
+    elif version == 4:
+        algo = body[5]
+        material = 6
+        header = b'\x99' + len(body).to_bytes(2, 'big')
+        fingerprint = hashlib.sha1(header + body).hexdigest()
+        keyid = fingerprint[-16:]
+
+    elif version in (5, 6):
+        algo = body[5]
+        material = 10
+        prefix = b'\x9a' if version == 5 else b'\x9b'
+        header = prefix + len(body).to_bytes(4, 'big')
+        fingerprint = hashlib.sha256(header + body).hexdigest()
+        keyid = fingerprint[:16]
+
+    else:
+        raise OpenPGPError(f'Unsupported key version {version}')
+
+    return {
+        'type': 'pub' if tag in (TAG_PUBLIC_KEY, TAG_SECRET_KEY) else 'sub',
+        'trust': '-',
+        'length': str(_key_length(algo, body, material)),
+        'algo': str(algo),
+        'keyid': keyid.upper(),
+        'date': str(created),
+        'expires': str(expires) if expires else '',
+        'fingerprint': fingerprint.upper(),
+        'cap': '',
+    }
+
+def _key_length(algo:int, body:bytes, pos:int) -> int:
+    """Get the size of a key from its key material."""
+    if algo in FIXED_KEY_LENGTHS:
+        return FIXED_KEY_LENGTHS[algo]
+    if algo in MPI_KEY_ALGOS:
+        return _mpi_bits(body, pos)[0]
+    if algo in CURVE_KEY_ALGOS:
+        oid_length = body[pos]
+        oid = body[pos + 1:pos + 1 + oid_length]
+        if oid in CURVE_LENGTHS:
+            return CURVE_LENGTHS[oid]
+    raise OpenPGPError(f'Unsupported key algorithm {algo}')
+
+def parse_signature(body:bytes) -> dict:
+    """Read the parts of a signature packet needed for key information.
+
+    Arguments:
+        body(bytes): The packet body
+
+    Returns: dict
+        The signature type, creation time, issuer, key expiry and key flags
+    """
+    version = body[0] if body else 0
+    if version == 3:
+        return {
+            'type': body[2],
+            'created': int.from_bytes(body[3:7], 'big'),
+            'issuer': body[7:15].hex().upper(),
+        }
+    if version not in (4, 5, 6):
+        raise OpenPGPError(f'Unsupported signature version {version}')
+
+    signature = {'type': body[1]}
+    size = 4 if version == 6 else 2
+    pos = 4
+    for hashed in (True, False):
+        length = int.from_bytes(body[pos:pos + size], 'big')
+        pos += size
+        subpackets = body[pos:pos + length]
+        pos += length
+        _read_subpackets(subpackets, signature, hashed)
+    return signature
+
+def _read_subpackets(data:bytes, signature:dict, hashed:bool) -> None:
+    """Read the signature subpackets we need into signature."""
+    pos = 0
+    while pos < len(data):
+        first = data[pos]
+        if first < 192:
+            length = first
+            pos += 1
+        elif first < 255:
+            length = ((first - 192) << 8) + data[pos + 1] + 192
+            pos += 2
+        else:
+            length = int.from_bytes(data[pos + 1:pos + 5], 'big')
+            pos += 5
+        kind = data[pos] & 0x7f
+        value = data[pos + 1:pos + length]
+        pos += length
+
+        if kind == SUBPACKET_ISSUER:
+            signature['issuer'] = value.hex().upper()
+        elif kind == SUBPACKET_ISSUER_FINGERPRINT and value:
+            signature['issuer_fingerprint'] = value[1:].hex().upper()
+        elif not hashed:
+            # Only trust the other subpackets if they were signed
+            continue
+        elif kind == SUBPACKET_CREATED:
+            signature['created'] = int.from_bytes(value, 'big')
+        elif kind == SUBPACKET_KEY_EXPIRES:
+            signature['key_expires'] = int.from_bytes(value, 'big')
+        elif kind == SUBPACKET_KEY_FLAGS and value:
+            signature['flags'] = value[0]
+
+def _is_self_signature(signature:dict, key:dict) -> bool:
+    """Check whether a signature was made by the given key."""
+    if 'issuer_fingerprint' in signature:
+        return signature['issuer_fingerprint'] == key['fingerprint']
+    return signature.get('issuer', key['keyid']) == key['keyid'][-16:]
+
+def _caps(algo:int, flags:int = None, primary:bool = False) -> str:
+    """Get gpg's capability letters for a key."""
+    if flags is None:
+        flags = ALGO_FLAGS.get(algo, 0)
+        if not primary:
+            # Only primary keys can certify
+            flags &= ~0x01
+    return ''.join(letter for mask, letter in KEY_FLAGS if flags & mask)
+
+def read_keys(data:bytes) -> list:
+    """Read the keys in a keyring.
+
+    Arguments:
+        data(bytes): The keyring, binary or ASCII-armored
+
+    Returns: list
+        A dict for each primary key, like python-gnupg's list_keys()
+    """
+    keys:list = []
+    key:dict = None
+    current:dict = None
+    # The newest value of each self-signature field, by key fingerprint
+    latest:dict = {}
+
+    for tag, body in read_packets(dearmor(data)):
+        if tag in (TAG_PUBLIC_KEY, TAG_SECRET_KEY):
+            key = parse_key(tag, body)
+            key.update({'uids': [], 'subkeys': [], 'subkey_info': {}})
+            keys.append(key)
+            current = key
+
+        elif key is None:
+            raise OpenPGPError('Keyring data does not start with a key')
+
+        elif tag in (TAG_PUBLIC_SUBKEY, TAG_SECRET_SUBKEY):
+            current = parse_key(tag, body)
+            key['subkey_info'][current['keyid']] = current
+            key['subkeys'].append(
+                [current['keyid'], '', current['fingerprint'], '']
+            )
+
+        elif tag == TAG_USER_ID:
+            key['uids'].append(body.decode('utf-8', errors='replace'))
+
+        elif tag == TAG_SIGNATURE:
+            try:
+                signature = parse_signature(body)
+            except OpenPGPError:
+                # Signatures we can't read don't stop us reading the keys
+                continue
+            sig_type = signature['type']
+            if not _is_self_signature(signature, key):
+                continue
+            if sig_type == SIG_KEY_REVOCATION:
+                key['trust'] = 'r'
+            elif sig_type in (*SIG_CERTIFICATIONS, SIG_DIRECT_KEY, SIG_SUBKEY_BINDING):
+                _apply_signature(current, signature, latest)
+
+    for key in keys:
+        _set_caps(key, latest)
+    return keys
+
+def _apply_signature(key:dict, signature:dict, latest:dict) -> None:
+    """Update a key from a self-signature.
+
+    Each of the key's expiry and flags comes from the newest self-signature
+    which sets it.
+    """
+    fields = latest.setdefault(key['fingerprint'], {})
+    created = signature.get('created', 0)
+    for field in ('key_expires', 'flags'):
+        if field not in signature:
+            continue
+        if field in fields and fields[field][0] > created:
+            continue
+        fields[field] = (created, signature[field])
+    
+    if 'key_expires' in fields:
+        expires = fields['key_expires'][1]
+        key['expires'] = str(int(key['date']) + expires) if expires else ''
+
+def _set_caps(key:dict, latest:dict) -> None:
+    """Set the validity and capabilities of a key and its subkeys, like gpg 
+    prints them.
+    """
+    now = time.time()
+    subkeys = list(key['subkey_info'].values())
+    usable = ''
+    for index, item in enumerate([key, *subkeys]):
+        flags = latest.get(item['fingerprint'], {}).get('flags', (0, None))[1]
+        item['cap'] = _caps(int(item['algo']), flags, primary=item is key)
+        if item['trust'] == '-' and item['expires'] and int(item['expires']) < now:
+            item['trust'] = 'e'
+        if item['trust'] == '-':
+            usable += item['cap']
+        if index:
+            key['subkeys'][index - 1][1] = item['cap']
+    if key['trust'] != '-':
+        return
+    key['cap'] += ''.join(
+        letter.upper() for _, letter in KEY_FLAGS if letter in usable
+    )
@@ -239,7 +239,7 @@ class ParseDeb:
                     f'Could not parse line {self.curr_line}: option {opt} is '
                     'not a valid debian repository option or is unsupported.'
                 )
-            parsed_options[key] = value
+            parsed_options[key] = util.intern_value(value)
         
         return parsed_options
 
@@ -338,18 +338,17 @@ class ParseDeb:
         
         line_uri = parts.pop(0)
         if util.url_validator(line_uri):
-            line_parsed['uri'] = line_uri
+            line_parsed['uri'] = util.intern_value(line_uri)
         
         else:
             raise DebParseError(
                 f'The line "{self.curr_line}" has invalid URI: {line_uri}'
             )
 
-        line_parsed['suite'] = parts.pop(0)
+        line_parsed['suite'] = util.intern_value(parts.pop(0))
         
-        line_components:list = []
         for comp in parts:
-            line_parsed['components'].append(comp)
+            line_parsed['components'].append(util.intern_value(comp))
         
         
         has_type = line_parsed['repo_type']
@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+
+"""
+Copyright (c) 2022, Ian Santopietro
+All rights reserved.
+
+This file is part of RepoLib.
+
+RepoLib is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RepoLib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
+
+Client for the privileged DBus service, used when RepoLib doesn't have
+permission to make a change itself.
+
+The connection to the service is made the first time it's needed and shared
+by every thread for the rest of the process. The service can be disabled (e.g. in containers
+without a system bus) by setting REPOLIB_NO_DBUS in the environment, and is
+disabled automatically if dbus-python isn't installed.
+"""
+
+import logging
+import os
+import threading
+
+try:
+    import dbus
+except ImportError:
+    dbus = None
+
+from . import util
+
+BUS_NAME = 'org.pop_os.repolib'
+OBJECT_PATH = '/Repo'
+UNKNOWN_METHOD = 'org.freedesktop.DBus.Error.UnknownMethod'
+SERVICE_UNKNOWN = 'org.freedesktop.DBus.Error.ServiceUnknown'
+
+# Errors meaning the caller isn't allowed to make the change
+_DENIED_ERRORS = (
+    'org.freedesktop.DBus.Error.AccessDenied',
+    'org.freedesktop.DBus.Error.AuthFailed',
+    'org.pop_os.repolib.PermissionDeniedByPolicy',
+)
+
+# Errors after which the proxy should be recreated on the next call
+_RECONNECT_ERRORS = (
+    SERVICE_UNKNOWN,
+    'org.freedesktop.DBus.Error.NoReply',
+    'org.freedesktop.DBus.Error.Disconnected',
+)
+
+ENABLED = dbus is not None and not os.environ.get('REPOLIB_NO_DBUS')
+
+log = logging.getLogger(__name__)
+_proxy = None
+_proxy_lock = threading.Lock()
+
+class PrivilegedError(util.RepoError):
+    """ Exceptions related to the privileged service."""
+
+    def __init__(self, *args, code=1, dbus_name='', **kwargs):
+        """Exceptions related to the privileged service.
+
+        Arguments:
+            code (:obj:`int`, optional, default=1): Exception error code.
+            dbus_name (:obj:`str`, optional): The DBus error name, if any.
+    """
+        super().__init__(*args, **kwargs)
+        self.code = code
+        self.dbus_name = dbus_name
+
+def set_enabled(enabled:bool = True) -> None:
+    """Enable or disable use of the privileged service.
+
+    Arguments:
+        enabled(bool): Whether the service should be used (Default: True)
+    """
+    global ENABLED
+    global _proxy
+    with _proxy_lock:
+        ENABLED = enabled and dbus is not None
+        _proxy = None
+
+def is_running() -> bool:
+    """Check whether the service is already running, without starting it.
+
+    Returns: bool
+        `True` if the service is enabled and running
+    """
+    if not ENABLED:
+        return False
+    try:
+        return bool(dbus.SystemBus().name_has_owner(BUS_NAME))
+    except dbus.exceptions.DBusException:
+        return False
+
+def get_proxy():
+    """Get the proxy object for the service, connecting if needed.
+
+    Returns: dbus.proxies.ProxyObject
+        The service's /Repo object
+    """
+    global _proxy
+    if not ENABLED:
+        raise PrivilegedError('The privileged service is disabled')
+
+    with _proxy_lock:
+        if _proxy is None:
+            try:
+                bus = dbus.SystemBus()
+                _proxy = bus.get_object(BUS_NAME, OBJECT_PATH)
+            except dbus.exceptions.DBusException as err:
+                raise PrivilegedError(
+                    f'Could not connect to the privileged service: {err}',
+                    dbus_name=err.get_dbus_name() or ''
+                ) from err
+        return _proxy
+
+def call(method:str, *args, **kwargs):
+    """Call a method on the privileged service.
+
+    Arguments:
+        method(str): The name of the method to call
+        *args: The arguments to the method
+        **kwargs: Keyword arguments for the proxy, e.g. `signature`
+
+    Returns:
+        The return value of the method
+    """
+    proxy = get_proxy()
+    try:
+        return getattr(proxy, method)(*args, **kwargs)
+    except dbus.exceptions.DBusException as err:
+        raise wrap_error(method, err) from err
+
+def wrap_error(method:str, err) -> PrivilegedError:
+    """Convert a DBus exception from the service into a PrivilegedError.
+
+    The proxy is reset if the error means the connection was lost.
+
+    Arguments:
+        method(str): The method which failed
+        err(dbus.exceptions.DBusException): The exception from dbus-python
+    
+    Returns: PrivilegedError
+        The error to raise
+    """
+    global _proxy
+    dbus_name = err.get_dbus_name() or ''
+    if dbus_name in _RECONNECT_ERRORS:
+        with _proxy_lock:
+            _proxy = None
+    return PrivilegedError(
+        f'Privileged call {method} failed: {err}', dbus_name=dbus_name
+    )
+
+def report(err:PrivilegedError) -> None:
+    """Tell the user that a change couldn't be made through the service.
+
+    Arguments:
+        err(PrivilegedError): The error from the service
+    """
+    log.debug('Privileged service error: %s', err)
+    if err.dbus_name == SERVICE_UNKNOWN:
+        log.critical('DBus service not found!')
+        print('Could not reach the RepoLib service. Please use `sudo`.')
+    elif err.dbus_name in _DENIED_ERRORS:
+        log.critical('The RepoLib service refused the change: %s', err)
+        print('Permission denied. Please use `sudo`.')
+    elif not err.dbus_name:
+        # The service is disabled or the system bus isn't available
+        log.critical(str(err))
+        print('Permission denied. Please use `sudo`.')
+    else:
+        log.critical('The RepoLib service could not make the change: %s', err)
+
+def exit_service() -> None:
+    """Ask the service to exit, if this process connected to it."""
+    global _proxy
+    with _proxy_lock:
+        proxy = _proxy
+        _proxy = None
+    if proxy is None:
+        return
+    try:
+        proxy.exit()
+    except dbus.exceptions.DBusException as err:
+        # The service may exit before replying
+        log.debug('Service exit: %s', err)
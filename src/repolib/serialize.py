@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+
+"""
+Copyright (c) 2022, Ian Santopietro
+All rights reserved.
+
+This file is part of RepoLib.
+
+RepoLib is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RepoLib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
+
+Compact binary serialization of sources, files and registries.
+
+The serialized form is a short header followed by a marshalled pair of a 
+string table and a payload. Payloads are nested tuples of integers which 
+index into the string table, so each distinct string is only stored once.
+Loggers, keys and GPG handles are never serialized; they are recreated from
+the source data when the data is loaded.
+
+The marshal format is only stable within a Python version, so the header 
+records the version which wrote the data and other versions reject it. 
+marshal isn't meant for untrusted input either; data should only be loaded 
+from RepoLib itself, such as the privileged service.
+"""
+
+import marshal
+import sys
+
+from . import util
+
+MAGIC = b'RPLB'
+VERSION = 2
+
+KIND_SOURCE = b'S'
+KIND_FILE = b'F'
+KIND_REGISTRY = b'R'
+
+# The Python version which wrote the data, as marshal requires
+PYTHON_VERSION = bytes(sys.version_info[:2])
+
+HEADER_LENGTH = len(MAGIC) + 2 + len(PYTHON_VERSION)
+
+class SerializationError(util.RepoError):
+    """ Exceptions related to serializing sources."""
+
+    def __init__(self, *args, code=1, **kwargs):
+        """Exceptions related to serializing sources.
+
+        Arguments:
+            code (:obj:`int`, optional, default=1): Exception error code.
+    """
+        super().__init__(*args, **kwargs)
+        self.code = code
+
+class StringTable:
+    """A table of the distinct strings in some serialized data.
+    
+    Attributes:
+        strings(list): The strings in the table, in order of addition
+    """
+
+    def __init__(self) -> None:
+        self.strings:list = []
+        self._index:dict = {}
+    
+    def add(self, string:str) -> int:
+        """Add a string to the table.
+
+        Arguments:
+            string(str): The string to add
+        
+        Returns: int
+            The index of the string in the table
+        """
+        try:
+            return self._index[string]
+        except KeyError:
+            index = len(self.strings)
+            self.strings.append(string)
+            self._index[string] = index
+            return index
+
+def pack(kind:bytes, table:StringTable, payload:tuple) -> bytes:
+    """Serialize a payload and its string table.
+
+    Arguments:
+        kind(bytes): The kind of object in the payload (KIND_*)
+        table(StringTable): The string table for the payload
+        payload(tuple): The payload data
+    
+    Returns: bytes
+        The serialized data
+    """
+    header = MAGIC + bytes([VERSION]) + kind + PYTHON_VERSION
+    return header + marshal.dumps((tuple(table.strings), payload))
+
+def unpack(data:bytes, kind:bytes) -> tuple:
+    """Deserialize data created by pack().
+
+    Arguments:
+        data(bytes): The serialized data
+        kind(bytes): The kind of object expected in the data (KIND_*)
+    
+    Returns: tuple(strings, payload)
+        strings(tuple): The string table, with shared copies of each string
+        payload(tuple): The payload data
+    """
+    if len(data) < HEADER_LENGTH or data[:len(MAGIC)] != MAGIC:
+        raise SerializationError('The data is not serialized RepoLib data')
+    
+    version = data[len(MAGIC)]
+    if version != VERSION:
+        raise SerializationError(
+            f'Unsupported serialization version {version} (expected {VERSION})'
+        )
+    
+    data_kind = data[len(MAGIC) + 1:len(MAGIC) + 2]
+    if data_kind != kind:
+        raise SerializationError(
+            f'The data contains a {data_kind.decode()} object, not a '
+            f'{kind.decode()} object'
+        )
+    
+    python_version = data[len(MAGIC) + 2:HEADER_LENGTH]
+    if python_version != PYTHON_VERSION:
+        raise SerializationError(
+            'The data was serialized by Python '
+            f'{python_version[0]}.{python_version[1]}, not '
+            f'{PYTHON_VERSION[0]}.{PYTHON_VERSION[1]}'
+        )
+    
+    try:
+        strings, payload = marshal.loads(data[HEADER_LENGTH:])
+    except (EOFError, ValueError, TypeError) as err:
+        raise SerializationError('The serialized data is corrupt') from err
+    if (
+        not isinstance(strings, tuple)
+        or not all(isinstance(string, str) for string in strings)
+    ):
+        raise SerializationError('The serialized string table is corrupt')
+    
+    strings = tuple(util.intern_value(string) for string in strings)
+    return strings, payload
+
+def load(data:bytes, kind:bytes, loader):
+    """Deserialize data created by pack() into an object.
+
+    Arguments:
+        data(bytes): The serialized data
+        kind(bytes): The kind of object expected in the data (KIND_*)
+        loader(callable): Creates the object from the string table and payload
+    
+    Returns:
+        The object returned by `loader`
+    """
+    strings, payload = unpack(data, kind)
+    try:
+        return loader(strings, payload)
+    except (IndexError, KeyError, TypeError, ValueError) as err:
+        raise SerializationError('The serialized payload is corrupt') from err
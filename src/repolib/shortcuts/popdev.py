@@ -23,13 +23,11 @@ along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
 import logging
 from pathlib import Path
 
-import dbus
-
 from repolib.key import SourceKey
 
 from ..source import Source, SourceError
 from ..file import SourceFile
-from .. import util
+from .. import changeset, util
 
 BASE_FORMAT = util.SourceFormat.DEFAULT
 BASE_URL = 'http://apt.pop-os.org/staging'
@@ -49,7 +47,6 @@ class PopdevSource(Source):
     Arguments:
         shortcut (str): The ppa: shortcut to process
     """
-    prefs_dir = Path('/etc/apt/preferences.d')
     default_format = BASE_FORMAT
 
     @staticmethod
@@ -88,33 +85,38 @@ class PopdevSource(Source):
         self.line = line
         self.twin_source:bool = True
         self.prefs_path = None
+        self.prefs_dirty:bool = False
         self.branch_name:str = ''
         self.branch_url:str = ''
         if line:
             self.load_from_shortcut(line)
     
-    def tasks_save(self, *args, **kwargs) -> None:
-        super().tasks_save(*args, **kwargs)
-        self.log.info('Saving prefs file for %s', self.ident)
+    @property
+    def prefs_contents(self) -> str:
+        """The contents of the apt preferences file for this branch"""
         prefs_contents = 'Package: *\n'
         prefs_contents += f'Pin: release o=pop-os-staging-{self.branch_url}\n'
         prefs_contents += 'Pin-Priority: 1002\n'
+        return prefs_contents
+    
+    def tasks_save(self, *args, **kwargs) -> None:
+        super().tasks_save(*args, **kwargs)
+        if not self.prefs_dirty:
+            self.log.debug('Prefs for %s are unchanged, skipping', self.ident)
+            return
+
+        self.log.info('Saving prefs file for %s', self.ident)
+        prefs_contents = self.prefs_contents
 
         self.log.debug('%s prefs for pin priority:\n%s', self.ident, prefs_contents)
 
-        try:
-            with open(self.prefs, mode='w') as prefs_file:
-                prefs_file.write(prefs_contents)
-        except PermissionError:
-            bus = dbus.SystemBus()
-            try:
-                privileged_object = bus.get_object('org.pop_os.repolib', '/Repo')
-                privileged_object.output_prefs_to_disk(str(self.prefs), prefs_contents)
-            except dbus.exceptions.DBusException:
-                self.log.critical('DBus service not found!')
-                print("Permission denied. Please use `sudo`.")
-                return
-        
+        with changeset.transaction() as changes:
+            changes.add(changeset.WRITE_PREFS, self.prefs, prefs_contents)
+            changes.on_commit(self._mark_prefs_saved)
+    
+    def _mark_prefs_saved(self) -> None:
+        """Marks the prefs file as saved once it has been written."""
+        self.prefs_dirty = False
         self.log.debug('Pin priority saved for %s', self.ident)
 
     
@@ -170,7 +172,8 @@ class PopdevSource(Source):
         self.key = key
         self.signed_by = str(self.key.path)
 
-        self.prefs_path = self.prefs_dir / f'pop-os-staging-{self.branch_name}'
+        self.prefs_path = Path(util.PREFS_DIR) / f'pop-os-staging-{self.branch_name}'
         self.prefs = self.prefs_path
+        self.prefs_dirty = True
 
         self.enabled = True
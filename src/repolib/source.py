@@ -27,10 +27,19 @@ from debian import deb822
 
 from .parsedeb import ParseDeb
 from .key import SourceKey
-from . import util
+from . import serialize, util
 
 DEFAULT_FORMAT = util.SourceFormat.LEGACY
 
+# Fields whose values are usually repeated across many sources
+SHARED_FIELDS = (
+    'Enabled', 'Types', 'URIs', 'Suites', 'Components', 'Architectures', 
+    'Languages', 'Targets', 'Signed-By', 'Trusted', 'PDiffs', 'By-Hash',
+)
+
+# Attributes managed by Deb822 itself, which snapshots must not share
+_DEB822_ATTRS = frozenset(vars(deb822.Deb822()))
+
 class SourceError(util.RepoError):
     """ Exception from a source object."""
 
@@ -135,6 +144,86 @@ class Source(deb822.Deb822):
         return False
 
 
+    def snapshot(self):
+        """Get a cheap copy of this source for previewing changes.
+
+        The copy shares the field values (which are immutable strings), the key
+        and the file with this source, so no parsing or deep copying is done. 
+        Setting a field on the copy replaces the value in the copy only, leaving
+        this source untouched.
+
+        Returns: Source
+            The copy of this source
+        """
+        clone = self.__class__.__new__(self.__class__)
+        deb822.Deb822.__init__(clone)
+        for attr, value in vars(self).items():
+            if attr in _DEB822_ATTRS:
+                continue
+            if isinstance(value, (list, dict)):
+                value = value.copy()
+            setattr(clone, attr, value)
+        for key in self:
+            clone[key] = self[key]
+        return clone
+
+    def to_bytes(self) -> bytes:
+        """Serialize this source into a compact binary form.
+
+        Only the source data is serialized. The key is reloaded from the 
+        `Signed-By` path when the data is loaded, and the file is not kept.
+
+        Returns: bytes
+            The serialized source, see :mod:`repolib.serialize`
+        """
+        table = serialize.StringTable()
+        return serialize.pack(serialize.KIND_SOURCE, table, self._pack(table))
+    
+    @classmethod
+    def from_bytes(cls, data:bytes):
+        """Load a source serialized with :meth:`to_bytes`.
+
+        Arguments:
+            data(bytes): The serialized source
+        
+        Returns: Source
+            The loaded source. This is always a plain Source, as with sources
+            loaded from files on disk.
+        """
+        return serialize.load(data, serialize.KIND_SOURCE, cls._unpack)
+
+    def _pack(self, table:serialize.StringTable) -> tuple:
+        """Get the serialization payload for this source."""
+        fields:list = []
+        for key in self:
+            fields.append(table.add(str(key)))
+            fields.append(table.add(str(self[key])))
+        comments = tuple(table.add(str(comment)) for comment in self.comments)
+        return (tuple(fields), comments, bool(self.twin_source))
+    
+    @staticmethod
+    def _unpack(strings:tuple, payload:tuple):
+        """Create a source from a serialization payload.
+
+        This skips the default values set by reset_values(), since every
+        field is present in the payload.
+        """
+        fields, comments, twin_source = payload
+        source = Source.__new__(Source)
+        source.log = logging.getLogger(__name__)
+        deb822.Deb822.__init__(source)
+        for index in range(0, len(fields), 2):
+            source[strings[fields[index]]] = strings[fields[index + 1]]
+        source.comments = [strings[index] for index in comments]
+        source.file = None
+        source.key = None
+        source.twin_source = twin_source
+        source.twin_enabled = False
+        source._update_legacy_options()
+        if source.signed_by:
+            source.load_key()
+        return source
+
     def get_description(self) -> str:
         """Get a UI-compatible description for a source. 
         
@@ -155,7 +244,7 @@ class Source(deb822.Deb822):
             The dictionary from gnupg with key info.
         """
         if self.key:
-            keys:list = self.key.gpg.list_keys()
+            keys:list = self.key.list_keys()
             if len(keys) > 1:
                 error_msg = (
                         f'The keyring for {self.ident} contains {len(keys)} keys'
@@ -242,10 +331,25 @@ class Source(deb822.Deb822):
 
         # DEB822 Source
         super().__init__(sequence=data)
+        self.intern_fields()
         if self.signed_by:
             self.load_key()
         return
     
+    def intern_fields(self) -> None:
+        """Replace repeated field values with their shared copies.
+
+        Fields which are unique to each source, like the name and ident, are
+        left alone, as are values which are already the shared copy.
+        """
+        for key in SHARED_FIELDS:
+            if key not in self:
+                continue
+            value = self[key]
+            shared = util.intern_value(value)
+            if shared is not value:
+                self[key] = shared
+    
     @property
     def sourcecode_enabled(self) -> bool:
         """`True` if this source also provides source code, otherwise `False`"""
@@ -273,7 +377,7 @@ class Source(deb822.Deb822):
             uri:str = self.uris[0].replace('/', ' ')
             uri_list:list = uri.split()
             uri_str:str = '-'.join(uri_list[1:])
-            branch_name:str = util.scrub_filename(uri_str)
+            branch_name:str = util.idents.canonical(uri_str)
             ident = f'{prefix}{branch_name}'
         ident += f'-{self.types[0].ident()}'
         try:
@@ -315,7 +419,11 @@ class Source(deb822.Deb822):
             else:
                 raise SourceError('No key configured for source {self.ident}')
         
-        if self.signed_by not in util.keys:
+        if self.key and str(self.key.path) == str(self.signed_by):
+            # Keep a newly-imported key, which may not be saved yet
+            util.keys[str(self.key.path)] = self.key
+        
+        elif self.signed_by not in util.keys:
             new_key = SourceKey()
             new_key.reset_path(path=self.signed_by)
             self.key = new_key
@@ -442,7 +550,7 @@ class Source(deb822.Deb822):
         """The list of source types for this source"""
         _types:list = []
         try:
-            for sourcetype in self['types'].split():
+            for sourcetype in util.split_value(self['Types']):
                 _types.append(util.SourceType(sourcetype))
         except KeyError:
             pass
@@ -458,46 +566,46 @@ class Source(deb822.Deb822):
                 _types.append(sourcetype)
         for sourcetype in _types:
             self['Types'] += f'{sourcetype.value} '
-        self['Types'] = self['Types'].strip()
+        self['Types'] = util.intern_value(self['Types'].strip())
     
 
     @property
     def uris(self) -> list:
         """The list of URIs for this source"""
         try:
-            return self['URIs'].split()
+            return util.split_value(self['URIs'])
         except KeyError:
             return []
     
     @uris.setter
     def uris(self, uris: list) -> None:
-        self['URIs'] = ' '.join(uris).strip()
+        self['URIs'] = util.intern_value(' '.join(uris).strip())
     
 
     @property
     def suites(self) -> list:
         """The list of URIs for this source"""
         try:
-            return self['Suites'].split()
+            return util.split_value(self['Suites'])
         except KeyError:
             return []
     
     @suites.setter
     def suites(self, suites: list) -> None:
-        self['Suites'] = ' '.join(suites).strip()
+        self['Suites'] = util.intern_value(' '.join(suites).strip())
 
 
     @property
     def components(self) -> list:
         """The list of URIs for this source"""
         try:
-            return self['Components'].split()
+            return util.split_value(self['Components'])
         except KeyError:
             return []
     
     @components.setter
     def components(self, components: list) -> None:
-        self['Components'] = ' '.join(components).strip()
+        self['Components'] = util.intern_value(' '.join(components).strip())
 
 
     @property
@@ -21,17 +21,26 @@ along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
 """
 
 import logging
+import os
+import re
 
 from pathlib import Path
 
-from . import util
-from .file import SourceFile
+from . import changeset, privileged, serialize, util
+from .file import SourceFile, SourceFileError
 from .source import Source
+from .key import SourceKey, find_identical_keyrings
 from .shortcuts import popdev, ppa
 
 
 log = logging.getLogger(__name__)
 
+# Keyrings in one-line options (signed-by=...) and deb822 Signed-By fields
+SIGNED_BY_RE = re.compile(
+    r'signed-by=(?P<option>[^\s\]]+)|^\s*Signed-By:[ \t]*(?P<field>\S+)',
+    re.IGNORECASE | re.MULTILINE
+)
+
 def load_all_sources() -> None:
     """Loads all of the sources present on the system."""
     log.info('Loading all sources')
@@ -40,29 +49,290 @@ def load_all_sources() -> None:
     util.files.clear()
     util.keys.clear()
     util.errors.clear()
+    util.idents.clear()
 
     sources_path = Path(util.SOURCES_DIR)
-    sources_files = sources_path.glob('*.sources')
-    legacy_files = sources_path.glob('*.list')
+    sources_files = sorted(sources_path.glob('*.sources'))
+    legacy_files = sorted(sources_path.glob('*.list'))
 
-    for file in [*sources_files, *legacy_files]:
-        if file.is_dir():
-            log.info("Ignoring directory '%s'", file)
-            continue
-        try:
-            sourcefile = SourceFile(name=file.stem)
-            log.debug('Loading %s', file)
-            sourcefile.load()
-            if file.name not in util.files:
-                util.files[file.name] = sourcefile
+    with util.sharing_values():
+        for file in [*sources_files, *legacy_files]:
+            if file.is_dir():
+                log.info("Ignoring directory '%s'", file)
+                continue
+            try:
+                sourcefile = SourceFile(name=file.stem)
+                log.debug('Loading %s', file)
+                sourcefile.load()
+                if file.name not in util.files:
+                    util.files[file.name] = sourcefile
 
-        except Exception as err:
-            util.errors[file.name] = err
+            except Exception as err:
+                util.errors[file.name] = err
     
+    # Colliding idents are renamed in memory only; the new ident is written
+    # out the next time the file is saved for some other reason.
     for f in util.files:
         file = util.files[f]
         for source in file.sources:
-            if source.ident in util.sources:
-                source.ident = f'{file.name}-{source.ident}'
-                source.file.save()
+            ident = util.idents.allocate(source.ident)
+            if ident != source.ident:
+                log.info(
+                    'Ident %s in %s is already in use, using %s',
+                    source.ident,
+                    file.path.name,
+                    ident
+                )
+                source.ident = ident
+            util.sources[source.ident] = source
+
+def allocate_ident(ident:str) -> str:
+    """Get an ident for a new source which isn't in use.
+
+    The ident must not be used by a loaded source or be the name of an 
+    existing source file, so sources must already be loaded.
+
+    Arguments:
+        ident(str): The preferred ident
+
+    Returns: str
+        `ident` if it's free, otherwise the next free numbered ident
+    """
+    for name in (*util.files, *util.errors):
+        util.idents.reserve(Path(name).stem)
+    return util.idents.allocate(ident)
+
+def get_sources_stamp() -> tuple:
+    """Get a stamp which changes whenever the sources on disk change.
+
+    Only the directory listing and file metadata are read, so this is much 
+    cheaper than parsing the sources to see if they changed.
+
+    Returns: tuple
+        The (name, mtime, size) of each source file
+    """
+    stamp:list = []
+    try:
+        with os.scandir(util.SOURCES_DIR) as entries:
+            for entry in entries:
+                if not entry.name.endswith(('.sources', '.list')):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                stamp.append((entry.name, stat.st_mtime_ns, stat.st_size))
+    except FileNotFoundError:
+        pass
+    return tuple(sorted(stamp))
+
+def load_from_service() -> bool:
+    """Load the sources from the privileged service, if it's already running.
+
+    The service keeps the sources parsed in memory, so this avoids parsing 
+    them again in each process. The service is never started just for this.
+
+    Returns: bool
+        `True` if the sources were loaded, otherwise load_all_sources() should
+        be used instead.
+    """
+    if not privileged.is_running():
+        return False
+    try:
+        data = privileged.call('get_registry', byte_arrays=True)
+        registry_from_bytes(bytes(data))
+    except util.RepoError as err:
+        log.debug('Could not load sources from the service: %s', err)
+        return False
+    log.info('Loaded sources from the service')
+    return True
+
+def get_all_key_info() -> dict:
+    """Get information about every keyring in use or installed.
+
+    This covers each keyring referenced by a loaded source and each keyring in
+    util.KEYS_DIR. Keyrings are read natively and cached where possible, so 
+    gpg is only run for keyrings which can't be read that way.
+
+    Returns: dict
+        For each keyring path, a dict of the `keys` it contains (as from 
+        SourceKey.list_keys()), the idents of the `sources` using it, and an
+        `error` message if it couldn't be read.
+    """
+    keyrings:dict = {}
+    for source in util.sources.values():
+        if source.signed_by:
+            keyrings.setdefault(str(source.signed_by), []).append(source.ident)
+    
+    keys_dir = Path(util.KEYS_DIR)
+    if keys_dir.is_dir():
+        for path in sorted(keys_dir.iterdir()):
+            if path.suffix in ('.gpg', '.asc'):
+                keyrings.setdefault(str(path), [])
+    
+    info:dict = {}
+    for path, idents in keyrings.items():
+        entry:dict = {'keys': [], 'sources': idents, 'error': ''}
+        info[path] = entry
+        if not Path(path).is_file():
+            entry['error'] = 'The keyring file does not exist'
+            continue
+        
+        key = util.keys.get(path)
+        if key is None:
+            key = SourceKey()
+            key.reset_path(path=path)
+        try:
+            entry['keys'] = list(key.list_keys())
+        except Exception as err:
+            log.debug('Could not read keyring %s: %s', path, err)
+            entry['error'] = str(err)
+    return info
+
+def consolidate_keyrings(dry_run:bool = False) -> dict:
+    """Replace identical keyrings in util.KEYS_DIR with a single copy.
+
+    For each set of identical keyrings, the one used by the most loaded 
+    sources is kept. Sources using the others are changed to use it, and the 
+    others are deleted, all in one transaction. Only keyrings which loaded 
+    sources use are replaced, and never ones which another apt source file 
+    (sources.list, or a file which couldn't be loaded) refers to, since those
+    can't be changed to match. Sources must already be loaded.
+
+    Arguments:
+        dry_run(bool): Only work out what would be changed (Default: False)
+
+    Returns: dict
+        The path of the keyring kept in place of each duplicate keyring
+    """
+    users:dict = {}
+    for source in util.sources.values():
+        if source.signed_by:
+            users.setdefault(str(source.signed_by), []).append(source)
+    unmanaged = _find_unmanaged_keyring_users()
+    
+    replacements:dict = {}
+    for paths in find_identical_keyrings():
+        paths = sorted(paths, key=lambda path: -len(users.get(str(path), [])))
+        keep = paths[0]
+        for path in paths[1:]:
+            if str(path) not in users:
+                # Nothing RepoLib manages uses it, so it isn't ours to remove
+                continue
+            if str(path) in unmanaged:
+                log.warning(
+                    'Keeping %s, which is also used by %s', 
+                    path,
+                    ', '.join(unmanaged[str(path)])
+                )
+                continue
+            replacements[path] = keep
+    
+    if dry_run or not replacements:
+        return replacements
+    
+    with changeset.transaction():
+        files:dict = {}
+        for path, keep in replacements.items():
+            log.info('Replacing keyring %s with %s', path, keep)
+            for source in users.get(str(path), []):
+                source.signed_by = str(keep)
+                source.load_key()
+                files[source.file.path] = source.file
+            
+            key = util.keys.pop(str(path), None)
+            if key is None:
+                key = SourceKey()
+                key.reset_path(path=path)
+            key.delete_key()
+        
+        for file in files.values():
+            file.save()
+    return replacements
+
+def _find_unmanaged_keyring_users() -> dict:
+    """Find the keyrings used by apt source files which weren't loaded.
+
+    This covers sources.list, which RepoLib doesn't manage, and any files in 
+    util.SOURCES_DIR which failed to load.
+
+    Returns: dict
+        The names of the files using each keyring path
+    """
+    sources_dir = Path(util.SOURCES_DIR)
+    files:list = [sources_dir.parent / 'sources.list']
+    for file in sorted(sources_dir.glob('*')):
+        if file.suffix in ('.sources', '.list') and file.name not in util.files:
+            files.append(file)
+    
+    found:dict = {}
+    for file in files:
+        try:
+            contents = file.read_text(errors='replace')
+        except OSError:
+            continue
+        for match in SIGNED_BY_RE.finditer(contents):
+            value = match.group('option') or match.group('field')
+            for path in value.split(','):
+                if path.startswith('/'):
+                    found.setdefault(path, []).append(str(file))
+    return found
+
+def registry_to_bytes() -> bytes:
+    """Serialize all of the loaded sources, files and errors.
+
+    All files share a single string table, so values repeated across files are 
+    only stored once.
+
+    Returns: bytes
+        The serialized registry, see :mod:`repolib.serialize`
+    """
+    table = serialize.StringTable()
+    files:list = []
+    for name, sourcefile in tuple(util.files.items()):
+        files.append((table.add(str(name)), sourcefile._pack(table)))
+    errors:list = []
+    for name, error in tuple(util.errors.items()):
+        errors.append((table.add(str(name)), table.add(str(error))))
+    return serialize.pack(
+        serialize.KIND_REGISTRY, table, (tuple(files), tuple(errors))
+    )
+
+def registry_from_bytes(data:bytes) -> None:
+    """Replace the loaded sources with ones serialized by registry_to_bytes().
+
+    This is used in place of load_all_sources() when the sources were already
+    parsed elsewhere. Nothing is read from disk except signing keys.
+
+    Arguments:
+        data(bytes): The serialized registry
+    """
+    try:
+        serialize.load(data, serialize.KIND_REGISTRY, _load_registry)
+    except serialize.SerializationError:
+        # Don't leave part of a corrupt registry loaded
+        _clear_registry()
+        raise
+
+def _clear_registry() -> None:
+    """Remove all of the loaded sources, files, keys and errors."""
+    util.sources.clear()
+    util.files.clear()
+    util.keys.clear()
+    util.errors.clear()
+    util.idents.clear()
+
+def _load_registry(strings:tuple, payload:tuple) -> None:
+    """Replace the loaded sources with those in a registry payload."""
+    files, errors = payload
+    _clear_registry()
+
+    for name, file_payload in files:
+        sourcefile = SourceFile._unpack(strings, file_payload)
+        util.files[strings[name]] = sourcefile
+        for source in sourcefile.sources:
+            util.idents.reserve(source.ident)
             util.sources[source.ident] = source
+    
+    for name, message in errors:
+        util.errors[strings[name]] = SourceFileError(strings[message])
@@ -0,0 +1,44 @@
+#!/usr/bin/python3
+
+"""
+Copyright (c) 2022, Ian Santopietro
+All rights reserved.
+
+This file is part of RepoLib.
+
+RepoLib is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RepoLib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
+
+Shared fixtures for the unit tests.
+"""
+
+import unittest
+
+from .. import file, util, source
+
+class SourceFileTestCase(unittest.TestCase):
+    """Sets up a single test source, in a file which isn't saved yet."""
+
+    def setUp(self):
+        util.set_testing()
+        self.source = source.Source()
+        self.source.ident = 'test'
+        self.source.name = 'Test Source'
+        self.source.enabled = True
+        self.source.types = [util.SourceType.BINARY]
+        self.source.uris = ['http://example.com/ubuntu']
+        self.source.suites = ['suite']
+        self.source.components = ['main']
+        self.file = file.SourceFile(name=self.source.ident)
+        self.file.add_source(self.source)
+        self.source.file = self.file
@@ -0,0 +1,43 @@
+#!/usr/bin/python3
+
+"""
+Copyright (c) 2022, Ian Santopietro
+All rights reserved.
+
+This file is part of RepoLib.
+
+RepoLib is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RepoLib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+
+from .. import asyncclient, changeset, privileged
+from .common import SourceFileTestCase
+
+class AsyncClientTestCase(SourceFileTestCase):
+    def test_async_client(self):
+        client = asyncclient.AsyncClient(timeout=5)
+
+        changes = changeset.ChangeSet()
+        changes.add_file(self.file)
+        self.file.path.unlink(missing_ok=True)
+        asyncio.run(client.commit(changes))
+        self.assertEqual(self.file.path.read_text(), self.file.output)
+
+        privileged.set_enabled(False)
+        try:
+            with self.assertRaises(privileged.PrivilegedError):
+                asyncio.run(client.delete_source_file(self.file.path.name))
+        finally:
+            privileged.set_enabled(True)
@@ -0,0 +1,40 @@
+#!/usr/bin/python3
+
+"""
+Copyright (c) 2022, Ian Santopietro
+All rights reserved.
+
+This file is part of RepoLib.
+
+RepoLib is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RepoLib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from .. import changeset
+from .common import SourceFileTestCase
+
+class ChangeSetTestCase(SourceFileTestCase):
+    def test_transaction(self):
+        self.file.path.unlink(missing_ok=True)
+        with self.assertRaises(RuntimeError):
+            with changeset.transaction():
+                self.file.save()
+                raise RuntimeError('Abort')
+        self.assertFalse(self.file.path.exists())
+
+        with changeset.transaction() as changes:
+            self.file.save()
+            self.file.save()
+            self.assertFalse(self.file.path.exists())
+            self.assertEqual(len(changes.get_changes()), 1)
+        self.assertEqual(self.file.path.read_text(), self.file.output)
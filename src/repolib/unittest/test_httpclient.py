@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+
+"""
+Copyright (c) 2022, Ian Santopietro
+All rights reserved.
+
+This file is part of RepoLib.
+
+RepoLib is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RepoLib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import http.server
+import threading
+import time
+import unittest
+
+from .. import httpclient
+
+BODY = b'key data\n' * 100
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.path)
+        server.ports.add(self.client_address[1])
+
+        if self.path.endswith('/flaky') and len(server.requests) < 3:
+            self.send_error(503)
+            return
+        if self.path.endswith('/nolocation'):
+            self.send_response(302)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path.endswith('/redirect'):
+            self.send_response(302)
+            self.send_header('Location', '/key.asc')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path.endswith('/hang'):
+            time.sleep(2)
+        if self.path.endswith('/missing'):
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+class HTTPClientTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(
+            ('127.0.0.1', 0), StandInHandler
+        )
+        self.server.daemon_threads = True
+        self.server.requests = []
+        self.server.ports = set()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        self.client = httpclient.HTTPClient(backoff=0.01, proxies={})
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_keep_alive(self):
+        for _ in range(3):
+            self.assertEqual(self.client.get(f'{self.url}/key.asc'), BODY)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(len(self.server.ports), 1)
+
+    def test_retry(self):
+        self.assertEqual(self.client.get(f'{self.url}/flaky'), BODY)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_status_error(self):
+        with self.assertRaises(httpclient.DownloadError) as context:
+            self.client.get(f'{self.url}/missing')
+        self.assertEqual(context.exception.status, 404)
+        # Not retried
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_redirect(self):
+        self.assertEqual(self.client.get(f'{self.url}/redirect'), BODY)
+        self.assertEqual(self.server.requests, ['/redirect', '/key.asc'])
+
+    def test_redirect_without_location(self):
+        with self.assertRaises(httpclient.DownloadError) as context:
+            self.client.get(f'{self.url}/nolocation')
+        self.assertEqual(context.exception.status, 302)
+        self.assertEqual(self.server.requests, ['/nolocation'])
+
+    def test_max_size(self):
+        with self.assertRaises(httpclient.DownloadError):
+            self.client.get(f'{self.url}/key.asc', max_size=100)
+
+    def test_read_timeout(self):
+        client = httpclient.HTTPClient(read_timeout=0.2, retries=0, proxies={})
+        start = time.monotonic()
+        with self.assertRaises(httpclient.ConnectError):
+            client.get(f'{self.url}/hang')
+        self.assertLess(time.monotonic() - start, 1.5)
+
+    def test_deadline(self):
+        start = time.monotonic()
+        with self.assertRaises(httpclient.DownloadError):
+            self.client.get(f'{self.url}/hang', timeout=0.3)
+        self.assertLess(time.monotonic() - start, 1.5)
+
+    def test_stop(self):
+        stop = threading.Event()
+        stop.set()
+        with self.assertRaises(httpclient.DownloadError):
+            self.client.get(f'{self.url}/key.asc', stop=stop)
+        self.assertEqual(self.server.requests, [])
+
+    def test_no_time_left(self):
+        with self.assertRaises(httpclient.DownloadError):
+            self.client.get(f'{self.url}/key.asc', timeout=0)
+        self.assertEqual(self.server.requests, [])
+
+    def test_proxy(self):
+        client = httpclient.HTTPClient(proxies={'http': self.url})
+        self.assertEqual(client.get('http://keys.example.com/key.asc'), BODY)
+        self.assertEqual(
+            self.server.requests, ['http://keys.example.com/key.asc']
+        )
+        client.close()
@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+
+"""
+Copyright (c) 2022, Ian Santopietro
+All rights reserved.
+
+This file is part of RepoLib.
+
+RepoLib is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RepoLib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import unittest
+
+from pathlib import Path
+
+from .. import util, system
+
+class IdentTestCase(unittest.TestCase):
+    def setUp(self):
+        self.idents = util.IdentAllocator()
+
+    def test_allocate_free(self):
+        self.assertEqual(self.idents.allocate('example'), 'example')
+        self.assertIn('example', self.idents)
+    
+    def test_allocate_collision(self):
+        self.idents.allocate('example')
+        self.assertEqual(self.idents.allocate('example'), 'example-1')
+        self.assertEqual(self.idents.allocate('example'), 'example-2')
+    
+    def test_allocate_skips_reserved(self):
+        self.idents.allocate('example')
+        self.assertTrue(self.idents.reserve('example-1'))
+        self.assertEqual(self.idents.allocate('example'), 'example-2')
+    
+    def test_canonical(self):
+        self.assertEqual(
+            self.idents.canonical('example.com/ubuntu'), 'example-com_ubuntu'
+        )
+        # Free idents are kept exactly, and only scrubbed on a collision
+        self.assertEqual(self.idents.allocate('my.repo'), 'my.repo')
+        self.assertEqual(self.idents.allocate('my.repo'), 'my-repo-1')
+        self.assertEqual(self.idents.allocate('my-repo'), 'my-repo')
+    
+    def test_release(self):
+        self.idents.allocate('example')
+        self.idents.release('example')
+        self.assertNotIn('example', self.idents)
+        self.assertEqual(self.idents.allocate('example'), 'example')
+    
+    def test_clear(self):
+        self.idents.allocate('example')
+        self.idents.allocate('example')
+        self.idents.clear()
+        self.assertEqual(self.idents.allocate('example'), 'example')
+        self.assertEqual(self.idents.allocate('example'), 'example-1')
+
+    def test_load_keeps_idents(self):
+        util.set_testing()
+        sources_dir = Path(util.SOURCES_DIR)
+        sources_dir.mkdir(parents=True, exist_ok=True)
+        for name in ('first', 'second'):
+            (sources_dir / f'{name}.sources').write_text(
+                f'X-Repolib-ID: my.repo\nX-Repolib-Name: {name}\nEnabled: yes\n'
+                'Types: deb\nURIs: http://example.com/\nSuites: jammy\n'
+                'Components: main\n'
+            )
+        system.load_all_sources()
+        self.assertEqual(sorted(util.sources), ['my-repo-1', 'my.repo'])
+        self.assertEqual(util.sources['my.repo'].name, 'first')
+
+        # New sources don't take the idents or file names already in use
+        self.assertEqual(system.allocate_ident('my.repo'), 'my-repo-2')
+        self.assertEqual(system.allocate_ident('second'), 'second-1')
+        self.assertEqual(system.allocate_ident('third'), 'third')
@@ -20,10 +20,17 @@ You should have received a copy of the GNU Lesser General Public License
 along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+import http.server
+import shutil
+import threading
+import time
 import unittest
 
-from ..key import SourceKey
-from .. import util, system
+from pathlib import Path
+
+from ..key import SourceKey, find_identical_keyrings
+from .. import cache, openpgp, util, system
+from .. import key as key_module
 from .. import set_testing
 
 # System76 Signing PubKey, for test import
@@ -78,6 +85,10 @@ class KeyTestCase(unittest.TestCase):
         set_testing()
         self.key_data = KEY_DATA
         self.keys_dir = util.KEYS_DIR
+        # Each test gets its own testing root, removed when it finishes
+        self.addCleanup(
+            shutil.rmtree, self.keys_dir.parents[2], ignore_errors=True
+        )
         self.key_id = '204DD8AEC33A7AFF'
         self.key_uids = ['Pop OS (ISO Signing Key) <info@system76.com>']
         self.key_length = '4096'
@@ -140,3 +151,334 @@ class KeyTestCase(unittest.TestCase):
         key_load.delete_key()
 
         self.assertFalse(key_load.path.exists())
+
+    def test_dirty(self):
+        key_path = self.keys_dir / 'popdev-archive-keyring.gpg'
+        if key_path.exists():
+            key_path.unlink()
+
+        key_save = SourceKey(name='popdev')
+        self.assertFalse(key_save.dirty)
+        key_save.load_key_data(ascii=self.key_data)
+        self.assertTrue(key_save.dirty)
+        key_save.save_gpg()
+        self.assertFalse(key_save.dirty)
+
+        key_load = SourceKey()
+        key_load.reset_path(name='popdev')
+        key_load.load_key_data(ascii=self.key_data)
+        self.assertFalse(key_load.dirty)
+
+    def test_lazy_gpg(self):
+        key_save = SourceKey(name='popdev')
+        key_save.load_key_data(ascii=self.key_data)
+        key_save.save_gpg()
+        key_save.tmp_path.unlink()
+
+        key_load = SourceKey()
+        key_load.reset_path(path=str(key_save.path))
+        self.assertIsNone(key_load._gpg)
+        self.assertFalse(key_load.tmp_path.exists())
+
+        key_dict = key_load.gpg.list_keys()[0]
+        self.assertTrue(key_load.tmp_path.exists())
+        self.assertEqual(key_dict['keyid'], self.key_id)
+
+    def test_openpgp(self):
+        keys = openpgp.read_keys(self.key_data)
+        self.assertEqual(len(keys), 1)
+        key_dict = keys[0]
+        self.assertEqual(key_dict['keyid'], self.key_id)
+        self.assertEqual(key_dict['uids'], self.key_uids)
+        self.assertEqual(key_dict['length'], self.key_length)
+        self.assertEqual(key_dict['date'], self.key_date)
+        self.assertEqual(
+            key_dict['fingerprint'], '63C46DF0140D738961429F4E204DD8AEC33A7AFF'
+        )
+        self.assertEqual(key_dict['expires'], '')
+        self.assertEqual(key_dict['algo'], '1')
+        self.assertEqual(key_dict['cap'], 'scESC')
+        self.assertEqual(key_dict['subkeys'][0][:2], ['49F26BFD279696B5', 'e'])
+
+        binary = openpgp.dearmor(self.key_data)
+        self.assertEqual(openpgp.read_keys(binary), keys)
+
+        with self.assertRaises(openpgp.OpenPGPError):
+            openpgp.read_keys(b'not a keyring')
+
+    def test_native_import(self):
+        key = SourceKey(name='native')
+        key.tmp_path.unlink(missing_ok=True)
+        key.load_key_data(ascii=self.key_data)
+        self.assertIsNone(key._gpg)
+        self.assertEqual(key.tmp_path.read_bytes(), openpgp.dearmor(self.key_data))
+        self.assertEqual(key.gpg.list_keys()[0]['keyid'], self.key_id)
+
+        # The armor checksum is checked
+        self.assertEqual(openpgp.crc24(b''), 0xb704ce)
+        corrupted = self.key_data.replace('=NL3f', '=NL3g')
+        with self.assertRaises(openpgp.OpenPGPError):
+            openpgp.public_keyring(corrupted)
+
+        # Data with anything other than public keys is left to gpg
+        with self.assertRaises(openpgp.OpenPGPError):
+            openpgp.public_keyring(b'\x95\x01\x00' + b'\x00' * 256)
+
+    def test_list_keys(self):
+        key = SourceKey(name='popdev')
+        key.load_key_data(ascii=self.key_data)
+        self.assertEqual(key.list_keys()[0]['keyid'], self.key_id)
+
+    def test_key_info_cache(self):
+        key = SourceKey(name='popdev')
+        key.load_key_data(ascii=self.key_data)
+        data = key.tmp_path.read_bytes()
+        self.assertIsNone(cache.get_key_info(data))
+
+        keys = key.list_keys()
+        self.assertEqual(cache.get_key_info(data), keys)
+        self.assertIsNone(cache.get_key_info(data + b'\0'))
+
+    def test_all_key_info(self):
+        key = SourceKey(name='popdev')
+        key.path.unlink(missing_ok=True)
+        key.load_key_data(ascii=self.key_data)
+        key.save_gpg()
+
+        key_info = system.get_all_key_info()
+        entry = key_info[str(key.path)]
+        self.assertEqual(entry['error'], '')
+        self.assertEqual(entry['sources'], [])
+        self.assertEqual(entry['keys'][0]['keyid'], self.key_id)
+
+    def test_identical_keyrings(self):
+        key = SourceKey(name='popdev')
+        key.path.unlink(missing_ok=True)
+        key.load_key_data(ascii=self.key_data)
+        key.save_gpg()
+        copy_path = self.keys_dir / 'vendor-archive-keyring.gpg'
+        copy_path.write_bytes(key.path.read_bytes())
+
+        new_key = SourceKey(name='vendor2')
+        new_key.load_key_data(ascii=self.key_data)
+        self.assertTrue(new_key.use_identical())
+        self.assertEqual(new_key.path, key.path)
+        self.assertFalse(new_key.dirty)
+        self.assertEqual(
+            find_identical_keyrings(), [[key.path, copy_path]]
+        )
+
+        sources_dir = Path(util.SOURCES_DIR)
+        sources_dir.mkdir(parents=True, exist_ok=True)
+        for ident, path in (('one', key.path), ('two', copy_path), ('three', copy_path)):
+            (sources_dir / f'{ident}.sources').write_text(
+                f'X-Repolib-Name: {ident}\nEnabled: yes\nTypes: deb\n'
+                f'URIs: http://example.com/{ident}\nSuites: suite\n'
+                f'Components: main\nSigned-By: {path}\n'
+            )
+        system.load_all_sources()
+        self.assertEqual(
+            system.consolidate_keyrings(dry_run=True), {key.path: copy_path}
+        )
+        self.assertTrue(key.path.exists())
+
+        system.consolidate_keyrings()
+        self.assertFalse(key.path.exists())
+        self.assertEqual(find_identical_keyrings(), [])
+        self.assertIn(
+            f'Signed-By: {copy_path}', (sources_dir / 'one.sources').read_text()
+        )
+        system.load_all_sources()
+        self.assertEqual(util.sources['one'].signed_by, str(copy_path))
+
+        # Copies used by files RepoLib doesn't manage, or by nothing, are kept
+        copies = {}
+        for name in ('unused', 'listed', 'broken'):
+            copies[name] = self.keys_dir / f'{name}-archive-keyring.gpg'
+            copies[name].write_bytes(copy_path.read_bytes())
+        for ident in ('listed', 'broken'):
+            (sources_dir / f'{ident}-user.sources').write_text(
+                f'X-Repolib-Name: {ident}\nEnabled: yes\nTypes: deb\n'
+                f'URIs: http://example.com/{ident}\nSuites: suite\n'
+                f'Components: main\nSigned-By: {copies[ident]}\n'
+            )
+        (sources_dir.parent / 'sources.list').write_text(
+            f'deb [arch=amd64 signed-by={copies["listed"]}] '
+            'http://example.com/listed suite main\n'
+        )
+        (sources_dir / 'broken.sources').write_text(
+            f'X-Repolib-Name: broken\nSigned-By: {copies["broken"]}\n'
+        )
+        system.load_all_sources()
+        self.assertIn('broken.sources', util.errors)
+        self.assertEqual(system.consolidate_keyrings(), {})
+        for path in copies.values():
+            self.assertTrue(path.exists())
+
+    def test_load_many(self):
+        server, url = serve_key(self.key_data)
+        try:
+            good = SourceKey(name='good')
+            other = SourceKey(name='other')
+            missing = SourceKey(name='missing')
+            results = key_module.load_many_key_data([
+                (good, {'url': f'{url}/key.asc'}),
+                (other, {'url': f'{url}/key.asc'}),
+                (missing, {'url': f'{url}/missing.asc'}),
+            ], timeout=5)
+        finally:
+            server.shutdown()
+            server.server_close()
+        
+        self.assertIsNone(results[good])
+        self.assertIsNone(results[other])
+        self.assertIsNotNone(results[missing])
+        self.assertEqual(good.list_keys()[0]['keyid'], self.key_id)
+
+    def test_download_cache(self):
+        server, url = serve_key(self.key_data)
+        try:
+            data = key_module.download_key(url=f'{url}/key.asc')
+            data_again = key_module.download_key(url=f'{url}/key.asc')
+        finally:
+            server.shutdown()
+            server.server_close()
+        
+        self.assertEqual(server.requests, 1)
+        self.assertEqual(data, data_again)
+
+        # Indexed by the fingerprint of the downloaded key too
+        cache.set_offline()
+        try:
+            self.assertEqual(
+                key_module.download_key(
+                    fingerprint='0x63C46DF0140D738961429F4E204DD8AEC33A7AFF'
+                ),
+                data
+            )
+            with self.assertRaises(key_module.KeyFileError):
+                key_module.download_key(url=f'{url}/other.asc')
+        finally:
+            cache.set_offline(False)
+
+    def test_download_binary_key(self):
+        binary_data = openpgp.public_keyring(self.key_data)
+        server, url = serve_key(binary_data)
+        try:
+            data = key_module.download_key(url=f'{url}/key.asc')
+            data_again = key_module.download_key(url=f'{url}/key.asc')
+            key = SourceKey(name='binary')
+            key.load_key_data(url=f'{url}/key.asc')
+        finally:
+            server.shutdown()
+            server.server_close()
+        
+        self.assertEqual(data, binary_data)
+        self.assertEqual(data_again, binary_data)
+        self.assertEqual(server.requests, 1)
+        self.assertEqual(key.list_keys()[0]['keyid'], self.key_id)
+
+    def test_hedged_lookup(self):
+        slow, slow_url = serve_key(self.key_data, delay=2)
+        fast, fast_url = serve_key(self.key_data)
+        keyservers = [f'{slow_url}/', f'{fast_url}/']
+        try:
+            start = time.monotonic()
+            data = key_module.lookup_fingerprint(
+                '0x63C46DF0140D738961429F4E204DD8AEC33A7AFF',
+                keyservers=keyservers,
+                keypath='key.asc?search=',
+                timeout=5,
+                hedge_delay=0.1
+            )
+            self.assertLess(time.monotonic() - start, 1.5)
+            self.assertIn(b'PGP PUBLIC KEY BLOCK', data)
+
+            # The fast keyserver is tried first next time
+            latencies = cache.get_keyserver_latencies()
+            self.assertLess(latencies[keyservers[1]], latencies[keyservers[0]])
+            key_module.lookup_fingerprint(
+                self.key_id,
+                keyservers=keyservers,
+                keypath='key.asc?search=',
+                timeout=5,
+                hedge_delay=0.5
+            )
+            self.assertEqual(slow.requests, 1)
+
+            with self.assertRaises(key_module.KeyFileError):
+                key_module.lookup_fingerprint(
+                    'E6AC16572ED1AD6F96C7EBE01E5F8BBC5BEB10AE',
+                    keyservers=[f'{fast_url}/'],
+                    keypath='key.asc?search=',
+                    timeout=5
+                )
+        finally:
+            for server in (slow, fast):
+                server.shutdown()
+                server.server_close()
+
+    def test_hedged_lookup_stops(self):
+        failing, failing_url = serve_key(self.key_data, delay=0.3, status=503)
+        fast, fast_url = serve_key(self.key_data)
+        try:
+            key_module.lookup_fingerprint(
+                self.key_id,
+                keyservers=[f'{failing_url}/', f'{fast_url}/'],
+                keypath='key.asc?search=',
+                timeout=5,
+                hedge_delay=0.1
+            )
+            # The losing lookup gives up instead of retrying
+            time.sleep(1)
+            self.assertEqual(failing.requests, 1)
+
+            # No time left means no request at all
+            with self.assertRaises(key_module.KeyFileError):
+                key_module.lookup_fingerprint(
+                    self.key_id,
+                    keyservers=[f'{fast_url}/'],
+                    keypath='key.asc?search=',
+                    timeout=0
+                )
+            self.assertEqual(fast.requests, 1)
+        finally:
+            for server in (failing, fast):
+                server.shutdown()
+                server.server_close()
+
+def serve_key(key_data, delay:float = 0, status:int = 200) -> tuple:
+    """Serve key_data at /key.asc from a local HTTP server.
+
+    Arguments:
+        key_data(str|bytes): The key to serve, ASCII-armored or binary
+        delay(float): Seconds to wait before each response
+        status(int): An error status to send instead of the key
+
+    Returns: (HTTPServer, str)
+        The running server, with a count of requests, and its base URL
+    """
+    data = key_data.encode() if isinstance(key_data, str) else key_data
+    class KeyHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.server.requests += 1
+            time.sleep(delay)
+            if status != 200:
+                self.send_error(status)
+                return
+            if self.path.split('?')[0] != '/key.asc':
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), KeyHandler)
+    server.requests = 0
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
@@ -20,12 +20,24 @@ You should have received a copy of the GNU Lesser General Public License
 along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+import shutil
 import unittest
 
+from ..key import SourceKey
 from ..shortcuts import popdev
 from .. import util
+from .test_key import KEY_DATA
 
 class PopdevTestCase(unittest.TestCase):
+    def setUp(self):
+        # Provide the popdev key so the shortcut doesn't download it
+        util.set_testing()
+        self.addCleanup(
+            shutil.rmtree, util.KEYS_DIR.parents[2], ignore_errors=True
+        )
+        key = SourceKey(name='popdev')
+        key.load_key_data(ascii=KEY_DATA)
+        key.save_gpg()
     
     def test_ppa(self):
         source = popdev.PopdevSource()
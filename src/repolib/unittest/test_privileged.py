@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+
+"""
+Copyright (c) 2022, Ian Santopietro
+All rights reserved.
+
+This file is part of RepoLib.
+
+RepoLib is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RepoLib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import contextlib
+import io
+import threading
+import time
+import types
+import unittest
+
+from unittest import mock
+
+from .. import changeset, privileged
+
+class PrivilegedTestCase(unittest.TestCase):
+    def report(self, dbus_name:str) -> tuple:
+        err = privileged.PrivilegedError(
+            'Privileged call exit failed: Something went wrong', 
+            dbus_name=dbus_name
+        )
+        output = io.StringIO()
+        with self.assertLogs(privileged.log, 'CRITICAL') as logs:
+            with contextlib.redirect_stdout(output):
+                privileged.report(err)
+        return ' '.join(logs.output), output.getvalue()
+
+    def test_report(self):
+        logs, output = self.report(privileged.SERVICE_UNKNOWN)
+        self.assertIn('DBus service not found', logs)
+        self.assertIn('sudo', output)
+
+        logs, output = self.report('org.freedesktop.DBus.Error.AccessDenied')
+        self.assertIn('refused', logs)
+        self.assertIn('Permission denied', output)
+
+        logs, output = self.report('org.pop_os.repolib.RepolibException')
+        self.assertIn('Something went wrong', logs)
+        self.assertNotIn('not found', logs)
+        self.assertEqual(output, '')
+
+    def test_privileged_disabled(self):
+        privileged.set_enabled(False)
+        try:
+            with self.assertRaises(privileged.PrivilegedError):
+                privileged.call('exit')
+            changes = [(changeset.WRITE_SOURCE, 'test.sources', 'contents')]
+            self.assertFalse(changeset.apply_changes_privileged(changes))
+        finally:
+            privileged.set_enabled(True)
+
+    def test_shared_proxy(self):
+        proxies:list = []
+
+        def get_object(bus_name, object_path):
+            # Connecting is slow enough for other threads to get here too
+            time.sleep(0.05)
+            proxies.append(object())
+            return proxies[-1]
+
+        bus = types.SimpleNamespace(get_object=get_object)
+        stand_in_dbus = types.SimpleNamespace(SystemBus=lambda: bus)
+        results:list = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(privileged.get_proxy())
+            )
+            for _ in range(8)
+        ]
+        try:
+            with mock.patch.object(privileged, 'dbus', stand_in_dbus):
+                privileged.set_enabled(True)
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+        finally:
+            # Back to the real dbus module, or none
+            privileged.set_enabled(True)
+        
+        self.assertEqual(len(proxies), 1)
+        self.assertEqual(results, proxies * 8)
@@ -0,0 +1,416 @@
+#!/usr/bin/python3
+
+"""
+Copyright (c) 2022, Ian Santopietro
+All rights reserved.
+
+This file is part of RepoLib.
+
+RepoLib is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RepoLib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import importlib.util
+import sys
+import threading
+import time
+import types
+import unittest
+
+from pathlib import Path
+from unittest import mock
+
+from .. import util
+from ..file import SourceFile
+
+SERVICE_PATH = Path(__file__).parents[3] / 'data' / 'service.py'
+
+SOURCE_DATA = (
+    'X-Repolib-Name: Example\n'
+    'Enabled: yes\n'
+    'Types: deb\n'
+    'URIs: http://example.com/ubuntu\n'
+    'Suites: jammy\n'
+    'Components: main\n'
+    'Signed-By: /usr/share/keyrings/example-archive-keyring.gpg\n'
+)
+
+SYSTEM_DATA = (
+    'X-Repolib-Name: Pop_OS System Sources\n'
+    'Enabled: yes\n'
+    'Types: deb\n'
+    'URIs: http://apt.pop-os.org/ubuntu\n'
+    'Suites: jammy\n'
+    'Components: main\n'
+)
+
+class StandInConnection:
+    """Accepts signal receivers without a bus."""
+
+    def add_signal_receiver(self, *args, **kwargs):
+        pass
+
+class StandInMonitor:
+    """Records the handler for file changes."""
+
+    def connect(self, signal, handler):
+        self.handler = handler
+
+def _decorator(*args, **kwargs):
+    return lambda func: func
+
+def stand_in_modules() -> dict:
+    """Build enough of dbus and gi to import the service without a bus."""
+    dbus = types.ModuleType('dbus')
+    dbus.DBusException = type('DBusException', (Exception,), {})
+    dbus.ByteArray = bytes
+    dbus.Interface = lambda obj, interface: obj
+    dbus.UInt32 = dbus.UInt64 = lambda value, variant_level=0: value
+
+    dbus_service = types.ModuleType('dbus.service')
+    dbus_service.Object = type(
+        'Object', (), {'__init__': lambda self, *args, **kwargs: None}
+    )
+    dbus_service.method = _decorator
+    dbus_service.signal = _decorator
+    dbus.service = dbus_service
+    dbus_mainloop = types.ModuleType('dbus.mainloop')
+    dbus_mainloop.glib = types.ModuleType('dbus.mainloop.glib')
+    dbus.mainloop = dbus_mainloop
+
+    timeouts:list = []
+    idles:list = []
+    gi = types.ModuleType('gi')
+    repository = types.ModuleType('gi.repository')
+    repository.GObject = types.SimpleNamespace()
+    repository.GLib = types.SimpleNamespace(
+        timeout_add=lambda delay, func: timeouts.append(func) or len(timeouts),
+        source_remove=lambda timeout: None,
+        idle_add=lambda func, *args: idles.append((func, args)),
+        timeouts=timeouts,
+        idles=idles,
+    )
+    repository.Gio = types.SimpleNamespace(
+        File=types.SimpleNamespace(
+            new_for_path=lambda path: types.SimpleNamespace(
+                monitor_directory=lambda flags, cancellable: StandInMonitor()
+            )
+        ),
+        FileMonitorFlags=types.SimpleNamespace(NONE=0),
+    )
+    gi.repository = repository
+
+    return {
+        'dbus': dbus,
+        'dbus.service': dbus_service,
+        'dbus.mainloop': dbus_mainloop,
+        'dbus.mainloop.glib': dbus_mainloop.glib,
+        'gi': gi,
+        'gi.repository': repository,
+    }
+
+class ServiceTestCase(unittest.TestCase):
+    def setUp(self):
+        if not SERVICE_PATH.exists():
+            self.skipTest('The service is not in this tree')
+        util.set_testing()
+        sources_dir = Path(util.SOURCES_DIR)
+        sources_dir.mkdir(parents=True, exist_ok=True)
+        (sources_dir / 'example.sources').write_text(SOURCE_DATA)
+
+        with mock.patch.dict(sys.modules, stand_in_modules()):
+            spec = importlib.util.spec_from_file_location(
+                'repolib_service', SERVICE_PATH
+            )
+            self.service = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(self.service)
+
+        self.repo = self.service.Repo(StandInConnection(), '/Repo')
+        self.changed:list = []
+        self.repo.SourcesChanged = self.changed.append
+
+    def test_read_methods(self):
+        self.assertTrue(self.repo.get_registry())
+        self.assertEqual(self.repo.list_sources(), [('example', 'Example')])
+        self.assertIn('example', self.repo.show_source('example'))
+        self.assertEqual(self.repo.GetSources()[0][:3], ('example', 'Example', True))
+        self.assertEqual(
+            self.repo.GetSource('example')[-1], 'example.sources'
+        )
+        self.assertEqual(
+            self.repo.GetKeys(),
+            [('/usr/share/keyrings/example-archive-keyring.gpg', ['example'])]
+        )
+        self.assertEqual(self.repo.GetErrors(), {})
+
+        with self.assertRaises(self.service.RepolibException):
+            self.repo.GetSource('missing')
+
+    def test_change_monitor(self):
+        self.repo.list_sources()
+        (Path(util.SOURCES_DIR) / 'example.sources').write_text(
+            SOURCE_DATA.replace('Example', 'Changed Name')
+        )
+        self.repo.monitor.handler(self.repo.monitor, None, None, 0)
+        timeouts = self.service.GLib.timeouts
+        self.assertEqual(len(timeouts), 1)
+        self.assertFalse(timeouts[0]())
+        self.assertEqual(self.changed, [['example']])
+        self.assertEqual(self.repo.list_sources(), [('example', 'Changed Name')])
+
+    def test_read_during_change_delay(self):
+        self.repo.list_sources()
+        (Path(util.SOURCES_DIR) / 'example.sources').write_text(
+            SOURCE_DATA.replace('Example', 'Changed Name')
+        )
+        self.repo.monitor.handler(self.repo.monitor, None, None, 0)
+
+        # A read before the delay passes reloads, and must still signal
+        self.assertEqual(self.repo.list_sources(), [('example', 'Changed Name')])
+        self.assertEqual(self.changed, [['example']])
+        self.assertFalse(self.service.GLib.timeouts[0]())
+        self.assertEqual(self.changed, [['example']])
+
+    def test_modify_source(self):
+        self.repo.modify_source('example', {'name': 'Modified'})
+        self.assertIn(
+            'X-Repolib-Name: Modified',
+            (Path(util.SOURCES_DIR) / 'example.sources').read_text()
+        )
+        self.assertEqual(self.repo.list_sources(), [('example', 'Modified')])
+        self.assertEqual(self.changed, [['example']])
+
+
+    def test_modify_source_failed(self):
+        self.repo.list_sources()
+        with mock.patch.object(
+            SourceFile, 'save', side_effect=OSError('Read-only file system')
+        ):
+            with self.assertRaises(self.service.RepolibException):
+                self.repo.modify_source('example', {'name': 'Unsaved'})
+        # The unsaved edit is dropped when the sources are next read
+        self.assertEqual(self.repo.list_sources(), [('example', 'Example')])
+        self.assertEqual(self.changed, [])
+
+        with self.assertRaises(self.service.RepolibException):
+            self.repo.modify_source(
+                'example', {'name': 'Unsaved', 'ident': 'other'}
+            )
+        self.assertEqual(self.repo.list_sources(), [('example', 'Example')])
+
+    def test_system_toggles(self):
+        system_path = Path(util.SOURCES_DIR) / 'system.sources'
+        system_path.write_text(SYSTEM_DATA)
+        self.repo.list_sources()
+
+        with mock.patch.object(
+            self.service.repolib, 'load_all_sources'
+        ) as load_all_sources:
+            self.assertTrue(self.repo.set_system_comp_enabled('universe', True))
+            self.assertTrue(
+                self.repo.set_system_suite_enabled('jammy-updates', True)
+            )
+            self.assertTrue(self.repo.set_system_source_code_enabled(True))
+            # Already enabled, so nothing is written
+            self.assertTrue(self.repo.set_system_comp_enabled('main', True))
+            system_source = self.repo.GetSource('system')
+        
+        load_all_sources.assert_not_called()
+        self.assertEqual(self.changed, [['system']] * 3)
+        self.assertEqual(system_source[1:7], (
+            'Pop_OS System Sources', True, ['deb', 'deb-src'],
+            ['http://apt.pop-os.org/ubuntu'], ['jammy', 'jammy-updates'],
+            ['main', 'universe'],
+        ))
+        contents = system_path.read_text()
+        self.assertIn('Components: main universe', contents)
+        self.assertIn('Suites: jammy jammy-updates', contents)
+        self.assertIn('Types: deb deb-src', contents)
+
+        # Changes made by others in the meantime are still noticed
+        (Path(util.SOURCES_DIR) / 'other.sources').write_text(SOURCE_DATA)
+        self.repo.set_system_comp_enabled('universe', False)
+        self.assertIn(('other', 'Example'), self.repo.list_sources())
+        self.assertEqual(self.changed[-2:], [['system'], ['other']])
+
+    def test_change_targets(self):
+        changeset = self.service.repolib.changeset
+        keys_dir = Path(util.KEYS_DIR)
+        keys_dir.mkdir(parents=True, exist_ok=True)
+        temp_key = Path(util.TEMP_DIR) / 'example-archive-keyring.gpg'
+        temp_key.write_bytes(b'key data')
+        outside = keys_dir.parents[2] / 'outside'
+        outside.write_text('not a key')
+        (keys_dir / 'link-archive-keyring.gpg').symlink_to(outside)
+
+        self.repo.apply_changes([(
+            changeset.WRITE_KEY, 
+            str(keys_dir / 'example-archive-keyring.gpg'), 
+            str(temp_key),
+        )])
+        self.assertEqual(
+            (keys_dir / 'example-archive-keyring.gpg').read_bytes(), b'key data'
+        )
+
+        rejected = [
+            # Writing or deleting outside the managed directories
+            (changeset.WRITE_KEY, str(outside), str(temp_key)),
+            (changeset.WRITE_KEY, str(keys_dir / '..' / 'outside'), str(temp_key)),
+            (changeset.WRITE_KEY, 'example-archive-keyring.gpg', str(temp_key)),
+            (changeset.DELETE_KEY, str(outside), ''),
+            (changeset.WRITE_PREFS, str(outside), 'Package: *'),
+            (changeset.DELETE_PREFS, str(outside), ''),
+            (changeset.WRITE_SOURCE, '../outside', 'Types: deb'),
+            # Through a symlink in the keys directory
+            (changeset.WRITE_KEY, str(keys_dir / 'link-archive-keyring.gpg'), str(temp_key)),
+            (changeset.DELETE_KEY, str(keys_dir / 'link-archive-keyring.gpg'), ''),
+            # Copying a key from anywhere but the temporary directory
+            (changeset.WRITE_KEY, str(keys_dir / 'passwd.gpg'), '/etc/passwd'),
+        ]
+        for change in rejected:
+            with self.subTest(change=change):
+                with self.assertRaises(self.service.RepolibException):
+                    self.repo.apply_changes([change])
+        self.assertEqual(outside.read_text(), 'not a key')
+        self.assertFalse((keys_dir / 'passwd.gpg').exists())
+
+        # The single change methods are checked the same way
+        with self.assertRaises(self.service.RepolibException):
+            self.repo.install_signing_key('/etc/passwd', str(keys_dir / 'passwd.gpg'))
+        with self.assertRaises(self.service.RepolibException):
+            self.repo.delete_signing_key(str(outside))
+        with self.assertRaises(self.service.RepolibException):
+            self.repo.output_prefs_to_disk(str(outside), 'Package: *')
+        self.assertEqual(outside.read_text(), 'not a key')
+
+    def _run_idle(self):
+        """Wait for a callback to be queued for the main loop, then run it."""
+        idles = self.service.GLib.idles
+        deadline = time.monotonic() + 5
+        while not idles and time.monotonic() < deadline:
+            time.sleep(0.01)
+        func, args = idles.pop(0)
+        func(*args)
+
+    def _add_source(self, line):
+        """Add a source, running the main loop until the reply is sent."""
+        replies:list = []
+        errors:list = []
+        self.repo.add_source(
+            line, reply_handler=replies.append, error_handler=errors.append
+        )
+        self._run_idle()
+        if errors:
+            raise errors[0]
+        return replies[0]
+
+    def test_add_source(self):
+        line = 'deb http://example.com/ubuntu jammy main'
+        first = self._add_source(line)
+        second = self._add_source(line)
+
+        # The second source gets its own ident and file
+        self.assertNotEqual(first, second)
+        sources_dir = Path(util.SOURCES_DIR)
+        for ident in (first, second):
+            self.assertEqual(len(list(sources_dir.glob(f'{ident}.*'))), 1)
+        idents = [ident for ident, name in self.repo.list_sources()]
+        self.assertEqual(sorted(idents), sorted(['example', first, second]))
+        self.assertEqual(self.changed, [[first], [second]])
+
+    def test_add_source_loads_in_thread(self):
+        loading = threading.Event()
+        finish = threading.Event()
+
+        def load_from_data(source, data):
+            loading.set()
+            finish.wait(5)
+            raise ValueError('Could not reach the server')
+
+        errors:list = []
+        with mock.patch.object(
+            self.service.repolib.Source, 'load_from_data', load_from_data
+        ):
+            self.repo.add_source(
+                'deb http://example.com/ubuntu jammy main',
+                reply_handler=None, error_handler=errors.append
+            )
+            # The call returned while the line is still loading
+            self.assertTrue(loading.wait(5))
+            self.assertEqual(self.service.GLib.idles, [])
+            finish.set()
+            self._run_idle()
+        self.assertIsInstance(errors[0], self.service.RepolibException)
+        self.assertEqual(self.changed, [])
+
+    def _authorize(self, sender=':1.42'):
+        self.repo._check_polkit_privilege(
+            sender, object(), 'org.pop_os.repolib.modifysources'
+        )
+
+    def _stand_in_polkit(self, start_times):
+        """Authorize every request, with the given process start times."""
+        self.repo.dbus_info = mock.Mock()
+        self.repo.dbus_info.GetConnectionUnixProcessID.return_value = 1234
+        self.repo.polkit = mock.Mock()
+        self.repo.polkit.CheckAuthorization.return_value = (True, False, {})
+        return mock.patch.object(
+            self.service.Repo, '_get_start_time', side_effect=start_times
+        )
+
+    def test_auth_cache_expiry(self):
+        self.repo.auth_cache_ttl = 10
+        with self._stand_in_polkit(lambda pid: 100):
+            with mock.patch.object(self.service.time, 'monotonic') as clock:
+                clock.return_value = 1000
+                self._authorize()
+                clock.return_value = 1009
+                self._authorize()
+                self.assertEqual(self.repo.polkit.CheckAuthorization.call_count, 1)
+
+                clock.return_value = 1011
+                self._authorize()
+                self.assertEqual(self.repo.polkit.CheckAuthorization.call_count, 2)
+
+            self.repo.auth_cache_ttl = 0
+            self._authorize()
+            self._authorize()
+            self.assertEqual(self.repo.polkit.CheckAuthorization.call_count, 4)
+
+    def test_auth_cache_disconnect(self):
+        with self._stand_in_polkit(lambda pid: 100):
+            self._authorize()
+            self._authorize(':1.43')
+            self.repo._on_name_owner_changed(':1.42', ':1.42', '')
+            self.assertNotIn(':1.42', self.repo.sender_pids)
+            self.assertEqual(
+                [key[0] for key in self.repo.auth_cache], [':1.43']
+            )
+
+            self._authorize()
+            self._authorize(':1.43')
+            self.assertEqual(self.repo.polkit.CheckAuthorization.call_count, 3)
+            lookups = self.repo.dbus_info.GetConnectionUnixProcessID
+            self.assertEqual(lookups.call_count, 3)
+
+    def test_auth_cache_reused_pid(self):
+        # Another process which got the same pid has a different start time
+        with self._stand_in_polkit([100, 100, 200]):
+            self._authorize()
+            self._authorize()
+            self.repo.polkit.CheckAuthorization.return_value = (False, False, {})
+            with mock.patch.object(self.service.Repo, '_log_in_file'):
+                with self.assertRaises(self.service.PermissionDeniedByPolicy):
+                    self._authorize()
+        self.assertEqual(self.repo.polkit.CheckAuthorization.call_count, 2)
+        self.assertEqual(len(self.repo.auth_cache), 1)
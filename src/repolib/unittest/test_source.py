@@ -20,9 +20,16 @@ You should have received a copy of the GNU Lesser General Public License
 along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+import gc
+import io
+import logging
+import marshal
+import tracemalloc
 import unittest
 
-from .. import file, util, source
+from pathlib import Path
+
+from .. import file, serialize, system, util, source
 
 class SourceTestCase(unittest.TestCase):
     def setUp(self): 
@@ -242,4 +249,183 @@ class SourceTestCase(unittest.TestCase):
         self.assertEqual(load_source.architectures, self.source.architectures)
         self.assertEqual(load_source.languages, self.source.languages)
         self.assertEqual(load_source.file.name, self.source.file.name)
-        
\ No newline at end of file
+        
+    def test_shared_values(self):
+        with util.sharing_values():
+            source_822 = source.Source()
+            source_822.load_from_data([
+                'X-Repolib-ID: shared-822',
+                'Types: deb',
+                'URIs: http://example.com/ubuntu',
+                'Suites: suite',
+                'Components: main contrib nonfree',
+            ])
+            source_legacy = source.Source()
+            source_legacy.load_from_data(
+                ['deb http://example.com/ubuntu suite main contrib nonfree']
+            )
+            self.assertIs(source_822.components[1], source_legacy.components[1])
+
+        self.assertIs(source_822['URIs'], source_legacy['URIs'])
+        self.assertIs(source_822['Components'], source_legacy['Components'])
+
+        # List properties must still be safe to modify
+        components = source_822.components
+        components.append('extra')
+        self.assertEqual(source_822.components, ['main', 'contrib', 'nonfree'])
+
+    def test_shared_values_memory(self):
+        sources_dir = Path(util.SOURCES_DIR)
+        sources_dir.mkdir(parents=True, exist_ok=True)
+        for file_num in range(20):
+            (sources_dir / f'shared-{file_num}.sources').write_text(''.join(
+                f'X-Repolib-ID: shared-{file_num}-{stanza}\n'
+                'Enabled: yes\n'
+                'Types: deb deb-src\n'
+                'URIs: http://archive.ubuntu.com/ubuntu\n'
+                'Suites: jammy jammy-updates jammy-security\n'
+                'Components: main restricted universe multiverse\n'
+                'Architectures: amd64 i386\n\n'
+                for stanza in range(5)
+            ))
+
+        def load_size() -> int:
+            util.sources.clear()
+            util.files.clear()
+            gc.collect()
+            # Captured log records would be counted too
+            logging.disable(logging.CRITICAL)
+            tracemalloc.start()
+            try:
+                system.load_all_sources()
+                gc.collect()
+                return tracemalloc.get_traced_memory()[0]
+            finally:
+                tracemalloc.stop()
+                logging.disable(logging.NOTSET)
+
+        util.INTERN_VALUES = False
+        try:
+            unshared = load_size()
+        finally:
+            util.INTERN_VALUES = True
+        shared = load_size()
+        self.assertEqual(len(util.sources), 100)
+        self.assertLess(shared, unshared * 0.95)
+
+    def test_snapshot(self):
+        snapshot_file = self.file.snapshot()
+        snapshot_source = snapshot_file.sources[0]
+
+        self.assertIsNot(snapshot_source, self.source)
+        self.assertIs(snapshot_source.file, snapshot_file)
+        self.assertIs(snapshot_source['URIs'], self.source['URIs'])
+        self.assertEqual(snapshot_file.output, self.file.output)
+        self.assertEqual(self.file.diff(snapshot_file), '')
+
+        snapshot_source.name = 'Changed Name'
+        snapshot_source.components = ['main']
+
+        self.assertEqual(self.source.name, 'Test Source')
+        self.assertEqual(
+            self.source.components, ['main', 'contrib', 'nonfree']
+        )
+        diff = self.file.diff(snapshot_file)
+        self.assertIn('-X-Repolib-Name: Test Source', diff)
+        self.assertIn('+X-Repolib-Name: Changed Name', diff)
+        self.assertIn('+Components: main\n', diff)
+
+    def test_serialize(self):
+        self.source.comments = ['A comment']
+        data = self.source.to_bytes()
+        load_source = source.Source.from_bytes(data)
+
+        self.assertEqual(load_source.deb822, self.source.deb822)
+        self.assertEqual(load_source.comments, ['A comment'])
+        self.assertEqual(load_source.uris, self.source.uris)
+
+        load_file = file.SourceFile.from_bytes(self.file.to_bytes())
+        self.assertEqual(load_file.path, self.file.path)
+        self.assertEqual(load_file.output, self.file.output)
+        self.assertIs(load_file.sources[0].file, load_file)
+
+        with self.assertRaises(util.RepoError):
+            file.SourceFile.from_bytes(data)
+
+    def test_serialize_corrupt(self):
+        data = self.source.to_bytes()
+        header = data[:serialize.HEADER_LENGTH]
+        table = serialize.StringTable()
+        table.add('X-Repolib-ID')
+        other_python = bytearray(header)
+        other_python[-1] = (other_python[-1] + 1) % 256
+        corrupt = [
+            b'',
+            serialize.MAGIC,
+            data[:serialize.HEADER_LENGTH + 4],
+            bytes(other_python) + data[serialize.HEADER_LENGTH:],
+            header + marshal.dumps('not a table'),
+            header + marshal.dumps(((1, 2), ((0, 1), (), False))),
+            # Indexes outside the string table
+            serialize.pack(serialize.KIND_SOURCE, table, ((0, 5), (), False)),
+            serialize.pack(serialize.KIND_SOURCE, table, (0,)),
+        ]
+        for bad_data in corrupt:
+            with self.subTest(data=bad_data):
+                with self.assertRaises(serialize.SerializationError):
+                    source.Source.from_bytes(bad_data)
+
+        system.load_all_sources()
+        registry = system.registry_to_bytes()
+        with self.assertRaises(serialize.SerializationError):
+            system.registry_from_bytes(registry[:-8])
+        self.assertEqual(util.sources, {})
+        self.assertEqual(util.files, {})
+
+    def test_save_unchanged(self):
+        self.file.save()
+        saved_stat = self.file.path.stat()
+        self.file.save()
+        self.assertEqual(self.file.path.stat().st_mtime_ns, saved_stat.st_mtime_ns)
+        self.assertEqual(self.file.path.stat().st_ino, saved_stat.st_ino)
+
+        self.source.name = 'Changed Name'
+        self.file.save()
+        self.assertNotEqual(self.file.path.stat().st_ino, saved_stat.st_ino)
+        self.assertIn('Changed Name', self.file.path.read_text())
+        leftovers = list(self.file.path.parent.glob('.*.tmp'))
+        self.assertEqual(leftovers, [])
+
+    def test_write_to(self):
+        file_string = (
+            '## Added/managed by repolib ##\n'
+            '#\n'
+            'X-Repolib-ID: test\n'
+            'X-Repolib-Name: Test Source\n'
+            'Enabled: yes\n'
+            'Types: deb deb-src\n'
+            'URIs: http://example.com/ubuntu http://example.com/mirror\n'
+            'Suites: suite suite-updates\n'
+            'Components: main contrib nonfree\n'
+            'Architectures: amd64 armel\n'
+            'Languages: en_US en_CA\n'
+        )
+        legacy_file_string = (
+            '## Added/managed by repolib ##\n'
+            '#\n'
+            'deb [arch=amd64,armel lang=en_US,en_CA] http://example.com/ubuntu suite main contrib nonfree  ## X-Repolib-Name: Test Legacy Source # X-Repolib-ID: test-legacy\n'
+        )
+        buffer = io.StringIO()
+        self.file.write_to(buffer)
+        self.assertEqual(buffer.getvalue(), file_string)
+
+        legacy_file = self.source_legacy.file
+        legacy_file.add_source(self.source_legacy)
+        buffer = io.StringIO()
+        legacy_file.write_to(buffer)
+        self.assertEqual(buffer.getvalue(), legacy_file_string)
+
+        buffer = io.StringIO()
+        self.file.write_to(buffer, 'ui')
+        self.assertEqual(buffer.getvalue(), f'\n\n{self.source.ui}\n')
+        self.assertNotIn('#', buffer.getvalue())
@@ -0,0 +1,35 @@
+#!/usr/bin/python3
+
+"""
+Copyright (c) 2022, Ian Santopietro
+All rights reserved.
+
+This file is part of RepoLib.
+
+RepoLib is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+RepoLib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from .. import system
+from .common import SourceFileTestCase
+
+class SystemTestCase(SourceFileTestCase):
+    def test_sources_stamp(self):
+        self.file.save()
+        stamp = system.get_sources_stamp()
+        self.assertEqual(stamp, system.get_sources_stamp())
+        self.assertIn(self.file.path.name, [entry[0] for entry in stamp])
+
+        self.source.name = 'A Longer Changed Name'
+        self.file.save()
+        self.assertNotEqual(stamp, system.get_sources_stamp())
@@ -21,7 +21,10 @@ along with RepoLib.  If not, see <https://www.gnu.org/licenses/>.
 """
 
 import atexit
+import contextlib
+import hashlib
 import logging
+import os
 import re
 import tempfile
 
@@ -30,11 +33,11 @@ from pathlib import Path
 from urllib.parse import urlparse
 from urllib import request, error
 
-import dbus
-
 SOURCES_DIR = Path('/etc/apt/sources.list.d')
 KEYS_DIR = Path('/etc/apt/keyrings/')
+PREFS_DIR = Path('/etc/apt/preferences.d')
 TESTING = False
+INTERN_VALUES = True
 KEYSERVER_QUERY_URL = 'http://keyserver.ubuntu.com/pks/lookup?op=get&search=0x'
 
 log = logging.getLogger(__name__)
@@ -176,6 +179,18 @@ PRETTY_PRINT = '\n    '
 _KEYS_TEMPDIR = tempfile.TemporaryDirectory()
 TEMP_DIR = Path(_KEYS_TEMPDIR.name)
 
+def _get_cache_dir() -> Path:
+    """Get the cache directory for the current user."""
+    if os.geteuid() == 0:
+        return SYSTEM_CACHE_DIR
+    cache_home = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(cache_home) / 'repolib'
+
+# Root (including the DBus service) writes to the system cache, which other
+# users can read from as well as their own.
+SYSTEM_CACHE_DIR = Path('/var/cache/repolib')
+CACHE_DIR = _get_cache_dir()
+
 options_re = re.compile(r'[^@.+]\[([^[]+.+)\]\ ')
 uri_re = re.compile(r'\w+:(\/?\/?)[^\s]+')
 
@@ -216,6 +231,9 @@ files:dict = {}
 keys:dict = {}
 errors:dict = {}
 
+# Field values shared between sources while loading, see sharing_values()
+_shared_values = None
+
 
 def scrub_filename(name: str = '') -> str:
     """ Clean up a string intended for a filename.
@@ -228,6 +246,147 @@ def scrub_filename(name: str = '') -> str:
     """
     return name.translate(CLEAN_CHARS)
 
+@contextlib.contextmanager
+def sharing_values():
+    """Share repeated field values between the sources loaded in this block.
+
+    Suites, components, URIs and options are repeated across many sources, so
+    while sources are loaded inside this block, each distinct value is stored
+    once and shared. The table of values is dropped when the block ends; the
+    sources keep sharing the values they already have.
+    """
+    global _shared_values
+    if _shared_values is not None:
+        # Already sharing values in an outer block
+        yield
+        return
+    _shared_values = {}
+    try:
+        yield
+    finally:
+        _shared_values = None
+
+def intern_value(value):
+    """Get the shared copy of a repeated field value.
+
+    Values are only shared inside a :func:`sharing_values` block. Elsewhere, 
+    and for non-string values, `value` is returned unchanged.
+
+    Arguments:
+        value(str): The value to intern
+
+    Returns: str
+        The shared copy of `value`
+    """
+    table = _shared_values
+    if INTERN_VALUES and table is not None and isinstance(value, str):
+        return table.setdefault(value, value)
+    return value
+
+def split_value(value:str) -> list:
+    """Split a space-separated field value into a list of shared words.
+
+    Arguments:
+        value(str): The field value to split
+
+    Returns: list
+        The words in `value`, as a new list which callers may modify
+    """
+    return [intern_value(word) for word in value.split()]
+
+class IdentAllocator:
+    """Hands out unique idents for a registry of sources.
+
+    Free idents are used exactly as given. When an ident is already in use, 
+    it is reduced to a canonical base (the scrubbed form used for file names)
+    and a counter is kept for each base, so the next free numbered suffix is
+    found without searching the registry again.
+
+    Attributes:
+        reserved(set): The idents which are currently in use
+        counters(dict): The next suffix number to try for each base ident
+    """
+
+    def __init__(self) -> None:
+        self.reserved:set = set()
+        self.counters:dict = {}
+        self._canonical:dict = {}
+
+    def __contains__(self, ident:str) -> bool:
+        return ident in self.reserved
+
+    def canonical(self, ident:str) -> str:
+        """Get the canonical base form of an ident.
+
+        Arguments:
+            ident(str): The ident to canonicalize
+        
+        Returns: str
+            The scrubbed ident
+        """
+        try:
+            return self._canonical[ident]
+        except KeyError:
+            base = scrub_filename(ident)
+            self._canonical[ident] = base
+            return base
+
+    def reserve(self, ident:str) -> bool:
+        """Reserve an exact ident.
+
+        Arguments:
+            ident(str): The ident to reserve
+        
+        Returns: bool
+            `True` if the ident was free and is now reserved, otherwise `False`
+        """
+        if ident in self.reserved:
+            return False
+        self.reserved.add(ident)
+        return True
+
+    def allocate(self, ident:str) -> str:
+        """Reserve and return a unique ident based on the given one.
+
+        If `ident` is free, it is used as-is. Otherwise the next free numbered
+        suffix for its canonical form is used (e.g. `example-1`).
+
+        Arguments:
+            ident(str): The preferred ident
+        
+        Returns: str
+            The unique ident which was reserved
+        """
+        if self.reserve(ident):
+            return ident
+
+        base = self.canonical(ident)
+        count:int = self.counters.get(base, 1)
+        candidate:str = f'{base}-{count}'
+        # Only loops if a numbered ident was reserved explicitly
+        while candidate in self.reserved:
+            count += 1
+            candidate = f'{base}-{count}'
+        self.counters[base] = count + 1
+        self.reserved.add(candidate)
+        return candidate
+
+    def release(self, ident:str) -> None:
+        """Release an ident so that it can be reserved again.
+
+        Arguments:
+            ident(str): The ident to release
+        """
+        self.reserved.discard(ident)
+
+    def clear(self) -> None:
+        """Release all idents and reset the counters."""
+        self.reserved.clear()
+        self.counters.clear()
+        self._canonical.clear()
+
+idents = IdentAllocator()
+
 def set_testing(testing:bool=True) -> None:
     """Sets Repolib in testing mode where changes will not be saved.
     
@@ -236,19 +395,91 @@ def set_testing(testing:bool=True) -> None:
             (Defaul: True)
     """
     global KEYS_DIR
+    global PREFS_DIR
     global SOURCES_DIR
+    global CACHE_DIR
+    global SYSTEM_CACHE_DIR
 
     testing_tempdir = tempfile.TemporaryDirectory()
 
     if not testing:
         KEYS_DIR = '/usr/share/keyrings'
         SOURCES_DIR = '/etc/apt/sources.list.d'
+        PREFS_DIR = Path('/etc/apt/preferences.d')
+        SYSTEM_CACHE_DIR = Path('/var/cache/repolib')
+        CACHE_DIR = _get_cache_dir()
         return
     
     testing_root = Path(testing_tempdir.name)
     KEYS_DIR = testing_root / 'usr' / 'share' / 'keyrings'
     SOURCES_DIR = testing_root / 'etc' / 'apt' / 'sources.list.d'
+    PREFS_DIR = testing_root / 'etc' / 'apt' / 'preferences.d'
+    SYSTEM_CACHE_DIR = testing_root / 'var' / 'cache' / 'repolib'
+    CACHE_DIR = SYSTEM_CACHE_DIR
+
 
+def atomic_write(path, contents, mode:int = 0o644) -> bool:
+    """Write a file atomically, unless it already has the given contents.
+
+    The existing file is compared with the new contents by size and SHA-256 
+    hash, and left untouched if they match. Otherwise the contents are written 
+    to a temporary file in the same directory, synced to disk and renamed over
+    the destination, so readers never see a partially-written file.
+
+    Arguments:
+        path(Path): The file to write
+        contents(str|bytes): The new contents for the file
+        mode(int): The permissions for a new file. Existing files keep their
+            current permissions. (Default: 0o644)
+    
+    Returns: bool
+        `True` if the file was written, `False` if it was already up to date
+    """
+    path = Path(path)
+    if isinstance(contents, str):
+        contents = contents.encode('utf-8')
+
+    try:
+        stat = path.stat()
+        mode = stat.st_mode & 0o7777
+        if stat.st_size == len(contents):
+            with open(path, mode='rb') as current_file:
+                current_hash = hashlib.sha256(current_file.read()).digest()
+            if current_hash == hashlib.sha256(contents).digest():
+                log.debug('%s is unchanged, not writing', path)
+                return False
+    except FileNotFoundError:
+        pass
+
+    tmp_fd, tmp_name = tempfile.mkstemp(
+        dir=path.parent, prefix=f'.{path.name}.', suffix='.tmp'
+    )
+    try:
+        with os.fdopen(tmp_fd, mode='wb') as tmp_file:
+            tmp_file.write(contents)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.chmod(tmp_name, mode)
+        os.replace(tmp_name, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except FileNotFoundError:
+            pass
+        raise
+
+    # Make sure the rename itself is on disk
+    try:
+        dir_fd = os.open(path.parent, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass
+
+    log.debug('Wrote %s', path)
+    return True
 
 def _cleanup_temsps() -> None:
     """Clean up our tempdir"""
@@ -258,9 +489,9 @@ def _cleanup_temsps() -> None:
 atexit.register(_cleanup_temsps)
 
 def dbus_quit():
-    bus = dbus.SystemBus()
-    privileged_object = bus.get_object('org.pop_os.repolib', '/Repo')
-    privileged_object.exit()
+    """Ask the privileged service to exit, if we connected to it."""
+    from . import privileged
+    privileged.exit_service()
 
 def compare_sources(source1, source2, excl_keys:list) -> bool:
     """Compare two sources based on arbitrary criteria.